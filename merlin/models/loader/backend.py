@@ -41,6 +41,10 @@ from merlin.models.loader.shuffle import _shuffle_df
 from merlin.schema import Tags
 
 
+# put in the queue of chunks once all the chunks were put (or when the loader is stopped)
+_END_OF_CHUNKS = object()
+
+
 def _num_steps(num_samples, step_size):
     return math.ceil(num_samples / step_size)
 
@@ -70,8 +74,15 @@ class ChunkQueue:
         self.put_wait = put_wait
         self.q_out = queue.Queue(qsize)
         self._stop_event = threading.Event()
+        self.epochs = epochs
         self.itr = dataloader._data_iter(epochs)
         self.dataloader = dataloader
+        self._rng = np.random.RandomState()
+        # a stream can't be read again: when it is stopped, the chunks not consumed yet
+        # and the transformed rows not batched yet are kept for the next iteration
+        self.streaming = getattr(dataloader.data, "is_streaming", False)
+        self.leftover = []
+        self.spill = None
 
     def __len__(self):
         return len(self.itr)
@@ -84,8 +95,27 @@ class ChunkQueue:
     def empty(self):
         return self.q_out.empty()
 
-    def get(self):
-        return self.q_out.get()
+    def get(self, timeout=None):
+        if self.leftover:
+            return self.leftover.pop(0)
+        return self.q_out.get(timeout=timeout)
+
+    def clear(self):
+        """Empties the queue, keeping the chunks of a stream in `leftover`."""
+        while True:
+            try:
+                packet = self.q_out.get_nowait()
+            except queue.Empty:
+                return
+            if self.streaming and isinstance(packet, tuple):
+                self.leftover.append(packet)
+
+    def wake_up(self):
+        """Ends the wait of a consumer blocked on `get`, once the loading thread stopped."""
+        try:
+            self.q_out.put_nowait(_END_OF_CHUNKS)
+        except queue.Full:
+            pass
 
     def put(self, packet):
         while True:
@@ -103,6 +133,9 @@ class ChunkQueue:
         """
         iterates through gpu_mem_frac size chunks of dataset
         and concatenates every `num_parts` of them.
+
+        Every transformed partition comes with the state of the transforms before it
+        was transformed (see `DataLoader.state_dict`).
         """
         current = []
         while True:
@@ -113,18 +146,63 @@ class ChunkQueue:
                     yield current
                 break
 
-            current.append(value)
+            if value is None:
+                # a streaming iterator waiting for new files flushes the partial chunk
+                if len(current) > 0:
+                    yield current
+                    current = []
+                continue
+            states = self.dataloader._transform_states()
+            current.append((self.dataloader._transform(value), states))
             if len(current) == self.num_parts:
                 yield current
                 current = []
 
     @annotate("chunk_logic", color="darkgreen", domain="nvt_python")
-    def chunk_logic(self, itr):
-        spill = None
-        for chunks in self.batch(itr):
+    def chunk_logic(self, itr, resume=None):
+        """Concatenates, shuffles and tensorizes the partitions yielded by `itr`.
+
+        Every chunk is put in the queue together with the state needed to rebuild it
+        (see `DataLoader.state_dict`): the number of partitions consumed before it,
+        the number of spilled rows carried over from those partitions and of partitions
+        they come from, the state of the transforms before these partitions and the
+        state of the RNG used to shuffle it. When `resume` is given, the first chunk
+        starts from the restored spill and RNG state and its already consumed rows are
+        dropped.
+        """
+        spill, parts_consumed, rows_to_skip = None, 0, 0
+        # transformed length and transforms state of the last partitions, to find
+        # the partitions of the spilled rows
+        history = []
+        if resume is not None:
+            spill = resume["spill"]
+            parts_consumed = resume["parts_consumed"]
+            rows_to_skip = resume["rows_consumed"]
+            history = resume["history"]
+            self._rng.set_state(resume["rng_state"])
+        if self.spill is not None:
+            spill, self.spill = self.spill, None
+
+        for parts in self.batch(itr):
             if self.stopped:
+                self._keep(spill, [part for part, _ in parts])
                 return
 
+            spill_rows = 0 if spill is None else len(spill)
+            spill_parts, transform_states = _spill_origin(history, spill_rows, parts[0][1])
+            state = {
+                "parts_consumed": parts_consumed,
+                "spill_rows": spill_rows,
+                "spill_parts": spill_parts,
+                "transform_states": transform_states,
+                "rng_state": self._rng.get_state(),
+                "rows_consumed": rows_to_skip,
+            }
+            parts_consumed += len(parts)
+            history = history[len(history) - spill_parts :]
+            history += [(len(part), states) for part, states in parts]
+            chunks = [part for part, _ in parts]
+
             if spill is not None and not spill.empty:
                 chunks.insert(0, spill)
 
@@ -132,40 +210,88 @@ class ChunkQueue:
             chunks.reset_index(drop=True, inplace=True)
             chunks, spill = self.get_batch_div_chunk(chunks, self.dataloader.batch_size)
             if self.shuffle:
-                chunks = _shuffle_df(chunks)
+                chunks = _shuffle_df(chunks, random_state=self._rng.randint(2 ** 31))
+            state["num_rows"] = len(chunks)
+            if rows_to_skip:
+                chunks = self._skip_rows(chunks, rows_to_skip)
+                rows_to_skip = 0
 
             if len(chunks) > 0:
                 chunks = self.dataloader.make_tensors(chunks, self.dataloader._use_nnz)
                 # put returns True if buffer is stopped before
                 # packet can be put in queue. Keeps us from
                 # freezing on a put on a full queue
-                if self.put(chunks):
+                if self.put((chunks, state)):
+                    self._keep(spill, [], chunks=(chunks, state))
                     return
             chunks = None
         # takes care final batch, which is less than batch size
         if not self.dataloader.drop_last and spill is not None and not spill.empty:
-            spill = self.dataloader.make_tensors(spill, self.dataloader._use_nnz)
-            self.put(spill)
+            spill_parts, transform_states = _spill_origin(
+                history, len(spill), self.dataloader._transform_states()
+            )
+            state = {
+                "parts_consumed": parts_consumed,
+                "spill_rows": len(spill),
+                "spill_parts": spill_parts,
+                "transform_states": transform_states,
+                "rng_state": self._rng.get_state(),
+                "rows_consumed": rows_to_skip,
+                "num_rows": len(spill),
+            }
+            if rows_to_skip:
+                spill = self._skip_rows(spill, rows_to_skip)
+            if not spill.empty:
+                spill = self.dataloader.make_tensors(spill, self.dataloader._use_nnz)
+                if self.put((spill, state)):
+                    self._keep(None, [], chunks=(spill, state))
+
+    def _keep(self, spill, parts, chunks=None):
+        """Keeps the rows of a stopped stream for the next iteration."""
+        if not self.streaming:
+            return
+        if chunks is not None:
+            self.leftover.append(chunks)
+        rows = [df for df in [spill] + parts if df is not None and not df.empty]
+        if rows:
+            self.spill = concat(rows)
+            self.spill.reset_index(drop=True, inplace=True)
+
+    @staticmethod
+    def _skip_rows(chunks, num_rows):
+        chunks = make_df(chunks.iloc[num_rows:])
+        chunks.reset_index(drop=True, inplace=True)
+        return chunks
 
     @annotate("load_chunks", color="darkgreen", domain="nvt_python")
-    def load_chunks(self, dev):
+    def load_chunks(self, dev, resume=None):
         try:
-            itr = iter(self.itr)
+            if resume is not None:
+                itr, resume = self.dataloader._seek(resume)
+            else:
+                # the partition order may have been re-shuffled since the last epoch
+                self.itr = self.dataloader._data_iter(self.epochs)
+                itr = iter(self.itr)
             if self.dataloader.device != "cpu":
                 with self.dataloader._get_device_ctx(dev):
-                    self.chunk_logic(itr)
+                    self.chunk_logic(itr, resume=resume)
             else:
-                self.chunk_logic(itr)
+                self.chunk_logic(itr, resume=resume)
         except Exception as e:  # pylint: disable=broad-except
             self.put(e)
+        else:
+            self.put(_END_OF_CHUNKS)
 
     # For when an iterator is stopped before iteration is complete.
     def stop(self):
         self._stop_event.set()
+        # streaming iterators may be waiting for new files
+        if hasattr(self.itr, "stop"):
+            self.itr.stop()
         # TODO: should we be clearing? I can imagine a world where
         # you want the thread to stop but still want to grab
         # data out of the buffer
-        self.q_out.queue.clear()
+        self.clear()
 
     def start(self):
         self._stop_event.clear()
@@ -182,6 +308,17 @@ class ChunkQueue:
         return chunks, spill
 
 
+def _spill_origin(history, spill_rows, next_states):
+    """Number of the last partitions of `history` holding the `spill_rows` spilled rows,
+    and the state of the transforms before the first of them (`next_states` if none)."""
+    num_parts, rows, states = 0, 0, next_states
+    for length, part_states in reversed(history):
+        if rows >= spill_rows:
+            break
+        num_parts, rows, states = num_parts + 1, rows + length, part_states
+    return num_parts, states
+
+
 def _get_dataset_schema(dataset):
     return dataset.schema if hasattr(dataset, "schema") else None
 
@@ -208,6 +345,7 @@ class DataLoader:
         sparse_names=None,
         sparse_max=None,
         sparse_as_dense=False,
+        transforms=None,
     ):
         self.data = dataset
         self.schema = _get_dataset_schema(dataset)
@@ -220,6 +358,7 @@ class DataLoader:
         self.sparse_as_dense = sparse_as_dense
         self.global_size = global_size or 1
         self.global_rank = global_rank or 0
+        self.transforms = transforms or []
         self._epochs = 1
 
         self.cat_names = cat_names or (
@@ -251,6 +390,8 @@ class DataLoader:
         self.__buff_len = None
         self._batch_itr = None
         self._workers = None
+        self._chunk_state = None
+        self._resume_state = None
 
     @property
     def _buff(self):
@@ -265,7 +406,12 @@ class DataLoader:
     def _buff_len(self):
         if self.__buff_len is None:
             # run once instead of every time len called
-            self.__buff_len = len(self._buff)
+            num_rows = len(self._buff)
+            for transform in self.transforms:
+                # transforms changing the number of rows can report it
+                if hasattr(transform, "output_rows"):
+                    num_rows = transform.output_rows(num_rows)
+            self.__buff_len = num_rows
         return self.__buff_len
 
     def epochs(self, epochs=1):
@@ -282,6 +428,14 @@ class DataLoader:
         self._epochs = epochs
 
     def __len__(self):
+        if getattr(self.data, "is_streaming", False):
+            # the number of rows of a stream is unknown
+            if self.data.steps_per_epoch is None:
+                raise TypeError(
+                    "A loader over a stream of files has no length, "
+                    "set `steps_per_epoch` of the dataset if needed."
+                )
+            return self.data.steps_per_epoch
         batches = _num_steps(self._buff_len, self.batch_size)
         if self.drop_last and self._buff_len % self.batch_size > 0:
             batches = batches - 1
@@ -303,7 +457,12 @@ class DataLoader:
                 t.join()
             # remove joined threads from list
             self._workers = None
-            self._buff.q_out.queue.clear()
+            if self._buff.streaming and self._batch_itr is not None:
+                # the batches left in the current chunk come first
+                self._buff.leftover.insert(0, (self._batch_itr, self._chunk_state))
+            self._buff.clear()
+            # a consumer waiting for a chunk stops iterating
+            self._buff.wake_up()
         self._batch_itr = None
 
     def _gather_indices_for_dev(self, dev):
@@ -334,15 +493,38 @@ class DataLoader:
         if self._buff.stopped:
             self._buff.start()
 
-        # shuffle partition indices to bring disparate
-        # parts of the dataset "close" to one another
-        if self.shuffle:
-            self._shuffle_indices()
+        # drops the wake-up of the consumers of the stopped iteration
+        self._buff.q_out.queue.clear()
+
+        resume, self._resume_state = self._resume_state, None
+        if resume is not None:
+            # partition order was restored by `load_state_dict`
+            self.num_rows_processed = resume["num_rows_processed"]
+            self._chunk_state = dict(resume["chunk"])
+        else:
+            if self.shuffle:
+                # shuffle partition indices to bring disparate
+                # parts of the dataset "close" to one another
+                self._shuffle_indices()
+            self._buff._rng.seed(np.random.randint(2 ** 31))
+            self._chunk_state = {
+                "parts_consumed": 0,
+                "spill_rows": 0,
+                "spill_parts": 0,
+                "transform_states": self._transform_states(),
+                "rng_state": self._buff._rng.get_state(),
+                "rows_consumed": 0,
+                "num_rows": 0,
+            }
 
         # build and start new threads for loading and
         # concatenating data
         self._workers = []
-        t = threading.Thread(target=self._buff.load_chunks, args=(self.device,))
+        t = threading.Thread(
+            target=self._buff.load_chunks,
+            args=(self.device,),
+            kwargs={"resume": resume["chunk"] if resume else None},
+        )
         t.daemon = True
         t.start()
         self._workers.append(t)
@@ -351,17 +533,126 @@ class DataLoader:
     def __next__(self):
         return self._get_next_batch()
 
-    def _data_iter(self, epochs):
-        indices = self._gather_indices_for_dev(0)
+    def _data_iter(self, epochs, indices=None):
+        if getattr(self.data, "is_streaming", False):
+            return self.data.to_iter(global_rank=self.global_rank, global_size=self.global_size)
+        if indices is None:
+            indices = self._gather_indices_for_dev(0)
         if hasattr(self.data, "to_iter"):
             return self.data.to_iter(indices=indices, epochs=epochs)
-        return DataFrameIter(self.data, epochs=epochs)
+        return DataFrameIter(self.data, indices=indices, epochs=epochs)
+
+    def state_dict(self):
+        """Returns the position of the loader in the current iteration.
+
+        The state contains the (shuffled) partition order, the number of rows
+        processed so far and the state of the chunk being consumed: how many
+        partitions were read before it, how many rows were spilled over into it,
+        the RNG state used to shuffle it, the state of the random transforms (e.g.
+        the RNG of `NegativeSampling`) and how many of its rows were consumed.
+        It can be passed to `load_state_dict` of a new loader to resume iteration
+        from the same row, e.g. after a preemption.
+
+        Returns
+        -------
+        dict
+        """
+        chunk = dict(self._chunk_state) if self._chunk_state else None
+        return {
+            "indices": self.indices.tolist(),
+            "epochs": self._epochs,
+            "num_rows_processed": self.num_rows_processed,
+            "chunk": chunk,
+        }
+
+    def load_state_dict(self, state):
+        """Restores a state returned by `state_dict`.
+
+        The next iteration over the loader seeks directly to the saved position:
+        partitions that were entirely consumed are skipped without being read and
+        only the partitions holding the rows of the interrupted chunk are decoded.
+
+        Parameters
+        ----------
+        state: dict
+            The state returned by `state_dict`.
+        """
+        if getattr(self.data, "is_streaming", False):
+            raise ValueError("Resuming from a state is not supported for streaming datasets.")
+        if len(state["indices"]) != len(self.indices):
+            raise ValueError(
+                f"The state was saved for a dataset with {len(state['indices'])} partitions, "
+                f"but this dataset has {len(self.indices)} partitions."
+            )
+        self.stop()
+        if state["epochs"] != self._epochs:
+            self._set_epochs(state["epochs"])
+        self.indices = cp.asarray(state["indices"])
+        self.num_rows_processed = state["num_rows_processed"]
+        self._resume_state = state if state["chunk"] is not None else None
+        return self
+
+    def _transform(self, df):
+        """Applies the `transforms` to a partition, in the thread loading the chunks."""
+        for transform in self.transforms:
+            df = transform(df)
+        return df
+
+    def _transform_states(self):
+        """The states of the transforms having one (e.g. the state of their RNG)."""
+        return [
+            transform.get_state() if hasattr(transform, "get_state") else None
+            for transform in self.transforms
+        ]
+
+    def _set_transform_states(self, states):
+        for transform, state in zip(self.transforms, states):
+            if state is not None:
+                transform.set_state(state)
+
+    def _seek(self, chunk_state):
+        """Builds the partition iterator and the resume info of `ChunkQueue.chunk_logic`
+        to continue from `chunk_state`.
+
+        The partitions consumed before the chunk are skipped without being read nor
+        transformed, the transforms restart from their saved state and only the
+        partitions of the spilled rows are transformed again, which gives the same rows.
+        """
+        indices = self._gather_indices_for_dev(0) * self._epochs
+        parts_consumed = chunk_state["parts_consumed"]
+        self._set_transform_states(chunk_state["transform_states"])
+
+        # rebuild the spill by reading back the last consumed partitions
+        spill, spill_rows, history = None, chunk_state["spill_rows"], []
+        if spill_rows:
+            start = parts_consumed - chunk_state["spill_parts"]
+            parts = []
+            for part in self._data_iter(1, indices=indices[start:parts_consumed]):
+                states = self._transform_states()
+                parts.append(self._transform(part))
+                history.append((len(parts[-1]), states))
+            spill = concat(parts)
+            spill = make_df(spill.iloc[len(spill) - spill_rows :])
+            spill.reset_index(drop=True, inplace=True)
+
+        remaining = indices[parts_consumed:]
+        itr = iter(self._data_iter(1, indices=remaining)) if remaining else iter([])
+        resume = dict(chunk_state, spill=spill, history=history)
+
+        return itr, resume
 
     def _fetch_chunk(self):
+        # waits for the next chunk, or the end of the chunks put by the loading thread
+        # (e.g. right away when resuming from the very end of an epoch) or by `stop`
         chunks = self._buff.get()
+        if chunks is _END_OF_CHUNKS:
+            self._workers = None
+            self._batch_itr = None
+            raise StopIteration
         if isinstance(chunks, Exception):
             self.stop()
             raise chunks
+        chunks, self._chunk_state = chunks
         self._batch_itr = iter(chunks)
 
     def _get_next_batch(self):
@@ -388,15 +679,8 @@ class DataLoader:
         try:
             batch = next(self._batch_itr)
         except StopIteration:
-            # anticipate any more chunks getting created
-            # if not, raise the StopIteration
-            if not self._working and self._buff.empty:
-                self._workers = None
-                self._batch_itr = None
-                raise
-
-            # otherwise get the next chunks and return
-            # the first batch
+            # get the next chunks and return the first batch,
+            # raises StopIteration after the last chunk
             self._fetch_chunk()
             batch = next(self._batch_itr)
         # if batch[0] is empty but other exist
@@ -404,6 +688,10 @@ class DataLoader:
             if sub is not None and len(sub) > 0:
                 self.num_rows_processed += len(sub)
                 break
+        # batches of a chunk are all `batch_size` long except the last one
+        self._chunk_state["rows_consumed"] = min(
+            self._chunk_state["rows_consumed"] + self.batch_size, self._chunk_state["num_rows"]
+        )
         return batch
 
     @annotate("make_tensors", color="darkgreen", domain="nvt_python")
@@ -0,0 +1,373 @@
+#
+# Copyright (c) 2021, NVIDIA CORPORATION.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import contextlib
+import itertools
+import multiprocessing
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from merlin.core.dispatch import is_cpu_object
+from merlin.models.loader.backend import DataLoader
+
+_ALIGNMENT = 64
+_END_OF_EPOCH = "end_of_epoch"
+_END_OF_DATA = "end_of_data"
+_STOPPED = "stopped"
+_ERROR = "error"
+
+_ArraySpec = namedtuple("_ArraySpec", ["dtype", "shape", "offset"])
+
+
+class NumpyDataLoader(DataLoader):
+    """`DataLoader` producing host numpy arrays, used by the loader service."""
+
+    def _to_tensor(self, gdf, dtype=None):
+        array = gdf.to_numpy() if is_cpu_object(gdf) else gdf.values_host
+        return array.astype(dtype, copy=False) if dtype else array
+
+    def _get_device_ctx(self, dev):
+        return contextlib.nullcontext()
+
+    def _split_fn(self, tensor, idx, axis=0):
+        return np.split(tensor, np.cumsum(idx)[:-1], axis=axis)
+
+    def _tensor_split(self, tensor, idx, axis=0):
+        return np.split(tensor, idx, axis=axis)
+
+    @property
+    def _LONG_DTYPE(self):
+        return np.int64
+
+    @property
+    def _FLOAT32_DTYPE(self):
+        return np.float32
+
+
+class SharedMemoryLoader:
+    """Loader service feeding several local training processes through shared memory.
+
+    A single service process reads, shuffles and tensorizes the data (with the same
+    chunking logic as the framework data loaders) and publishes the batches into one
+    shared-memory ring buffer per local rank, dealing the batches round-robin over the
+    ranks. The training processes read their shard with `consumer(rank)` as numpy arrays
+    that are views on the shared memory (no copy, no pickling), instead of each of them
+    decoding the same files into their own buffers::
+
+        service = SharedMemoryLoader(dataset, num_ranks=2, batch_size=1024, shuffle=True)
+        service.start()
+        workers = [
+            multiprocessing.Process(target=train, args=(service.consumer(rank),))
+            for rank in range(2)
+        ]
+        ...
+        service.stop()
+
+    The arrays of a batch are only valid until the next batch is requested from the
+    consumer, since its slot of the ring buffer is then handed back to the service:
+    converting them to framework tensors (e.g. `tf.convert_to_tensor`) copies them.
+    All the ranks get the same number of batches per epoch, so that distributed training
+    processes run the same number of steps: the batches are dealt by rounds of one batch
+    per rank, and the last incomplete round of an epoch is dropped with `drop_last=True`,
+    or completed with copies of the first batches of the epoch otherwise.
+    The consumers stop iterating when the service ends, is stopped or fails (raising
+    the error of the service).
+
+    Parameters
+    ----------
+    dataset: merlin.io.Dataset
+        The dataset to load.
+    num_ranks: int
+        Number of local training processes.
+    batch_size: int
+        Number of rows of every batch.
+    shuffle: bool
+        Whether to shuffle the data, by default True.
+    epochs: int
+        Number of passes over the data published by the service, by default 1.
+        Every consumer iterator stops at the end of an epoch.
+    num_slots: int
+        Number of batches of every ring buffer, by default 4.
+    slot_size: int
+        Size in bytes of a slot, must hold the largest batch. By default 16 MiB.
+    mp_context: str
+        The `multiprocessing` start method of the service process, by default "spawn".
+    **loader_kwargs:
+        Extra arguments of the data loader, e.g. `cat_names`, `parts_per_chunk`
+        or `transforms`.
+    """
+
+    def __init__(
+        self,
+        dataset,
+        num_ranks,
+        batch_size,
+        shuffle=True,
+        epochs=1,
+        num_slots=4,
+        slot_size=2 ** 24,
+        mp_context="spawn",
+        **loader_kwargs,
+    ):
+        if num_slots < 2:
+            raise ValueError("num_slots must be at least 2")
+
+        self.dataset = dataset
+        self.num_ranks = num_ranks
+        self.epochs = epochs
+        self.loader_kwargs = dict(loader_kwargs, batch_size=batch_size, shuffle=shuffle)
+        self._context = multiprocessing.get_context(mp_context)
+        self._stop_event = self._context.Event()
+        self._rings = []
+        for _ in range(num_ranks):
+            memory = shared_memory.SharedMemory(create=True, size=num_slots * slot_size)
+            self._rings.append(
+                RingBuffer(
+                    memory.name,
+                    num_slots,
+                    slot_size,
+                    self._context.Semaphore(num_slots),
+                    self._context.Queue(),
+                    memory=memory,
+                )
+            )
+        self._process = None
+
+    def start(self):
+        self._process = self._context.Process(
+            target=_serve,
+            args=(self.dataset, self.loader_kwargs, self._rings, self.epochs, self._stop_event),
+            daemon=True,
+        )
+        self._process.start()
+        return self
+
+    def consumer(self, rank):
+        """Returns the iterator over the batches of `rank`, to pass to its process."""
+        return SharedMemoryConsumer(self._rings[rank])
+
+    def join(self, timeout=None):
+        if self._process is not None:
+            self._process.join(timeout)
+
+    def stop(self):
+        """Stops the service process and releases the shared memory."""
+        self._stop_event.set()
+        if self._process is not None:
+            self._process.join()
+            self._process = None
+        for ring in self._rings:
+            ring.unlink()
+        self._rings = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class RingBuffer:
+    """Ring buffer of `num_slots` batches in a shared memory block.
+
+    The writer waits for a free slot (`free_slots` semaphore), copies the arrays of the
+    batch into it and sends the layout of the batch (dtypes, shapes and offsets of the
+    arrays) through `layouts`. The reader rebuilds the batch as numpy views on the slot
+    and hands the slot back when it moves on to the next batch.
+    """
+
+    def __init__(self, name, num_slots, slot_size, free_slots, layouts, memory=None):
+        self.name = name
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.free_slots = free_slots
+        self.layouts = layouts
+        self._memory = memory
+        self._next_slot = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_memory"] = None
+        return state
+
+    @property
+    def memory(self):
+        if self._memory is None:
+            self._memory = _attach(self.name)
+        return self._memory
+
+    def put(self, batch, stop_event):
+        """Copies `batch` into the next slot, returns False if stopped while waiting."""
+        while not self.free_slots.acquire(timeout=0.1):
+            if stop_event.is_set():
+                return False
+
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % self.num_slots
+        base, offset = slot * self.slot_size, 0
+        arrays = []
+
+        def pack(array):
+            nonlocal offset
+            array = np.ascontiguousarray(array)
+            if offset + array.nbytes > self.slot_size:
+                raise ValueError(
+                    f"A batch doesn't fit in a slot of {self.slot_size} bytes, "
+                    "increase `slot_size` or decrease the batch size"
+                )
+            arrays.append((array, base + offset))
+            spec = _ArraySpec(array.dtype.str, array.shape, base + offset)
+            offset += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+            return spec
+
+        layout = _map_arrays(pack, batch)
+        for array, array_offset in arrays:
+            view = np.ndarray(array.shape, array.dtype, self.memory.buf, array_offset)
+            view[...] = array
+        self.layouts.put((slot, layout))
+
+        return True
+
+    def put_message(self, message):
+        self.layouts.put((None, message))
+
+    def get(self):
+        """Returns the next batch (as views on its slot) or a control message."""
+        slot, layout = self.layouts.get()
+        if slot is None:
+            return layout, None
+
+        def unpack(spec):
+            return np.ndarray(spec.shape, np.dtype(spec.dtype), self.memory.buf, spec.offset)
+
+        return None, _map_arrays(unpack, layout, leaf_type=_ArraySpec)
+
+    def release(self):
+        self.free_slots.release()
+
+    def close(self):
+        if self._memory is not None:
+            self._memory.close()
+            self._memory = None
+
+    def unlink(self):
+        memory = self.memory
+        self.close()
+        memory.unlink()
+
+
+class SharedMemoryConsumer:
+    """Iterator over the batches published for one rank by a `SharedMemoryLoader`.
+
+    Every iteration yields the `(features, labels)` batches of one epoch, as numpy arrays
+    in shared memory that are valid until the next batch is requested.
+    """
+
+    def __init__(self, ring):
+        self.ring = ring
+        self._holding = False
+        # last message of the service, once it ended
+        self._final_message = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._holding:
+            self.ring.release()
+            self._holding = False
+
+        message = self._final_message
+        if message is None:
+            message, batch = self.ring.get()
+            if message is None:
+                self._holding = True
+                return batch
+            if message != _END_OF_EPOCH:
+                self._final_message = message
+        if isinstance(message, tuple) and message[0] == _ERROR:
+            raise RuntimeError(f"The loader service failed: {message[1]}")
+
+        raise StopIteration
+
+    def close(self):
+        self.ring.close()
+
+
+def _serve(dataset, loader_kwargs, rings, epochs, stop_event):
+    # the consumers wait for a message, which is sent however the service ends
+    message, loader = _END_OF_DATA, None
+    try:
+        loader = NumpyDataLoader(dataset, **loader_kwargs)
+        for _ in range(epochs):
+            if not _publish_epoch(loader, rings, stop_event):
+                message = _STOPPED
+                return
+            for ring in rings:
+                ring.put_message(_END_OF_EPOCH)
+    except Exception as e:  # pylint: disable=broad-except
+        message = (_ERROR, repr(e))
+    finally:
+        if loader is not None:
+            loader.stop()
+        for ring in rings:
+            ring.put_message(message)
+            ring.close()
+
+
+def _publish_epoch(loader, rings, stop_event):
+    """Deals the batches of an epoch over the rings by rounds of one batch per ring,
+    returns False if stopped."""
+    num_ranks = len(rings)
+    first_batches, batches = [], []
+    for batch in loader:
+        if not loader.drop_last and len(first_batches) < num_ranks - 1:
+            # copied, as a batch is a view on the whole chunk it was split from
+            first_batches.append(_map_arrays(np.copy, batch))
+        batches.append(batch)
+        if len(batches) == num_ranks:
+            if not _publish_round(batches, rings, stop_event):
+                return False
+            batches = []
+
+    if batches and not loader.drop_last:
+        padding = itertools.islice(itertools.cycle(first_batches), num_ranks - len(batches))
+        return _publish_round(batches + list(padding), rings, stop_event)
+    return True
+
+
+def _publish_round(batches, rings, stop_event):
+    return all(ring.put(batch, stop_event) for ring, batch in zip(rings, batches))
+
+
+def _map_arrays(fn, obj, leaf_type=np.ndarray):
+    """Applies `fn` to the arrays of a (nested) batch of dicts, tuples and lists."""
+    if isinstance(obj, leaf_type):
+        return fn(obj)
+    if isinstance(obj, dict):
+        return {key: _map_arrays(fn, value, leaf_type) for key, value in obj.items()}
+    if isinstance(obj, (tuple, list)):
+        return type(obj)(_map_arrays(fn, value, leaf_type) for value in obj)
+    return obj
+
+
+def _attach(name):
+    try:
+        # only the process creating the memory should unlink it
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
@@ -50,17 +50,17 @@ def _check_shuffle_arg(shuffle):
     return shuffle
 
 
-def _shuffle_df(df, size=None, keep_index=False):
+def _shuffle_df(df, size=None, keep_index=False, random_state=None):
     """Shuffles a DataFrame, returning a new dataframe with randomly
     ordered rows"""
     size = size or len(df)
     if isinstance(df, pd.DataFrame):
         if _IGNORE_INDEX_SUPPORTED:
-            return df.sample(n=size, ignore_index=not keep_index)
+            return df.sample(n=size, ignore_index=not keep_index, random_state=random_state)
         else:
             # Pandas<1.3.0
             if keep_index:
-                return df.sample(n=size)
-            return df.sample(n=size).reset_index(drop=True)
+                return df.sample(n=size, random_state=random_state)
+            return df.sample(n=size, random_state=random_state).reset_index(drop=True)
     else:
-        return df.sample(n=size, keep_index=keep_index)
+        return df.sample(n=size, keep_index=keep_index, random_state=random_state)
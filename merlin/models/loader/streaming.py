@@ -0,0 +1,230 @@
+#
+# Copyright (c) 2021, NVIDIA CORPORATION.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import glob
+import os
+import threading
+import time
+import zlib
+
+import merlin.io
+
+
+class StreamingDataset:
+    """Dataset over a directory (or a manifest file) that keeps receiving new files.
+
+    Passing a `StreamingDataset` to a data loader (e.g. `BatchedDataset`) turns it into
+    a "tail" loader: the loader keeps polling for new files and appends their partitions
+    to the running iterator, instead of stopping at the end of the files that existed
+    when it was created. Partitions go through the same chunking, shuffling
+    (`parts_per_chunk` shuffle window) and batching as for a regular dataset, so a
+    long-lived training process can keep consuming fresh data without being restarted.
+
+    Partitions waiting for a full chunk are batched anyway when no new file arrived for
+    `flush_timeout` seconds, or when the stream ends, so that a slow stream of files
+    doesn't hold them back.
+
+    A stream has no length: `len()` of the loader raises a `TypeError`, unless
+    `steps_per_epoch` is set for the frameworks that require one (e.g. Keras `fit`).
+
+    Every file is read only once: files consumed by a previous iteration are not replayed.
+    Stopping the loader (e.g. calling `len()` or starting a new iteration, as Keras does at
+    every epoch) doesn't drop any row: the rows read but not consumed yet are returned by
+    the next iteration.
+    Files should be written atomically (e.g. written under a temporary name that doesn't
+    match `pattern` and then renamed), so that partially written files are never read.
+    When training with several processes, every file is assigned to a single rank based
+    on a hash of its path.
+
+    Example usage::
+        data = StreamingDataset("/data/hourly/", poll_interval=60)
+        loader = BatchedDataset(data, batch_size=1024, shuffle=True, parts_per_chunk=4)
+        for step in range(num_steps):
+            inputs, targets = next(loader)
+
+    Parameters
+    ----------
+    path: str
+        Either a directory where new files are dropped or a manifest file, in which
+        every line is the path of a file (relative to the manifest directory or absolute).
+        New files are added to the manifest by appending lines to it.
+    engine: str
+        The file format, by default "parquet".
+    pattern: str, optional
+        Glob pattern of the files to pick up when `path` is a directory,
+        by default `*.<engine>`.
+    schema: Schema, optional
+        The schema of the files. If not provided, it is inferred
+        from the files available when the dataset is created.
+    poll_interval: float
+        Number of seconds to wait between checks for new files, by default 10.
+    idle_timeout: float, optional
+        Stop iterating when no new file arrived for `idle_timeout` seconds.
+        By default None, which means that the iterator waits for new files forever.
+    flush_timeout: float, optional
+        Number of seconds without new files after which the partitions received so far
+        are batched, even if there are less than `parts_per_chunk` of them.
+        By default `poll_interval`.
+    steps_per_epoch: int, optional
+        Number of batches reported as the length of the loader. By default None,
+        which means that the loader has no length.
+    cpu: bool, optional
+        Whether to read the files in host memory, passed to `merlin.io.Dataset`.
+    **dataset_kwargs:
+        Extra arguments passed to `merlin.io.Dataset` when reading new files,
+        e.g. `part_size` to control the size of the partitions.
+    """
+
+    is_streaming = True
+
+    def __init__(
+        self,
+        path,
+        engine="parquet",
+        pattern=None,
+        schema=None,
+        poll_interval=10.0,
+        idle_timeout=None,
+        flush_timeout=None,
+        steps_per_epoch=None,
+        cpu=None,
+        **dataset_kwargs,
+    ):
+        self.path = path
+        self.engine = engine
+        self.pattern = pattern or f"*.{engine}"
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.flush_timeout = poll_interval if flush_timeout is None else flush_timeout
+        self.steps_per_epoch = steps_per_epoch
+        self.cpu = cpu
+        self.dataset_kwargs = dataset_kwargs
+        self.num_files_read = 0
+        self._files_seen = set()
+        # partitions of the files read by every rank, not consumed yet
+        self._unread = {}
+        self._lock = threading.Lock()
+
+        if schema is None:
+            files = self.list_files()
+            if files:
+                schema = self._read(files[:1]).schema
+        self.schema = schema
+
+    @property
+    def npartitions(self):
+        # Partitions are discovered while iterating
+        return 0
+
+    def list_files(self):
+        """Lists all the files currently available, in arrival order."""
+        if os.path.isfile(self.path):
+            base = os.path.dirname(self.path)
+            with open(self.path) as manifest:
+                # Ignore the last line until it is complete
+                lines = [line.strip() for line in manifest if line.endswith("\n")]
+            return [
+                line if os.path.isabs(line) else os.path.join(base, line) for line in lines if line
+            ]
+
+        return sorted(glob.glob(os.path.join(self.path, self.pattern)))
+
+    def new_files(self, global_rank=0, global_size=1):
+        """Returns the files of this rank that were not read yet and marks them as read."""
+        with self._lock:
+            files = [
+                f
+                for f in self.list_files()
+                if f not in self._files_seen and _file_rank(f, global_size) == global_rank
+            ]
+            self._files_seen.update(files)
+            self.num_files_read += len(files)
+
+        return files
+
+    def next_partition(self, global_rank=0, global_size=1):
+        """Returns the next partition of this rank not read yet, or None if there is none.
+
+        Partitions are read lazily, so the partitions of a file that were not consumed
+        when an iterator stopped are returned to the next one.
+        """
+        while True:
+            part = next(self._unread.get(global_rank, iter([])), None)
+            if part is not None:
+                return part
+            files = self.new_files(global_rank, global_size)
+            if not files:
+                return None
+            self._unread[global_rank] = iter(self._read(files).to_iter())
+
+    def to_iter(self, indices=None, epochs=1, global_rank=0, global_size=1):
+        return StreamingIter(self, global_rank=global_rank, global_size=global_size)
+
+    def _read(self, files):
+        return merlin.io.Dataset(files, engine=self.engine, cpu=self.cpu, **self.dataset_kwargs)
+
+
+class StreamingIter:
+    """Iterator over the partitions of the new files of a `StreamingDataset`.
+
+    It yields None when no new file arrived for `flush_timeout` seconds, for the
+    loader to batch the partitions it is holding.
+
+    Parameters
+    ----------
+    dataset: StreamingDataset
+        The dataset to poll for new files.
+    global_rank: int
+        The rank of this process, only the files assigned to it are read.
+    global_size: int
+        The total number of processes.
+    """
+
+    def __init__(self, dataset, global_rank=0, global_size=1):
+        self.dataset = dataset
+        self.global_rank = global_rank
+        self.global_size = global_size
+        self._stop_event = threading.Event()
+
+    def __len__(self):
+        raise TypeError("A stream of files has no length, set `steps_per_epoch` if needed.")
+
+    def __iter__(self):
+        last_arrival, flushed = time.monotonic(), True
+        while not self._stop_event.is_set():
+            part = self.dataset.next_partition(self.global_rank, self.global_size)
+            if part is not None:
+                last_arrival, flushed = time.monotonic(), False
+                yield part
+                continue
+
+            if not flushed and time.monotonic() - last_arrival >= self.dataset.flush_timeout:
+                flushed = True
+                yield None
+                continue
+
+            idle_timeout = self.dataset.idle_timeout
+            if idle_timeout is not None and time.monotonic() - last_arrival >= idle_timeout:
+                return
+            self._stop_event.wait(self.dataset.poll_interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def _file_rank(path, global_size):
+    if global_size == 1:
+        return 0
+    return zlib.crc32(os.path.basename(path).encode()) % global_size
@@ -0,0 +1,294 @@
+#
+# Copyright (c) 2021, NVIDIA CORPORATION.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import numpy as np
+import pyarrow as pa
+
+from merlin.core.dispatch import (
+    concat,
+    concat_columns,
+    create_multihot_col,
+    is_cpu_object,
+    is_list_dtype,
+    make_series,
+    pull_apart_list,
+)
+
+
+class NegativeSampling:
+    """Data loader transform that adds sampled negatives to every partition.
+
+    For every (positive) row of a partition, `num_negatives` rows are generated
+    by copying the context columns of the row and replacing the item id by an item
+    sampled from `item_frequencies`. When `item_features` is provided, the item-side
+    columns of the negatives are gathered from this in-memory item table.
+    The label of the negatives is set to 0, and the label of the positives to 1
+    if the partitions don't have the label column already.
+
+    Items are sampled with the alias method, so every draw is O(1) whatever the
+    number of items, and the sampling is vectorized over the whole partition.
+    The transform runs in the thread loading the chunks of the data loader, so the
+    negatives don't need to be stored on disk::
+
+        item_frequencies = train.to_ddf()["item_id"].value_counts().compute()
+        sampling = NegativeSampling("item_id", item_frequencies, num_negatives=4)
+        loader = BatchedDataset(train, batch_size=1024, transforms=[sampling])
+
+    Note that the sampled negatives can be actual positives of the user (accidental hits).
+
+    Parameters
+    ----------
+    item_id: str
+        Name of the item id column.
+    item_frequencies: Series
+        Number of occurrences (or unnormalized probability) of every item,
+        indexed by the item id, e.g. the `value_counts()` of the item id column.
+    num_negatives: int
+        Number of negatives to sample for every positive row, by default 1.
+    item_features: DataFrame, optional
+        Item-side features indexed by the item id, with a row for every item of
+        `item_frequencies`. Those columns are replaced by the features of the sampled
+        items in the negatives.
+    label: str
+        Name of the binary label column, by default "click".
+    alpha: float
+        Exponent applied to the frequencies before normalization, e.g. 0.75 to
+        smooth the popularity distribution. By default 1.0.
+    seed: int, optional
+        Seed of the random generator.
+    """
+
+    def __init__(
+        self,
+        item_id,
+        item_frequencies,
+        num_negatives=1,
+        item_features=None,
+        label="click",
+        alpha=1.0,
+        seed=None,
+    ):
+        if num_negatives < 1:
+            raise ValueError(f"num_negatives must be at least 1, got {num_negatives}")
+
+        self.item_id = item_id
+        self.num_negatives = num_negatives
+        self.label = label
+        self._rng = np.random.RandomState(seed)
+
+        ids = item_frequencies.index.to_series().reset_index(drop=True)
+        probs = item_frequencies.values
+        if not is_cpu_object(item_frequencies):
+            probs = probs.get()
+        probs = np.asarray(probs, dtype=np.float64) ** alpha
+        if probs.sum() <= 0:
+            raise ValueError("item_frequencies must have at least one non-zero frequency")
+        self._accept, self._alias = _alias_table(probs)
+
+        if item_features is not None:
+            items = item_features.loc[ids.values].reset_index(drop=True)
+            items = items.drop(columns=[item_id], errors="ignore")
+        else:
+            items = None
+        self._ids = ids
+        self._items = items
+
+    @property
+    def item_columns(self):
+        columns = [self.item_id]
+        if self._items is not None:
+            columns += list(self._items.columns)
+        return columns
+
+    def output_rows(self, num_rows):
+        return num_rows * (1 + self.num_negatives)
+
+    def get_state(self):
+        """The state of the random generator, saved by `DataLoader.state_dict`."""
+        return self._rng.get_state()
+
+    def set_state(self, state):
+        self._rng.set_state(state)
+
+    def sample(self, num_samples):
+        """Returns the positions (in `item_frequencies`) of `num_samples` sampled items."""
+        idx = self._rng.randint(len(self._accept), size=num_samples)
+        accepted = self._rng.random_sample(num_samples) < self._accept[idx]
+
+        return np.where(accepted, idx, self._alias[idx])
+
+    def __call__(self, df):
+        positions = self.sample(len(df) * self.num_negatives)
+        rows = np.repeat(np.arange(len(df)), self.num_negatives)
+
+        item_columns = [col for col in self.item_columns if col in df.columns]
+        context = df.drop(columns=item_columns + [self.label], errors="ignore")
+        context = context.take(rows).reset_index(drop=True)
+        item_ids = self._ids.take(positions).reset_index(drop=True)
+        items = item_ids.astype(df[self.item_id].dtype).to_frame(self.item_id)
+        if self._items is not None:
+            items = concat_columns([items, self._items.take(positions).reset_index(drop=True)])
+
+        negatives = concat_columns([context, items])
+        negatives[self.label] = 0
+        if self.label not in df.columns:
+            df = df.copy()
+            df[self.label] = 1
+        negatives = negatives[list(df.columns)]
+        negatives[self.label] = negatives[self.label].astype(df[self.label].dtype)
+
+        return concat([df, negatives], ignore_index=True)
+
+
+class SlidingWindow:
+    """Data loader transform that expands sessions into sliding-window examples.
+
+    Every row of a partition holds a session, where the sequential features are list
+    columns of the same length. The transform emits, for every session, the windows of
+    at most `window_size` consecutive interactions ending every `stride` positions,
+    starting from the end of the session::
+
+        session: [1, 2, 3, 4, 5], window_size=3, stride=1, min_length=2
+        windows: [1, 2], [1, 2, 3], [2, 3, 4], [3, 4, 5]
+
+    The other columns of the session are repeated for all its windows. The last item of
+    every window is the item to predict, which is what `CausalLanguageModeling` with
+    `train_on_last_item_seq_only=True` (the default) uses as target, so the windowed
+    sessions can be fed to `NextItemPredictionTask` as is. Sessions shorter than
+    `min_length` are dropped. The windows are computed with index arithmetic over the
+    flattened list columns of the whole partition, without a Python loop over sessions.
+
+    Note that the number of windows depends on the session lengths, so the length of the
+    data loader counts sessions and not windows: pass `steps_per_epoch` to `model.fit`
+    accordingly.
+
+    Parameters
+    ----------
+    columns: list(str), optional
+        The sequential (list) columns to window. By default all list columns.
+    window_size: int
+        Maximum number of interactions in a window, including the target.
+    stride: int
+        Number of positions between the ends of two consecutive windows, by default 1.
+    min_length: int
+        Minimum number of interactions in a window, by default 2 (one input and the
+        target).
+    """
+
+    def __init__(self, columns=None, window_size=20, stride=1, min_length=2):
+        if window_size < 1 or stride < 1:
+            raise ValueError("window_size and stride must be positive")
+        if min_length < 1 or min_length > window_size:
+            raise ValueError(f"min_length must be between 1 and window_size, got {min_length}")
+
+        self.columns = columns
+        self.window_size = window_size
+        self.stride = stride
+        self.min_length = min_length
+
+    def __call__(self, df):
+        columns = self.columns or [col for col in df.columns if is_list_dtype(df[col])]
+        if not columns:
+            raise ValueError("SlidingWindow requires at least one list column")
+
+        flat = {col: pull_apart_list(df[col]) for col in columns}
+        offsets = _to_numpy(flat[columns[0]][1])
+        for col in columns[1:]:
+            if not np.array_equal(_to_numpy(flat[col][1]), offsets):
+                raise ValueError(f"List columns {columns[0]} and {col} have different lengths")
+
+        rows, starts, ends = self.windows(offsets)
+        lengths = ends - starts
+        window_offsets = np.concatenate([[0], np.cumsum(lengths)])
+        positions = np.repeat(starts - window_offsets[:-1], lengths) + np.arange(
+            window_offsets[-1]
+        )
+
+        windows = df.drop(columns=columns).take(rows).reset_index(drop=True)
+        for col in columns:
+            values = flat[col][0].take(positions).reset_index(drop=True)
+            windows[col] = _list_column(values, window_offsets, like=df)
+
+        return windows[list(df.columns)]
+
+    def windows(self, offsets):
+        """Returns the session, start and end (positions in the flattened list
+        columns) of every window of the sessions delimited by `offsets`."""
+        session_lengths = np.diff(offsets)
+        num_windows = np.where(
+            session_lengths >= self.min_length,
+            (session_lengths - self.min_length) // self.stride + 1,
+            0,
+        )
+        rows = np.repeat(np.arange(len(session_lengths)), num_windows)
+        first = np.cumsum(num_windows) - num_windows
+        # windows of a session are ordered by end position, the last one ends the session
+        steps_from_last = num_windows[rows] - 1 - (np.arange(len(rows)) - first[rows])
+        ends = offsets[1:][rows] - steps_from_last * self.stride
+        starts = np.maximum(offsets[:-1][rows], ends - self.window_size)
+
+        return rows, starts, ends
+
+
+def _to_numpy(series):
+    return np.asarray(series.to_numpy(), dtype=np.int64)
+
+
+def _list_column(values, offsets, like):
+    if is_cpu_object(like):
+        # built by arrow from the offsets, as on GPU, instead of slicing every window
+        list_array = pa.ListArray if offsets[-1] < 2 ** 31 else pa.LargeListArray
+        lists = list_array.from_arrays(offsets, pa.array(values.to_numpy()))
+        return make_series(lists.to_pandas(), device="cpu")
+
+    return create_multihot_col(offsets, values)
+
+
+def _alias_table(probs):
+    """Builds the tables of the alias method for the unnormalized probabilities `probs`.
+
+    Instead of pairing the under-full and over-full bins one at a time, the deficits
+    of the under-full bins and the surpluses of the over-full bins are laid on two
+    cumulative axes: an under-full bin takes its alias from the over-full bin whose
+    surplus covers the start of its deficit, and an over-full bin that gave away more
+    than its surplus aliases the next over-full bin for the remainder.
+    """
+    num_items = len(probs)
+    probs = probs * (num_items / probs.sum())
+    small = np.flatnonzero(probs < 1.0)
+    large = np.flatnonzero(probs >= 1.0)
+
+    accept = np.ones(num_items)
+    alias = np.arange(num_items)
+    if len(small) == 0 or len(large) == 0:
+        return accept, alias
+
+    deficits = np.cumsum(1.0 - probs[small])
+    surpluses = np.cumsum(probs[large] - 1.0)
+    deficit_starts = np.concatenate([[0.0], deficits[:-1]])
+
+    # under-full bins take their alias from the surplus interval their deficit starts in
+    owner = np.minimum(np.searchsorted(surpluses, deficit_starts, side="right"), len(large) - 1)
+    accept[small] = probs[small]
+    alias[small] = large[owner]
+
+    # over-full bins overlapped by the next deficit alias the next over-full bin
+    ends = surpluses[:-1]
+    straddling = np.minimum(np.searchsorted(deficits, ends, side="right"), len(small) - 1)
+    overflow = np.where(deficit_starts[straddling] < ends, deficits[straddling] - ends, 0.0)
+    accept[large[:-1]] = np.clip(1.0 - overflow, 0.0, 1.0)
+    alias[large[:-1]] = large[1:]
+
+    return accept, alias
@@ -48,7 +48,14 @@ from merlin.models.tf.blocks.core.combinators import (
     ResidualBlock,
     SequentialBlock,
 )
-from merlin.models.tf.blocks.core.index import IndexBlock, TopKIndexBlock
+from merlin.models.tf.blocks.core.index import (
+    HNSWTopKIndexBlock,
+    IndexBlock,
+    IVFTopKIndexBlock,
+    PQTopKIndexBlock,
+    ShardedTopKIndexBlock,
+    TopKIndexBlock,
+)
 from merlin.models.tf.blocks.core.inputs import InputBlock
 from merlin.models.tf.blocks.core.masking import CausalLanguageModeling, MaskedLanguageModeling
 from merlin.models.tf.blocks.core.tabular import AsTabular, Filter, TabularBlock
@@ -65,6 +72,7 @@ from merlin.models.tf.blocks.experts import CGCBlock, MMOEBlock, MMOEGate
 from merlin.models.tf.blocks.interaction import DotProductInteraction
 from merlin.models.tf.blocks.mlp import DenseResidualBlock, MLPBlock
 from merlin.models.tf.blocks.retrieval.base import ItemRetrievalScorer
+from merlin.models.tf.blocks.retrieval.cache import CachedQueryBlock, QueryEmbeddingCache
 from merlin.models.tf.blocks.retrieval.matrix_factorization import MatrixFactorizationBlock
 from merlin.models.tf.blocks.retrieval.two_tower import TwoTowerBlock
 from merlin.models.tf.blocks.sampling.base import ItemSampler
@@ -73,6 +81,7 @@ from merlin.models.tf.blocks.sampling.cross_batch import (
     CachedUniformSampler,
     PopularityBasedSampler,
 )
+from merlin.models.tf.blocks.sampling.frequency import ItemFrequencyEstimator
 from merlin.models.tf.blocks.sampling.in_batch import InBatchSampler
 from merlin.models.tf.blocks.sampling.queue import FIFOQueue
 from merlin.models.tf.features.continuous import ContinuousFeatures
@@ -84,9 +93,11 @@ from merlin.models.tf.features.embedding import (
     SequenceEmbeddingFeatures,
     TableConfig,
 )
+from merlin.models.tf.features.store import ItemFeatureStore
 from merlin.models.tf.losses import LossType
 from merlin.models.tf.metrics.ranking import AvgPrecisionAt, NDCGAt, RecallAt, ranking_metrics
 from merlin.models.tf.models.base import Model, RetrievalModel
+from merlin.models.tf.models.pipeline import RetrieveAndRankPipeline, StageTimings
 from merlin.models.tf.models.ranking import DCNModel, DLRMModel
 from merlin.models.tf.models.retrieval import (
     MatrixFactorizationModel,
@@ -132,13 +143,20 @@ __all__ = [
     "MMOEBlock",
     "CGCBlock",
     "TopKIndexBlock",
+    "IVFTopKIndexBlock",
+    "HNSWTopKIndexBlock",
+    "PQTopKIndexBlock",
+    "ShardedTopKIndexBlock",
     "IndexBlock",
+    "CachedQueryBlock",
+    "QueryEmbeddingCache",
     "DenseResidualBlock",
     "TabularBlock",
     "ContinuousFeatures",
     "EmbeddingFeatures",
     "SequenceEmbeddingFeatures",
     "EmbeddingOptions",
+    "ItemFeatureStore",
     "FeatureConfig",
     "TableConfig",
     "ParallelPredictionBlock",
@@ -166,6 +184,8 @@ __all__ = [
     "ranking_metrics",
     "Model",
     "RetrievalModel",
+    "RetrieveAndRankPipeline",
+    "StageTimings",
     "InputBlock",
     "PredictionTasks",
     "StochasticSwapNoise",
@@ -179,6 +199,7 @@ __all__ = [
     "CachedCrossBatchSampler",
     "CachedUniformSampler",
     "PopularityBasedSampler",
+    "ItemFrequencyEstimator",
     "FIFOQueue",
     "YoutubeDNNRetrievalModel",
     "TwoTowerModel",
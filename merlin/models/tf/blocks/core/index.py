@@ -13,7 +13,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-from typing import Optional, Union
+import concurrent.futures
+import heapq
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Type, Union
 
 import numpy as np
 import tensorflow as tf
@@ -23,16 +31,47 @@ import merlin.io
 from merlin.core.dispatch import DataFrameType
 from merlin.models.tf.blocks.core.base import Block, PredictionOutput
 from merlin.models.tf.utils import tf_utils
-from merlin.models.tf.utils.batch_utils import TFModelEncode
+from merlin.models.tf.utils.batch_utils import ArraySink, TFModelEncode
 from merlin.schema import Tags
 
+_DEFAULT_BLOCK_SIZE = 65536
+_INDEX_METADATA = "index.json"
+
 
 @tf.keras.utils.register_keras_serializable(package="merlin_models")
 class IndexBlock(Block):
+    """Index of candidates embeddings.
+
+    The candidates can be replaced wholesale with `update`, or changed incrementally
+    with `upsert` and `delete`, which only touch the rows of the changed ids: the
+    first incremental change builds an id -> row map, deleted rows are masked out of
+    the search and reused by the next inserted ids, and the rows are compacted in a
+    background thread once more than `compaction_threshold` of them are deleted.
+    `set_availability` restricts the searches to a subset of the candidates (e.g.
+    the items in stock), without removing the others from the index. It is supported
+    by all the indices, including the ones that can only be rebuilt with `update`,
+    and is kept when the index is rebuilt or saved.
+
+    An index can be saved with `save` and restored with `load`, which memory-maps
+    the saved arrays by default so that the processes serving the same index share
+    it through the page cache instead of rebuilding it.
+    """
+
+    # fraction of deleted rows triggering a background compaction
+    compaction_threshold = 0.25
+    _incremental_updates = True
+
     def __init__(self, values: tf.Tensor, ids: Optional[tf.Tensor] = None, **kwargs):
         super(IndexBlock, self).__init__(**kwargs)
         self.values = values
         self.ids = ids
+        # rows of the candidates and available rows, None until the first
+        # `upsert`, `delete` or `set_availability`
+        self.mask, self.available = None, None
+        # (allow, deny) ids set by `set_availability`, None if all the ids are available
+        self._availability = None
+        self._slots = None
+        self._id_lookup = None
 
     @classmethod
     def from_dataset(
@@ -52,10 +91,21 @@ class IndexBlock(Block):
 
     @classmethod
     def from_block(
-        cls, block: Block, data: merlin.io.Dataset, id_column: Optional[str] = None, **kwargs
+        cls,
+        block: Block,
+        data: merlin.io.Dataset,
+        id_column: Optional[str] = None,
+        num_workers: int = 4,
+        mmap_path: Optional[str] = None,
+        check_unique_ids: bool = True,
+        **kwargs,
     ) -> "IndexBlock":
         """Build candidates embeddings from applying `block` to a dataset of features `data`.
 
+        The partitions of `data` are encoded concurrently, straight into their rows of a
+        preallocated array of embeddings (see `ArraySink`), so that the build holds a
+        single copy of the embeddings, which is shared with the index.
+
         Parameters:
         -----------
         block: Block
@@ -66,6 +116,13 @@ class IndexBlock(Block):
             The candidates ids column name.
             Note, this will be inferred automatically if the block contains
             a schema with an item-id Tag.
+        num_workers: int
+            Number of partitions encoded concurrently. Defaults to 4.
+        mmap_path: Optional[str]
+            A directory where the embeddings and ids are written to memory-mapped
+            `.npy` files, which back the index, instead of in-memory arrays.
+        check_unique_ids: bool
+            Whether to check that the candidates ids are unique. Defaults to True.
         """
         if not id_column and getattr(block, "schema", None):
             tagged = block.schema.select_by_tag(Tags.ITEM_ID)
@@ -73,33 +130,386 @@ class IndexBlock(Block):
                 id_column = tagged.first.name
 
         model_encode = TFModelEncode(model=block, output_concat_func=np.concatenate)
+        sink = ArraySink(model_encode, id_column, output_path=mmap_path)
+        values, ids = sink.write(data, num_workers=num_workers)
+        if check_unique_ids and len(np.unique(ids)) != len(ids):
+            raise ValueError("Please make sure that `data` contains unique indices")
 
-        data = data.to_ddf()
-        block_outputs = data.map_partitions(
-            model_encode, filter_input_columns=[id_column]
-        ).compute()
-
-        block_outputs.set_index(id_column, inplace=True)
+        if mmap_path is None:
+            # the tensors share the memory of the arrays
+            values, ids = tf_utils.array_to_tensor(values), tf_utils.array_to_tensor(ids)
 
-        return cls.from_dataset(block_outputs, **kwargs)
+        return cls(values=values, ids=ids, **kwargs)
 
     @staticmethod
     def _check_unique_ids(data: DataFrameType):
         if data.index.to_series().nunique() != data.shape[0]:
             raise ValueError("Please make sure that `data` contains unique indices")
 
+    def build(self, input_shape):
+        if self._incremental_updates and not isinstance(self.values, (np.ndarray, type(None))):
+            # the candidates are read from variables, written in place by `update`,
+            # `upsert` and `delete`, so that the traced searches see the changes
+            with tf.init_scope():
+                self._write("values", self.values)
+                if self.ids is not None:
+                    self._write("ids", self.ids)
+        super(IndexBlock, self).build(input_shape)
+
     def update(self, values: tf.Tensor, ids: Optional[tf.Tensor] = None):
-        if len(tf.shape(values)) != 2:
+        """Replaces all the candidates.
+
+        The candidates are written in place into the variables of the index, so that the
+        searches already traced in a `tf.function` (e.g. by `Model.predict`) retrieve the
+        new candidates. The searches traced over memory-mapped candidates (see `load`)
+        keep reading the memory-mapped arrays.
+        """
+        if len(values.shape) != 2:
             raise ValueError(f"The candidates embeddings tensor must be 2D (got {values.shape}).")
-        _ids: tf.Tensor = ids if ids else tf.range(values.shape[0])
+        _ids: tf.Tensor = ids if ids is not None else tf.range(tf.shape(values)[0])
+
+        if isinstance(self.ids, tf.Variable) and tf.as_dtype(_ids.dtype).is_integer:
+            _ids = tf.cast(_ids, self.ids.dtype)
+        values = self._encode(values)
+        self._write("values", values)
+        self._write("ids", _ids)
+        if self.mask is not None:
+            self.mask.assign(tf.ones([tf.shape(values)[0]], dtype=tf.bool))
+        self._slots, self._id_lookup = None, None
+        self._apply_availability()
+        return self
+
+    def upsert(self, ids, values: tf.Tensor):
+        """Inserts the candidates `ids`, or replaces their embeddings if they are indexed.
+
+        New ids take the rows of deleted candidates first, then rows appended at the
+        end of the index (whose capacity grows geometrically), so the cost is
+        proportional to the number of upserted candidates.
+        """
+        ids = np.asarray(ids).reshape(-1)
+        # only the last occurrence of a duplicated id is kept
+        _, last = np.unique(ids[::-1], return_index=True)
+        keep = np.sort(len(ids) - 1 - last)
+        ids = ids[keep]
+        values = self._encode(tf.gather(tf.convert_to_tensor(values), keep))
+        if len(values.shape) != 2:
+            raise ValueError(f"The candidates embeddings tensor must be 2D (got {values.shape}).")
+
+        slots = self._incremental_slots()
+        with slots.lock:
+            rows = np.empty(len(ids), dtype=np.int64)
+            for i, item_id in enumerate(ids.tolist()):
+                row = slots.rows.get(item_id)
+                if row is None:
+                    if slots.free:
+                        row = slots.free.pop()
+                    else:
+                        row, slots.size = slots.size, slots.size + 1
+                    slots.rows[item_id] = row
+                rows[i] = row
+            self._reserve(slots.size)
+
+            rows = rows[:, None]
+            self.values.scatter_nd_update(rows, tf.cast(values, self.values.dtype))
+            self.ids.scatter_nd_update(rows, tf.cast(ids, self.ids.dtype))
+            self.mask.scatter_nd_update(rows, tf.ones([len(ids)], dtype=tf.bool))
+            self.available.scatter_nd_update(rows, slots.is_available(ids))
+            slots.version += 1
 
-        if self.ids:
-            self.ids.assign(_ids)
-        else:
-            self.ids = _ids
-        self.values.assign(values)
         return self
 
+    def delete(self, ids) -> int:
+        """Removes the candidates `ids` from the index, ignoring the ids not indexed.
+
+        Returns the number of removed candidates.
+        """
+        slots = self._incremental_slots()
+        with slots.lock:
+            ids = np.asarray(ids).reshape(-1).tolist()
+            rows = [slots.rows.pop(item_id) for item_id in ids if item_id in slots.rows]
+            if rows:
+                indices = np.asarray(rows, dtype=np.int64)[:, None]
+                self.mask.scatter_nd_update(indices, tf.zeros([len(rows)], dtype=tf.bool))
+                deleted = tf.fill([len(rows)], tf.cast(-1, self.ids.dtype))
+                self.ids.scatter_nd_update(indices, deleted)
+                slots.free.extend(rows)
+                slots.version += 1
+            compact = self._needs_compaction(slots)
+
+        if compact:
+            self._compact_in_background()
+
+        return len(rows)
+
+    def set_availability(self, allow=None, deny=None):
+        """Restricts the searches to the candidates of `allow` (all of them if None)
+        that are not in `deny`, e.g. to filter out the items out of stock.
+
+        The availability is a mask over the rows of the index, it isn't densified per
+        query and applies to the candidates upserted or rebuilt (`update`) later, and
+        to the index restored by `load`. `set_availability()` makes all the candidates
+        available again.
+
+        The approximate indices only return available candidates: IVF and PQ mask the
+        unavailable candidates of the scanned lists or blocks, and HNSW walks through
+        them without returning them. The top-k is padded with -inf scores when less
+        than `k` available candidates are found, e.g. in the lists probed by IVF.
+        """
+        allow = None if allow is None else np.asarray(allow).reshape(-1)
+        deny = None if deny is None else np.asarray(deny).reshape(-1)
+        self._availability = None if allow is None and deny is None else (allow, deny)
+
+        slots = self._slots
+        if slots is None:
+            self._apply_availability()
+            return self
+        with slots.lock:
+            self.available.assign(self._is_available(self.ids.numpy()))
+            slots.set_availability(allow, deny)
+            slots.version += 1
+
+        return self
+
+    def _is_available(self, ids: np.ndarray) -> np.ndarray:
+        """Availability of the candidates `ids`, see `set_availability`."""
+        if self._availability is None:
+            return np.ones(len(ids), dtype=bool)
+        allow, deny = self._availability
+        available = np.ones(len(ids), dtype=bool) if allow is None else np.isin(ids, allow)
+        if deny is not None:
+            available &= ~np.isin(ids, deny)
+        return available
+
+    def _apply_availability(self):
+        """Recomputes the mask of the available rows when the candidates are (re)built."""
+        if self._availability is None and self.available is None:
+            return
+        if self.ids is None:
+            ids = np.arange(int(self._num_candidates()))
+        else:
+            ids = np.asarray(self.ids)
+        self._write("available", self._is_available(ids))
+
+    def _write(self, name: str, value):
+        """Writes `value` into the variable `name` in place, so that the traced searches
+        see it, or replaces it by a variable with a dynamic number of rows when it isn't
+        a variable of the same dtype and row shape."""
+        variable = getattr(self, name)
+        if isinstance(variable, tf.Variable) and variable is value:
+            return
+        value = tf.convert_to_tensor(value)
+        if (
+            isinstance(variable, tf.Variable)
+            and variable.dtype == value.dtype
+            and variable.shape[1:] == value.shape[1:]
+        ):
+            variable.assign(value)
+        else:
+            setattr(self, name, tf.Variable(value, trainable=False, shape=[None] + value.shape[1:]))
+
+    def compact(self) -> bool:
+        """Packs the remaining candidates into contiguous rows, dropping the deleted ones.
+
+        The packed index is built from a snapshot of the candidates, without blocking
+        the searches nor the incremental changes, and is only swapped in if the index
+        didn't change meanwhile. Returns whether the index was compacted.
+        """
+        slots = self._slots
+        if slots is None:
+            return False
+        with slots.lock:
+            version = slots.version
+            mask, available, values, ids = (
+                v.read_value() for v in (self.mask, self.available, self.values, self.ids)
+            )
+
+        rows = tf.where(mask)[:, 0]
+        values, ids = tf.gather(values, rows), tf.gather(ids, rows)
+        available = tf.gather(available, rows)
+        row_of_id = {item_id: row for row, item_id in enumerate(ids.numpy().tolist())}
+
+        with slots.lock:
+            if slots.version != version or self._slots is not slots:
+                return False
+            self.values.assign(values)
+            self.ids.assign(ids)
+            self.mask.assign(tf.ones([len(row_of_id)], dtype=tf.bool))
+            self.available.assign(available)
+            slots.rows, slots.free, slots.size = row_of_id, [], len(row_of_id)
+            slots.version += 1
+
+        return True
+
+    def _needs_compaction(self, slots: "_Slots") -> bool:
+        return len(slots.free) > self.compaction_threshold * max(slots.size, 1)
+
+    def _compact_in_background(self, max_attempts: int = 3):
+        slots = self._slots
+
+        def compact():
+            # a compaction is discarded when the index changes meanwhile
+            for _ in range(max_attempts):
+                if self._slots is not slots or not self._needs_compaction(slots):
+                    return
+                if self.compact():
+                    return
+
+        with slots.lock:
+            if slots.compaction is not None and slots.compaction.is_alive():
+                return
+            slots.compaction = threading.Thread(target=compact, daemon=True)
+            slots.compaction.start()
+
+    def _encode(self, values: tf.Tensor) -> tf.Tensor:
+        """Converts candidates embeddings to the representation stored by the index."""
+        return values
+
+    def save(self, path: str):
+        """Saves the index to the directory `path`.
+
+        Every array of the index (candidates embeddings, ids and the structures of the
+        approximate indices) is written as a flat `.npy` file, next to an `index.json`
+        file holding the class and the parameters of the index.
+        """
+        os.makedirs(path, exist_ok=True)
+        arrays = self._index_arrays()
+        if self._availability is not None:
+            allow, deny = self._availability
+            if allow is not None:
+                arrays["availability_allow"] = allow
+            if deny is not None:
+                arrays["availability_deny"] = deny
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), np.asarray(array))
+        metadata = dict(
+            class_name=tf.keras.utils.get_registered_name(type(self)),
+            config=self._index_config(),
+            arrays=list(arrays),
+        )
+        with open(os.path.join(path, _INDEX_METADATA), "w") as f:
+            json.dump(metadata, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, **kwargs) -> "IndexBlock":
+        """Restores an index saved with `save`, without rebuilding it.
+
+        Parameters:
+        -----------
+        path: str
+            The directory of the saved index.
+        mmap: bool
+            Whether to memory-map the large arrays of the index (read-only) instead of
+            reading them in memory, so that loading is instant and the processes
+            loading the same index share its pages. The top-k scans then read the
+            candidates one block at a time. Defaults to True.
+        **kwargs:
+            Parameters overriding the saved ones, e.g. `k`, `nprobe` or `ef_search`.
+        """
+        with open(os.path.join(path, _INDEX_METADATA)) as f:
+            metadata = json.load(f)
+        index_cls = tf.keras.utils.get_registered_object(metadata["class_name"])
+        if index_cls is None or not issubclass(index_cls, cls):
+            raise ValueError(f"{path} holds a {metadata['class_name']}, not a {cls.__name__}.")
+
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in metadata["arrays"]
+        }
+        allow = arrays.pop("availability_allow", None)
+        deny = arrays.pop("availability_deny", None)
+        index = index_cls(values=None, **dict(metadata["config"], **kwargs))
+        index._restore(arrays, mmap)
+        if allow is not None or deny is not None:
+            index.set_availability(allow=allow, deny=deny)
+
+        return index
+
+    def _index_arrays(self) -> Dict[str, np.ndarray]:
+        """The arrays saved by `save`."""
+        values, ids = self.values, self.ids
+        if ids is None:
+            ids = tf.range(tf.shape(values)[0])
+        if self.mask is not None:
+            rows = tf.where(self.mask)[:, 0]
+            values, ids = tf.gather(values, rows), tf.gather(ids, rows)
+
+        return dict(values=np.asarray(values), ids=np.asarray(ids))
+
+    def _index_config(self) -> dict:
+        """The parameters saved by `save`, passed to the constructor by `load`."""
+        return {}
+
+    def _restore(self, arrays: Dict[str, np.ndarray], mmap: bool):
+        """Restores the `arrays` of a saved index, memory-mapped if `mmap`."""
+        if mmap:
+            self.values, self.ids = arrays["values"], arrays["ids"]
+        else:
+            self.values, self.ids = tf.constant(arrays["values"]), tf.constant(arrays["ids"])
+
+    def _incremental_slots(self) -> "_Slots":
+        if not self._incremental_updates:
+            raise NotImplementedError(
+                f"{type(self).__name__} doesn't support incremental updates, "
+                "use `update` to rebuild it."
+            )
+        if self._slots is None:
+            num_rows = int(_num_rows(self.values))
+            ids = self.ids if self.ids is not None else tf.range(num_rows)
+            rows = {item_id: row for row, item_id in enumerate(np.asarray(ids).tolist())}
+            if len(rows) != num_rows:
+                raise ValueError("Incremental updates require unique candidates ids")
+
+            # variables with a dynamic number of rows, grown by `_reserve`
+            self._write("values", self.values)
+            self._write("ids", ids)
+            mask = tf.ones([num_rows], dtype=tf.bool)
+            self._write("mask", mask)
+            self._apply_availability()
+            if self.available is None:
+                self.available = tf.Variable(mask, trainable=False, shape=[None])
+            self._slots = _Slots(rows, size=len(rows))
+            self._slots.set_availability(*(self._availability or (None, None)))
+
+        return self._slots
+
+    def _reserve(self, capacity: int):
+        num_rows = int(tf.shape(self.values)[0])
+        if capacity <= num_rows:
+            return
+        padding = max(capacity, 2 * num_rows) - num_rows
+
+        zeros = tf.zeros([padding, self.values.shape[1]], dtype=self.values.dtype)
+        self.values.assign(tf.concat([self.values, zeros], 0))
+        self.ids.assign(tf.concat([self.ids, tf.fill([padding], tf.cast(-1, self.ids.dtype))], 0))
+        self.mask.assign(tf.concat([self.mask, tf.zeros([padding], dtype=tf.bool)], 0))
+        self.available.assign(tf.concat([self.available, tf.zeros([padding], dtype=tf.bool)], 0))
+
+    def _searchable(self, start=0, size=None) -> Optional[tf.Tensor]:
+        """Mask of the rows (`start` to `start + size`) that can be retrieved, None if
+        all of them can."""
+        if self.available is None:
+            return None
+        end = None if size is None else start + size
+        if self.mask is None:
+            return self.available[start:end]
+        return tf.logical_and(self.mask[start:end], self.available[start:end])
+
+    def _lookup_rows(self, ids: tf.Tensor) -> tf.Tensor:
+        """Rows of the candidates `ids`, -1 for the ids that are not indexed."""
+
+        def lookup(ids):
+            slots = self._slots
+            if slots is not None:
+                with slots.lock:
+                    return np.array([slots.rows.get(i, -1) for i in ids.tolist()], dtype=np.int64)
+            if self._id_lookup is None or self._id_lookup.ids is not self.ids:
+                self._id_lookup = _IdLookup(self.ids)
+            return self._id_lookup.rows(ids)
+
+        rows = tf.numpy_function(lookup, [ids], tf.int64)
+        rows.set_shape(ids.shape)
+        return rows
+
     def call(self, inputs: tf.Tensor, **kwargs) -> tf.Tensor:
         return self.values[inputs]
 
@@ -132,12 +542,76 @@ class TopKIndexBlock(IndexBlock):
             The pre-computed embedddings of candidates.
         ids: tf.Tensor
             The candidates ids.
+        block_size: Optional[int]
+            Number of candidates scored at once. When set, the candidates are scanned
+            in blocks of `block_size` items and a running top-k is merged with the
+            top-k of every block, so that memory is O(batch * (block_size + k))
+            instead of O(batch * num_candidates) for the full score matrix.
+            Defaults to None (scores all the candidates at once).
+        quantization: Optional[str]
+            Set to "int8" to store the candidates embeddings with per-dimension int8
+            scalar quantization, `values ~ offset + scale * int8_values`, which uses
+            4x less memory than float32 embeddings. The queries are scaled once and
+            scored against the int8 rows, which are converted to float one block of
+            `block_size` (by default 65536) candidates at a time, so the dequantized
+            embeddings are never materialized. Defaults to None (float embeddings).
     """
 
-    def __init__(self, k, values: tf.Tensor, ids: Optional[tf.Tensor] = None, **kwargs):
+    def __init__(
+        self,
+        k,
+        values: tf.Tensor,
+        ids: Optional[tf.Tensor] = None,
+        block_size: Optional[int] = None,
+        quantization: Optional[str] = None,
+        **kwargs,
+    ):
         self._k = k
+        self.block_size = block_size
+        self.quantization = quantization
+        self.scale, self.offset = None, None
+        if quantization == "int8":
+            if values is not None:
+                values, self.scale, self.offset = _quantize_int8(values)
+        elif quantization is not None:
+            raise ValueError(f"Unsupported quantization: {quantization}, expected 'int8'.")
         super(TopKIndexBlock, self).__init__(values, ids, **kwargs)
 
+    def build(self, input_shape):
+        if self.quantization and self._incremental_updates:
+            with tf.init_scope():
+                self._write("scale", self.scale)
+                self._write("offset", self.offset)
+        super(TopKIndexBlock, self).build(input_shape)
+
+    def update(self, values: tf.Tensor, ids: Optional[tf.Tensor] = None):
+        if self.quantization:
+            _, scale, offset = _quantize_int8(values)
+            self._write("scale", scale)
+            self._write("offset", offset)
+        return super().update(values, ids)
+
+    def _encode(self, values: tf.Tensor) -> tf.Tensor:
+        if self.quantization:
+            # new candidates are quantized with the ranges of the indexed ones
+            values = tf.round((tf.cast(values, tf.float32) - self.offset) / self.scale)
+            return tf.cast(tf.clip_by_value(values, -128.0, 127.0), tf.int8)
+        return values
+
+    def _index_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = super()._index_arrays()
+        if self.quantization:
+            arrays.update(scale=np.asarray(self.scale), offset=np.asarray(self.offset))
+        return arrays
+
+    def _index_config(self) -> dict:
+        return dict(k=self._k, block_size=self.block_size, quantization=self.quantization)
+
+    def _restore(self, arrays: Dict[str, np.ndarray], mmap: bool):
+        super()._restore(arrays, mmap)
+        if self.quantization:
+            self.scale, self.offset = tf.constant(arrays["scale"]), tf.constant(arrays["offset"])
+
     @classmethod
     def from_block(  # type: ignore
         cls,
@@ -166,10 +640,21 @@ class TopKIndexBlock(IndexBlock):
             The candidates ids column name.
             Note, this will be inferred automatically if the block contains
             a schema with an item-id Tag.
+        num_workers: int
+            Number of partitions encoded concurrently, see `IndexBlock.from_block`.
+        mmap_path: Optional[str]
+            A directory of memory-mapped files backing the embeddings of the index,
+            see `IndexBlock.from_block`.
+        block_size: Optional[int]
+            Number of candidates scored at once, see `TopKIndexBlock`.
+        quantization: Optional[str]
+            Set to "int8" to quantize the candidates embeddings, see `TopKIndexBlock`.
         """
         return super().from_block(block=block, data=data, id_column=id_column, k=k, **kwargs)
 
-    def call(self, inputs: tf.Tensor, k=None, **kwargs) -> Union[tf.Tensor, tf.Tensor]:
+    def call(
+        self, inputs: tf.Tensor, k=None, exclude=None, **kwargs
+    ) -> Union[tf.Tensor, tf.Tensor]:
         """
         Compute Top-k scores and related indices from query inputs
 
@@ -180,15 +665,88 @@ class TopKIndexBlock(IndexBlock):
         k: int
             Number of top candidates to retrieve
             Defaults to constructor `_k` parameter.
+        exclude: Optional[Union[tf.RaggedTensor, tf.Tensor]]
+            Candidates ids excluded from the top-k of every query, e.g. the items
+            already seen by the user: a ragged tensor (or a tensor padded with ids
+            that are not indexed) of the excluded ids of every query, or a `uint8`
+            tensor of bitsets where bit `id % 8` of byte `id // 8` is set for the
+            excluded ids. The excluded candidates are masked before the top-k, so
+            that `k` candidates are retrieved whenever enough of them remain.
         Returns
         -------
         top_scores, top_indices: tf.Tensor, tf.Tensor
             2D Tensors with the scores for the top-k candidates and related ids.
         """
         k = k if k is not None else self._k
-        scores = tf.matmul(inputs, self.values, transpose_b=True)
-        top_scores, top_indices = tf.math.top_k(scores, k=k)
-        top_indices = tf.gather(self.ids, top_indices)
+        exclusions = _Exclusions(self, exclude) if exclude is not None else None
+        if self.quantization:
+            # <q, offset + scale * x> = <q * scale, x> + <q, offset>, where the last
+            # term is the same for all the candidates and doesn't change the ranking
+            queries = inputs * self.scale
+            top_scores, top_indices = self._blocked_top_k(
+                queries, k, self.block_size or _DEFAULT_BLOCK_SIZE, exclusions
+            )
+            top_scores += tf.linalg.matvec(inputs, self.offset)[:, None]
+        elif self.block_size or isinstance(self.values, np.ndarray):
+            # memory-mapped candidates are always read one block at a time
+            top_scores, top_indices = self._blocked_top_k(
+                inputs, k, self.block_size or _DEFAULT_BLOCK_SIZE, exclusions
+            )
+        else:
+            scores = tf.matmul(inputs, self.values, transpose_b=True)
+            searchable = self._searchable()
+            if searchable is not None:
+                scores = tf.where(searchable, scores, tf.constant(-np.inf, dtype=scores.dtype))
+            if exclusions is not None:
+                scores = exclusions.mask_block(scores, 0)
+            top_scores, top_indices = tf.math.top_k(scores, k=k)
+        top_indices = _gather_rows(self.ids, top_indices)
+
+        return top_scores, top_indices
+
+    def _score_block(self, inputs: tf.Tensor, start, block_size: int) -> tf.Tensor:
+        """Scores of the candidates `start` to `start + block_size` for the queries `inputs`."""
+        block = _slice_rows(self.values, start, block_size)
+        if block.dtype != inputs.dtype:
+            block = tf.cast(block, inputs.dtype)
+        scores = tf.matmul(inputs, block, transpose_b=True)
+        searchable = self._searchable(start, block_size)
+        if searchable is not None:
+            scores = tf.where(searchable, scores, tf.constant(-np.inf, dtype=scores.dtype))
+        return scores
+
+    def _num_candidates(self):
+        return _num_rows(self.values)
+
+    def _blocked_top_k(
+        self, inputs: tf.Tensor, k: int, block_size: int, exclusions: "_Exclusions" = None
+    ):
+        """Top-k scores and positions of the candidates, scanned by blocks of candidates."""
+        num_candidates = self._num_candidates()
+        batch_size = tf.shape(inputs)[0]
+        top_scores = tf.fill([batch_size, k], tf.constant(-np.inf, dtype=inputs.dtype))
+        top_indices = tf.zeros([batch_size, k], dtype=tf.int32)
+
+        def scan_block(start, top_scores, top_indices):
+            scores = self._score_block(inputs, start, block_size)
+            if exclusions is not None:
+                scores = exclusions.mask_block(scores, start)
+            block_scores, block_indices = tf.math.top_k(
+                scores, k=tf.minimum(k, tf.shape(scores)[1])
+            )
+            # the running top-k comes first so that ties are broken as with a full scan
+            scores = tf.concat([top_scores, block_scores], axis=1)
+            indices = tf.concat([top_indices, block_indices + start], axis=1)
+            top_scores, positions = tf.math.top_k(scores, k=k)
+            top_indices = tf.gather(indices, positions, batch_dims=1)
+
+            return start + block_size, top_scores, top_indices
+
+        _, top_scores, top_indices = tf.while_loop(
+            lambda start, *_: start < num_candidates,
+            scan_block,
+            (tf.constant(0), top_scores, top_indices),
+        )
 
         return top_scores, top_indices
 
@@ -231,3 +789,1544 @@ class TopKIndexBlock(IndexBlock):
     def compute_output_shape(self, input_shape):
         batch_size = input_shape[0]
         return tf.TensorShape((batch_size, self._k)), tf.TensorShape((batch_size, self._k))
+
+
+@tf.keras.utils.register_keras_serializable(package="merlin_models")
+class IVFTopKIndexBlock(TopKIndexBlock):
+    """Approximate Top-K index based on an inverted file (IVF).
+
+    At build time, the candidates embeddings are clustered with k-means into `nlist`
+    lists. A query only scores the candidates of the `nprobe` lists whose centroids
+    have the highest inner product with the query, so the cost of a query is roughly
+    `nlist + nprobe / nlist * num_candidates` dot products instead of
+    `num_candidates` for the exact `TopKIndexBlock`. Increasing `nprobe` trades
+    latency for recall, with `nprobe=nlist` being an exact (but slower) search.
+
+    Example usage::
+        index = IVFTopKIndexBlock.from_block(
+            model.retrieval_block.item_block(), data=items, k=20, nlist=1024, nprobe=16
+        )
+
+    Parameters:
+    -----------
+        k: int
+            Number of top candidates to retrieve.
+        values: tf.Tensor
+            The pre-computed embedddings of candidates.
+        ids: tf.Tensor
+            The candidates ids.
+        nlist: int
+            Number of lists (k-means clusters). Defaults to 100.
+        nprobe: int
+            Number of lists scanned for every query. Defaults to 10.
+        kmeans_iterations: int
+            Number of k-means iterations. Defaults to 20.
+        max_points_per_centroid: int
+            k-means is trained on a sample of at most `nlist * max_points_per_centroid`
+            candidates. Defaults to 256.
+        seed: Optional[int]
+            Seed of the k-means initialization and sampling.
+        quantization: Optional[str]
+            Set to "int8" to store the candidates of the lists with int8 scalar
+            quantization, see `TopKIndexBlock`.
+    """
+
+    _incremental_updates = False
+
+    def __init__(
+        self,
+        k,
+        values: tf.Tensor,
+        ids: Optional[tf.Tensor] = None,
+        nlist: int = 100,
+        nprobe: int = 10,
+        kmeans_iterations: int = 20,
+        max_points_per_centroid: int = 256,
+        seed: Optional[int] = None,
+        **kwargs,
+    ):
+        super(IVFTopKIndexBlock, self).__init__(k, values, ids, **kwargs)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.kmeans_iterations = kmeans_iterations
+        self.max_points_per_centroid = max_points_per_centroid
+        self.seed = seed
+        if values is not None:
+            self._build(values, ids)
+
+    def _build(self, values, ids=None):
+        values = np.asarray(values, dtype=np.float32)
+        if len(values.shape) != 2:
+            raise ValueError(f"The candidates embeddings tensor must be 2D (got {values.shape}).")
+        ids = np.arange(values.shape[0]) if ids is None else np.asarray(ids)
+        nlist = min(self.nlist, values.shape[0])
+
+        rng = np.random.RandomState(self.seed)
+        sample_size = nlist * self.max_points_per_centroid
+        sample = values
+        if values.shape[0] > sample_size:
+            sample = values[rng.choice(values.shape[0], sample_size, replace=False)]
+        centroids = _kmeans(sample, nlist, self.kmeans_iterations, rng)
+
+        # store the candidates grouped by list, so that every list is a contiguous slice
+        assignments = _nearest_centroids(values, centroids)
+        order = np.argsort(assignments, kind="stable")
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))])
+
+        if self.quantization:
+            self.values, self.scale, self.offset = _quantize_int8(values[order])
+        else:
+            self.values = tf.constant(values[order])
+        self.ids = tf.constant(ids[order])
+        self.centroids = tf.constant(centroids)
+        self.list_offsets = tf.constant(list_offsets, dtype=tf.int32)
+        self._apply_availability()
+
+    def update(self, values: tf.Tensor, ids: Optional[tf.Tensor] = None):
+        self._build(values, ids)
+        return self
+
+    def _index_arrays(self) -> Dict[str, np.ndarray]:
+        return dict(
+            super()._index_arrays(),
+            centroids=np.asarray(self.centroids),
+            list_offsets=np.asarray(self.list_offsets),
+        )
+
+    def _index_config(self) -> dict:
+        return dict(
+            super()._index_config(),
+            nlist=self.nlist,
+            nprobe=self.nprobe,
+            kmeans_iterations=self.kmeans_iterations,
+            max_points_per_centroid=self.max_points_per_centroid,
+            seed=self.seed,
+        )
+
+    def _restore(self, arrays: Dict[str, np.ndarray], mmap: bool):
+        super()._restore(arrays, mmap)
+        self.centroids = tf.constant(arrays["centroids"])
+        self.list_offsets = tf.constant(arrays["list_offsets"])
+
+    def call(
+        self, inputs: tf.Tensor, k=None, exclude=None, **kwargs
+    ) -> Union[tf.Tensor, tf.Tensor]:
+        """
+        Compute approximate Top-k scores and related ids from query inputs
+
+        Parameters:
+        ----------
+        inputs: tf.Tensor
+            Tensor of pre-computed query embeddings.
+        k: int
+            Number of top candidates to retrieve
+            Defaults to constructor `_k` parameter.
+        exclude: Optional[Union[tf.RaggedTensor, tf.Tensor]]
+            Candidates ids excluded from the top-k of every query, see
+            `TopKIndexBlock.call`.
+        Returns
+        -------
+        top_scores, top_indices: tf.Tensor, tf.Tensor
+            2D Tensors with the scores for the top-k candidates and related ids.
+        """
+        k = k if k is not None else self._k
+        nprobe = min(self.nprobe, self.centroids.shape[0])
+
+        _, probes = tf.math.top_k(tf.matmul(inputs, self.centroids, transpose_b=True), nprobe)
+        starts = tf.gather(self.list_offsets, probes)
+        limits = tf.gather(self.list_offsets, probes + 1)
+
+        # positions of the candidates of the probed lists, padded with -1
+        candidates = tf.RaggedTensor.from_row_lengths(
+            tf.ragged.range(tf.reshape(starts, [-1]), tf.reshape(limits, [-1])).flat_values,
+            tf.reduce_sum(limits - starts, axis=1),
+        ).to_tensor(default_value=-1)
+        num_missing = tf.maximum(k - tf.shape(candidates)[1], 0)
+        candidates = tf.pad(candidates, [[0, 0], [0, num_missing]], constant_values=-1)
+
+        queries = inputs * self.scale if self.quantization else inputs
+        # column of the first candidate of every probed list in the rows of `candidates`
+        columns = tf.cumsum(limits - starts, axis=1, exclusive=True)
+        scores = self._score_lists(queries, probes, columns, tf.shape(candidates)[1])
+        if self.quantization:
+            # same as `TopKIndexBlock.call`, the offset term doesn't change the ranking
+            scores += tf.linalg.matvec(inputs, self.offset)[:, None]
+
+        valid = candidates >= 0
+        candidates = tf.maximum(candidates, 0)
+        searchable = self._searchable()
+        if searchable is not None:
+            valid = tf.logical_and(valid, tf.gather(searchable, candidates))
+        scores = tf.where(valid, scores, tf.constant(-np.inf, dtype=scores.dtype))
+        if exclude is not None:
+            scores = _Exclusions(self, exclude).mask_rows(scores, candidates)
+
+        top_scores, top_positions = tf.math.top_k(scores, k=k)
+        top_indices = _gather_rows(self.ids, tf.gather(candidates, top_positions, batch_dims=1))
+
+        return top_scores, top_indices
+
+    def _score_lists(self, queries: tf.Tensor, probes: tf.Tensor, columns, num_columns):
+        """Scores of the candidates of the probed lists, laid out as the rows of candidates
+        of `call`.
+
+        Every probed list is scored with a single matmul against the queries that probe
+        it, so that the embeddings of a list are read once per batch and the memory is
+        O(batch * nprobe * list size) scores, instead of gathering a
+        [batch, nprobe * list size, dim] tensor of embeddings.
+        """
+        batch_size, nprobe = tf.shape(probes)[0], tf.shape(probes)[1]
+        # the (query, probe) pairs, grouped by list
+        order = tf.argsort(tf.reshape(probes, [-1]), stable=True)
+        lists, _, counts = tf.unique_with_counts(tf.gather(tf.reshape(probes, [-1]), order))
+        pair_starts = tf.concat([[0], tf.cumsum(counts)], axis=0)
+        pair_queries = order // nprobe
+        pair_columns = tf.gather(tf.reshape(columns, [-1]), order)
+
+        def score_list(i, positions, list_scores):
+            start = self.list_offsets[lists[i]]
+            size = self.list_offsets[lists[i] + 1] - start
+            pairs = tf.range(pair_starts[i], pair_starts[i + 1])
+            list_queries = tf.gather(pair_queries, pairs)
+            block = tf.cast(_slice_rows(self.values, start, size), queries.dtype)
+            scores = tf.matmul(tf.gather(queries, list_queries), block, transpose_b=True)
+            cols = tf.gather(pair_columns, pairs)[:, None] + tf.range(size)[None, :]
+            flat_positions = list_queries[:, None] * num_columns + cols
+
+            return (
+                i + 1,
+                positions.write(i, tf.reshape(flat_positions, [-1])),
+                list_scores.write(i, tf.reshape(scores, [-1])),
+            )
+
+        num_lists = tf.shape(lists)[0]
+        _, positions, list_scores = tf.while_loop(
+            lambda i, *_: i < num_lists,
+            score_list,
+            (
+                tf.constant(0),
+                tf.TensorArray(tf.int32, size=num_lists, infer_shape=False),
+                tf.TensorArray(queries.dtype, size=num_lists, infer_shape=False),
+            ),
+        )
+        # every candidate of a row is scored once, the padding columns stay at 0
+        scores = tf.scatter_nd(
+            positions.concat()[:, None], list_scores.concat(), [batch_size * num_columns]
+        )
+
+        return tf.reshape(scores, [batch_size, num_columns])
+
+
+@tf.keras.utils.register_keras_serializable(package="merlin_models")
+class PQTopKIndexBlock(TopKIndexBlock):
+    """Top-K index over product-quantized (PQ/OPQ) candidates embeddings.
+
+    The embeddings are split into `num_subvectors` sub-vectors, and every sub-vector is
+    replaced by the index of its nearest centroid in a codebook of `num_centroids`
+    centroids learned with k-means. With 256 centroids, an embedding of dimension `d`
+    is stored in `num_subvectors` bytes instead of `4 * d` bytes.
+    With `opq=True`, an orthogonal rotation of the embeddings is learned jointly
+    with the codebooks to balance the sub-spaces (Optimized Product Quantization),
+    which reduces the quantization error. Inner products are preserved by the rotation.
+
+    Queries are not quantized: the scores are computed with asymmetric distance
+    computation, i.e. a lookup table of the inner products between the query
+    sub-vectors and the centroids is built once per query, and the score of a
+    candidate is the sum of `num_subvectors` lookups. The candidates are scanned by
+    blocks of `block_size` (see `TopKIndexBlock`). The top `rerank` candidates can
+    then be re-ranked with their exact scores, which requires keeping the float
+    embeddings in memory as well; see `memory_usage` for the footprint of the index.
+
+    Parameters:
+    -----------
+        k: int
+            Number of top candidates to retrieve.
+        values: tf.Tensor
+            The pre-computed embedddings of candidates.
+        ids: tf.Tensor
+            The candidates ids.
+        num_subvectors: int
+            Number of sub-vectors (bytes per candidate with 256 centroids),
+            must divide the embeddings dimension. Defaults to 8.
+        num_centroids: int
+            Number of centroids of every sub-space codebook, at most 256 so that codes
+            are stored as uint8. Defaults to 256.
+        opq: bool
+            Whether to learn an OPQ rotation. Defaults to False.
+        opq_iterations: int
+            Number of alternate optimizations of the rotation and the codebooks.
+            Defaults to 10.
+        rerank: Optional[int]
+            Number of candidates (at least `k`) retrieved with the quantized scores
+            and re-ranked with the exact scores. Defaults to None (no re-ranking).
+        block_size: Optional[int]
+            Number of candidates scored at once. Defaults to 65536.
+        kmeans_iterations: int
+            Number of k-means iterations to train the codebooks. Defaults to 20.
+        max_points_per_centroid: int
+            The codebooks are trained on a sample of at most
+            `num_centroids * max_points_per_centroid` candidates. Defaults to 256.
+        seed: Optional[int]
+            Seed of the training.
+    """
+
+    _incremental_updates = False
+
+    def __init__(
+        self,
+        k,
+        values: tf.Tensor,
+        ids: Optional[tf.Tensor] = None,
+        num_subvectors: int = 8,
+        num_centroids: int = 256,
+        opq: bool = False,
+        opq_iterations: int = 10,
+        rerank: Optional[int] = None,
+        block_size: Optional[int] = 65536,
+        kmeans_iterations: int = 20,
+        max_points_per_centroid: int = 256,
+        seed: Optional[int] = None,
+        **kwargs,
+    ):
+        if num_centroids > 256:
+            raise ValueError(f"num_centroids must be at most 256 (got {num_centroids}).")
+        super(PQTopKIndexBlock, self).__init__(k, values, ids, block_size=block_size, **kwargs)
+        self.num_subvectors = num_subvectors
+        self.num_centroids = num_centroids
+        self.opq = opq
+        self.opq_iterations = opq_iterations
+        self.rerank = rerank
+        self.kmeans_iterations = kmeans_iterations
+        self.max_points_per_centroid = max_points_per_centroid
+        self.seed = seed
+        if values is not None:
+            self._build(values, ids)
+
+    def _build(self, values, ids=None):
+        values = np.asarray(values, dtype=np.float32)
+        if len(values.shape) != 2:
+            raise ValueError(f"The candidates embeddings tensor must be 2D (got {values.shape}).")
+        if values.shape[1] % self.num_subvectors:
+            raise ValueError(
+                f"The embeddings dimension ({values.shape[1]}) must be divisible "
+                f"by num_subvectors ({self.num_subvectors})."
+            )
+        num_centroids = min(self.num_centroids, values.shape[0])
+
+        rng = np.random.RandomState(self.seed)
+        sample = values
+        sample_size = num_centroids * self.max_points_per_centroid
+        if values.shape[0] > sample_size:
+            sample = values[rng.choice(values.shape[0], sample_size, replace=False)]
+
+        rotation = np.eye(values.shape[1], dtype=np.float32)
+        if self.opq:
+            for _ in range(self.opq_iterations):
+                rotated = sample @ rotation
+                codebooks = self._train_codebooks(rotated, num_centroids, 4, rng)
+                reconstructed = _pq_decode(_pq_encode(rotated, codebooks), codebooks)
+                # orthogonal Procrustes: the rotation best mapping sample to its reconstruction
+                u, _, vt = np.linalg.svd(sample.T @ reconstructed)
+                rotation = (u @ vt).astype(np.float32)
+
+        rotated = values @ rotation
+        codebooks = self._train_codebooks(
+            sample @ rotation, num_centroids, self.kmeans_iterations, rng
+        )
+
+        self.rotation = tf.constant(rotation) if self.opq else None
+        self.codebooks = tf.constant(codebooks)
+        self.codes = tf.constant(_pq_encode(rotated, codebooks).astype(np.uint8))
+        self.values = tf.constant(values) if self.rerank else None
+        self.ids = tf.constant(np.arange(values.shape[0]) if ids is None else np.asarray(ids))
+        self._apply_availability()
+
+    def _index_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = dict(codes=np.asarray(self.codes), codebooks=np.asarray(self.codebooks))
+        arrays["ids"] = np.asarray(self.ids)
+        if self.rotation is not None:
+            arrays["rotation"] = np.asarray(self.rotation)
+        if self.values is not None:
+            arrays["values"] = np.asarray(self.values)
+        return arrays
+
+    def _index_config(self) -> dict:
+        return dict(
+            super()._index_config(),
+            num_subvectors=self.num_subvectors,
+            num_centroids=self.num_centroids,
+            opq=self.opq,
+            opq_iterations=self.opq_iterations,
+            rerank=self.rerank,
+            kmeans_iterations=self.kmeans_iterations,
+            max_points_per_centroid=self.max_points_per_centroid,
+            seed=self.seed,
+        )
+
+    def _restore(self, arrays: Dict[str, np.ndarray], mmap: bool):
+        def restore(name, small=False):
+            array = arrays.get(name)
+            if array is None or (mmap and not small):
+                return array
+            return tf.constant(array)
+
+        self.codes, self.ids, self.values = restore("codes"), restore("ids"), restore("values")
+        self.codebooks, self.rotation = restore("codebooks", True), restore("rotation", True)
+
+    def _train_codebooks(self, values, num_centroids, iterations, rng):
+        subvectors = np.split(values, self.num_subvectors, axis=1)
+        return np.stack([_kmeans(sub, num_centroids, iterations, rng) for sub in subvectors])
+
+    def update(self, values: tf.Tensor, ids: Optional[tf.Tensor] = None):
+        self._build(values, ids)
+        return self
+
+    def memory_usage(self) -> dict:
+        """Returns the memory footprint (in bytes) of the index components."""
+
+        def nbytes(tensor):
+            if tensor is None:
+                return 0
+            return int(np.prod(tensor.shape)) * tf.as_dtype(tensor.dtype).size
+
+        usage = {
+            "codes": nbytes(self.codes),
+            "codebooks": nbytes(self.codebooks),
+            "rotation": nbytes(self.rotation),
+            "rerank_values": nbytes(self.values),
+            "ids": nbytes(self.ids),
+        }
+        usage["total"] = sum(usage.values())
+        num_candidates, dim = self.codes.shape[0], self.codebooks.shape[0] * self.codebooks.shape[2]
+        usage["float32_values"] = num_candidates * dim * 4
+        usage["compression_ratio"] = usage["float32_values"] / max(usage["codes"], 1)
+
+        return usage
+
+    def _num_candidates(self):
+        return _num_rows(self.codes)
+
+    def _score_block(self, inputs: tf.Tensor, start, block_size: int) -> tf.Tensor:
+        # `inputs` are the lookup tables of the queries: [batch, num_subvectors, num_centroids],
+        # transposed so that the lookups gather contiguous rows
+        tables = tf.transpose(inputs, [1, 2, 0])
+        codes = tf.cast(_slice_rows(self.codes, start, block_size), tf.int32)
+        scores = tf.gather(tables[0], codes[:, 0])
+        for i in range(1, self.num_subvectors):
+            scores += tf.gather(tables[i], codes[:, i])
+        scores = tf.transpose(scores)
+
+        searchable = self._searchable(start, block_size)
+        if searchable is not None:
+            scores = tf.where(searchable, scores, tf.constant(-np.inf, dtype=scores.dtype))
+        return scores
+
+    def call(
+        self, inputs: tf.Tensor, k=None, exclude=None, **kwargs
+    ) -> Union[tf.Tensor, tf.Tensor]:
+        """
+        Compute approximate Top-k scores and related ids from query inputs
+
+        Parameters:
+        ----------
+        inputs: tf.Tensor
+            Tensor of pre-computed query embeddings.
+        k: int
+            Number of top candidates to retrieve
+            Defaults to constructor `_k` parameter.
+        exclude: Optional[Union[tf.RaggedTensor, tf.Tensor]]
+            Candidates ids excluded from the top-k of every query, see
+            `TopKIndexBlock.call`.
+        Returns
+        -------
+        top_scores, top_indices: tf.Tensor, tf.Tensor
+            2D Tensors with the scores for the top-k candidates and related ids.
+        """
+        k = k if k is not None else self._k
+        queries = inputs if self.rotation is None else tf.matmul(inputs, self.rotation)
+        queries = tf.reshape(queries, [tf.shape(queries)[0], self.num_subvectors, -1])
+        tables = tf.einsum("bmd,mcd->bmc", queries, self.codebooks)
+
+        num_candidates = max(k, self.rerank or 0)
+        block_size = self.block_size or self.codes.shape[0]
+        exclusions = _Exclusions(self, exclude) if exclude is not None else None
+        top_scores, top_positions = self._blocked_top_k(
+            tables, num_candidates, block_size, exclusions
+        )
+
+        if self.rerank:
+            exact_scores = tf.einsum(
+                "bd,bcd->bc", inputs, _gather_rows(self.values, top_positions)
+            )
+            # the excluded and unavailable candidates stay out of the top-k
+            exact_scores = tf.where(top_scores > -np.inf, exact_scores, top_scores)
+            top_scores, reranked = tf.math.top_k(exact_scores, k=k)
+            top_positions = tf.gather(top_positions, reranked, batch_dims=1)
+
+        return top_scores, _gather_rows(self.ids, top_positions)
+
+
+@tf.keras.utils.register_keras_serializable(package="merlin_models")
+class HNSWTopKIndexBlock(TopKIndexBlock):
+    """Approximate Top-K index based on a Hierarchical Navigable Small World graph.
+
+    The candidates are the nodes of a multi-layer proximity graph (inner-product
+    similarity) and a query greedily walks the graph from its entry point, keeping
+    the `ef_search` best candidates found, so that it only scores a few thousand
+    candidates whatever the size of the catalog. This makes it suited to online
+    retrieval with small query batches, where a brute-force `matmul` over the whole
+    catalog is wasteful; large batches are better served by `TopKIndexBlock`.
+
+    The graph is built by inserting the candidates in batches of 1024, whose
+    neighbors are searched at once with vectorized numpy operations, new candidates
+    can be inserted later with `add`, and the index can be saved with `save` and
+    restored (memory-mapped) with `HNSWTopKIndexBlock.load`. The search runs on CPU
+    in numpy (through `tf.numpy_function`).
+
+    The build still costs about a millisecond per candidate on a CPU core (with the
+    default parameters), so it takes minutes for 100k candidates and is not suited
+    to catalogs of millions of items, better served by `IVFTopKIndexBlock` or
+    `PQTopKIndexBlock`.
+
+    Example usage::
+        recommender = model.to_top_k_recommender(
+            items, k=20, index_cls=HNSWTopKIndexBlock, M=16, ef_search=64
+        )
+
+    Parameters:
+    -----------
+        k: int
+            Number of top candidates to retrieve.
+        values: tf.Tensor
+            The pre-computed embedddings of candidates.
+        ids: tf.Tensor
+            The candidates ids.
+        M: int
+            Number of neighbors of every node in the upper layers of the graph (2 * M
+            in the bottom layer). Higher values improve recall at the expense of
+            memory and build time. Defaults to 16.
+        ef_construction: int
+            Size of the candidates list when inserting a candidate. Defaults to 100.
+        ef_search: int
+            Size of the candidates list when searching, at least `k`. Higher values
+            improve recall at the expense of latency. Defaults to 64.
+        seed: Optional[int]
+            Seed of the random levels of the nodes.
+    """
+
+    _incremental_updates = False
+    # number of candidates inserted at once by `add`
+    _insert_batch_size = 1024
+
+    def __init__(
+        self,
+        k,
+        values: tf.Tensor,
+        ids: Optional[tf.Tensor] = None,
+        M: int = 16,
+        ef_construction: int = 100,
+        ef_search: int = 64,
+        seed: Optional[int] = None,
+        **kwargs,
+    ):
+        super(HNSWTopKIndexBlock, self).__init__(k, values, ids, **kwargs)
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.seed = seed
+        self._rng = np.random.RandomState(seed)
+        self._level_multiplier = 1 / np.log(M)
+
+        self._values = np.zeros((0, 0), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        # neighbors of the nodes for every layer, padded with -1
+        self._neighbors: List[np.ndarray] = []
+        self._levels = np.zeros(0, dtype=np.int32)
+        self._entry_point = -1
+        self._size = 0
+        if values is not None:
+            self.add(values, ids)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, values, ids=None):
+        """Inserts new candidates in the graph."""
+        values = np.asarray(values, dtype=np.float32)
+        if len(values.shape) != 2:
+            raise ValueError(f"The candidates embeddings tensor must be 2D (got {values.shape}).")
+        if ids is None:
+            ids = np.arange(self._size, self._size + values.shape[0])
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        self._reserve(self._size + values.shape[0], values.shape[1])
+
+        for start in range(0, len(values), self._insert_batch_size):
+            end = start + self._insert_batch_size
+            self._insert_batch(values[start:end], ids[start:end])
+        self.values, self.ids = self._values[: self._size], self._ids[: self._size]
+        self._apply_availability()
+
+        return self
+
+    def update(self, values: tf.Tensor, ids: Optional[tf.Tensor] = None):
+        self._values = np.zeros((0, 0), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._levels = np.zeros(0, dtype=np.int32)
+        self._neighbors = []
+        self._size, self._entry_point = 0, -1
+        return self.add(values, ids)
+
+    def _reserve(self, capacity, dim):
+        if capacity <= len(self._ids):
+            return
+        capacity = max(capacity, 2 * len(self._ids))
+
+        def grow(array, fill):
+            grown = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            grown[: len(array)] = array
+            return grown
+
+        if self._values.shape[1] != dim:
+            self._values = np.zeros((0, dim), dtype=np.float32)
+        self._values = grow(self._values, 0)
+        self._ids = grow(self._ids, -1)
+        self._levels = grow(self._levels, -1)
+        self._neighbors = [grow(neighbors, -1) for neighbors in self._neighbors]
+
+    def _max_neighbors(self, level):
+        return 2 * self.M if level == 0 else self.M
+
+    def _insert_batch(self, values, ids):
+        """Inserts a batch of candidates. Their neighbors are searched at once in the
+        graph built before the batch, see `_search_layer_batch`, and by brute force
+        among the candidates of the batch inserted in the same layer."""
+        nodes = np.arange(self._size, self._size + len(values))
+        levels = -np.log(1.0 - self._rng.random_sample(len(values))) * self._level_multiplier
+        levels = levels.astype(np.int32)
+        capacity = len(self._ids)
+        while len(self._neighbors) <= levels.max():
+            max_neighbors = self._max_neighbors(len(self._neighbors))
+            self._neighbors.append(np.full((capacity, max_neighbors), -1, dtype=np.int32))
+
+        self._values[nodes], self._ids[nodes], self._levels[nodes] = values, ids, levels
+        self._size += len(nodes)
+
+        top_level = self._levels[self._entry_point] if self._entry_point >= 0 else -1
+        entry_points = np.full((len(nodes), 1), self._entry_point, dtype=np.int64)
+        for layer in range(max(top_level, levels.max()), -1, -1):
+            # the nodes above their level only lead to their entry point of the next layer
+            descending = np.flatnonzero((levels < layer) & (layer <= top_level))
+            if len(descending):
+                _, closest = self._search_layer_batch(
+                    values[descending], entry_points[descending], 1, layer
+                )
+                entry_points[descending] = -1
+                entry_points[descending, 0] = closest[:, 0]
+
+            inserted = np.flatnonzero(levels >= layer)
+            if len(inserted) == 0:
+                continue
+            queries = values[inserted]
+            if layer <= top_level:
+                scores, candidates = self._search_layer_batch(
+                    queries, entry_points[inserted], self.ef_construction, layer
+                )
+                # the nodes of the batch reached by the search are scored below
+                scores[candidates >= nodes[0]] = -np.inf
+            else:
+                scores = np.zeros((len(inserted), 0), dtype=np.float32)
+                candidates = np.zeros((len(inserted), 0), dtype=np.int64)
+            batch_scores = queries @ queries.T
+            np.fill_diagonal(batch_scores, -np.inf)
+            scores = np.concatenate([scores, batch_scores], axis=1)
+            candidates = np.concatenate(
+                [candidates, np.broadcast_to(nodes[inserted], batch_scores.shape)], axis=1
+            )
+            order = np.argsort(-scores, axis=1, kind="stable")[:, : self.ef_construction]
+            scores = np.take_along_axis(scores, order, axis=1)
+            candidates = np.take_along_axis(candidates, order, axis=1)
+            candidates[np.isneginf(scores)] = -1
+
+            neighbors = self._select_neighbors(candidates, scores, self.M)
+            self._neighbors[layer][nodes[inserted], : self.M] = neighbors
+            # the reverse links are added once the neighbors of the batch are set
+            self._connect(nodes[inserted], neighbors, layer)
+
+            if entry_points.shape[1] < candidates.shape[1]:
+                entry_points = np.pad(
+                    entry_points, [(0, 0), (0, candidates.shape[1] - entry_points.shape[1])],
+                    constant_values=-1,
+                )
+            entry_points[inserted] = -1
+            entry_points[inserted, : candidates.shape[1]] = candidates
+
+        if levels.max() > top_level:
+            self._entry_point = int(nodes[np.argmax(levels)])
+
+    def _connect(self, nodes, neighbors, layer):
+        """Links the `neighbors` (padded with -1) back to their `nodes`. The nodes
+        that get too many neighbors keep the most diverse ones, see `_select_neighbors`.
+        A node keeps at most its `max_neighbors` most similar new links."""
+        max_neighbors = self._max_neighbors(layer)
+        targets = neighbors.reshape(-1).astype(np.int64)
+        sources = np.repeat(nodes, neighbors.shape[1])
+        targets, sources = targets[targets >= 0], sources[targets >= 0]
+        similarities = np.einsum("ed,ed->e", self._values[targets], self._values[sources])
+
+        # the new links of every target, by decreasing similarity
+        order = np.lexsort((-similarities, targets))
+        targets, sources = targets[order], sources[order]
+        targets, starts, counts = np.unique(targets, return_index=True, return_counts=True)
+        ranks = np.arange(len(sources)) - np.repeat(starts, counts)
+        rows = np.repeat(np.arange(len(targets)), counts)
+        new_links = np.full((len(targets), max_neighbors), -1, dtype=np.int64)
+        kept = ranks < max_neighbors
+        new_links[rows[kept], ranks[kept]] = sources[kept]
+
+        links = self._neighbors[layer][targets].astype(np.int64)
+        new_links[(new_links[:, :, None] == links[:, None, :]).any(axis=2)] = -1
+        candidates = np.concatenate([links, new_links], axis=1)
+        scores = _batch_dot(self._values[candidates], self._values[targets])
+        scores[candidates < 0] = -np.inf
+        order = np.argsort(-scores, axis=1, kind="stable")
+        self._neighbors[layer][targets] = self._select_neighbors(
+            np.take_along_axis(candidates, order, axis=1),
+            np.take_along_axis(scores, order, axis=1),
+            max_neighbors,
+        )
+
+    def _select_neighbors(self, candidates, scores, num_neighbors):
+        """Heuristic of the HNSW paper: a candidate (sorted by decreasing similarity
+        `scores` to the node) is only connected if it is more similar to the node than
+        to the neighbors selected so far, which keeps links towards other regions.
+
+        Selects the neighbors of a batch of nodes, from their candidates padded with -1,
+        and returns them padded with -1."""
+        num_nodes, num_candidates = candidates.shape
+        selected = np.full((num_nodes, num_neighbors), -1, dtype=np.int32)
+        chunk_size = max(1, 2 ** 24 // max(1, num_candidates * self._values.shape[1]))
+        for start in range(0, num_nodes, chunk_size):
+            chunk = candidates[start : start + chunk_size]
+            chunk_scores = scores[start : start + chunk_size]
+            vectors = self._values[chunk]
+            # highest similarity of every candidate to the selected neighbors
+            closest_selected = np.full(chunk.shape, -np.inf, dtype=np.float32)
+            num_selected = np.zeros(len(chunk), dtype=np.int64)
+            is_selected = np.zeros(chunk.shape, dtype=bool)
+            is_pruned = np.zeros(chunk.shape, dtype=bool)
+            for i in range(num_candidates):
+                # the candidates are padded at the end
+                candidate = (chunk[:, i] >= 0) & (num_selected < num_neighbors)
+                if not candidate.any():
+                    break
+                is_selected[:, i] = candidate & (closest_selected[:, i] <= chunk_scores[:, i])
+                is_pruned[:, i] = candidate & ~is_selected[:, i]
+                num_selected += is_selected[:, i]
+                rows = np.flatnonzero(is_selected[:, i])
+                closest_selected[rows] = np.maximum(
+                    closest_selected[rows], _batch_dot(vectors[rows], vectors[rows, i])
+                )
+            # fill up with the most similar candidates that were pruned
+            positions = np.arange(num_candidates)
+            rank = np.where(
+                is_selected, positions, np.where(is_pruned, num_candidates + positions, -1)
+            )
+            rank = np.where(rank < 0, 2 * num_candidates, rank)
+            order = np.argsort(rank, axis=1, kind="stable")[:, :num_neighbors]
+            chunk_selected = np.take_along_axis(chunk, order, axis=1)
+            chunk_selected[np.take_along_axis(rank, order, axis=1) >= 2 * num_candidates] = -1
+            selected[start : start + chunk_size, : chunk_selected.shape[1]] = chunk_selected
+
+        return selected
+
+    def _search_layer(self, query, entry_points, ef, layer, available=None):
+        """Best-first search of the `ef` most similar nodes of `layer`,
+        returns their scores and nodes sorted by decreasing score.
+
+        With an `available` mask of the nodes, the unavailable nodes are expanded
+        but not returned."""
+        entry_points = np.asarray(entry_points)
+        scores = (self._values[entry_points] @ query).tolist()
+        visited = set(entry_points.tolist())
+        # max-heap of the candidates to expand and min-heap of the results
+        candidates = [(-score, node) for score, node in zip(scores, entry_points.tolist())]
+        results = [
+            (score, node)
+            for score, node in zip(scores, entry_points.tolist())
+            if available is None or available[node]
+        ]
+        heapq.heapify(candidates)
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        neighbors_of = self._neighbors[layer]
+        while candidates:
+            negative_score, node = heapq.heappop(candidates)
+            if len(results) >= ef and -negative_score < results[0][0]:
+                break
+            neighbors = [n for n in neighbors_of[node].tolist() if n >= 0 and n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            neighbor_scores = (self._values[neighbors] @ query).tolist()
+            for score, neighbor in zip(neighbor_scores, neighbors):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, neighbor))
+                    if available is None or available[neighbor]:
+                        heapq.heappush(results, (score, neighbor))
+                        if len(results) > ef:
+                            heapq.heappop(results)
+
+        results = sorted(results, reverse=True)
+        return (
+            np.array([score for score, _ in results], dtype=np.float32),
+            np.array([node for _, node in results], dtype=np.int64),
+        )
+
+    def _search_layer_batch(self, queries, entry_points, ef, layer):
+        """`_search_layer` for a batch of queries, vectorized over the queries: every
+        iteration expands the best node not expanded yet of every query. Returns the
+        scores and nodes of the `ef` most similar nodes of every query, sorted by
+        decreasing score and padded with -inf scores and -1 nodes.
+
+        The entry points are padded with -1. No visited set is needed, as a node that
+        leaves the `ef` best ones is less similar than all of them from then on."""
+        neighbors_of = self._neighbors[layer]
+        nodes = np.asarray(entry_points, dtype=np.int64)
+        scores = np.where(nodes >= 0, _batch_dot(self._values[nodes], queries), -np.inf)
+        # the best nodes of every query, as sorted keys (see `_candidate_keys`)
+        keys = np.sort(_candidate_keys(scores, nodes), axis=1)[:, :ef]
+        if keys.shape[1] < ef:
+            empty = _candidate_keys(np.full((len(keys), 1), -np.inf), np.full((1, 1), -1))
+            keys = np.concatenate([keys, np.repeat(empty, ef - keys.shape[1], axis=1)], 1)
+
+        # the keys of the valid nodes are lower than the keys of -inf scores
+        padding = _candidate_keys(np.full(1, -np.inf), np.zeros(1, dtype=np.int64))
+        while True:
+            pending = ((keys & _EXPANDED) == 0) & (keys < padding)
+            active = np.flatnonzero(pending.any(axis=1))
+            if len(active) == 0:
+                break
+            # the keys are sorted, the first pending node is the best one
+            expanding = np.argmax(pending[active], axis=1)
+            keys[active, expanding] |= _EXPANDED
+            best = keys[active]
+            worst_scores = _from_candidate_keys(best[:, -1:])[0]
+
+            expanded_nodes = best[np.arange(len(active)), expanding] & _NODE_MASK
+            neighbors = neighbors_of[expanded_nodes.astype(np.int64)].astype(np.int64)
+            neighbor_scores = _batch_dot(self._values[neighbors], queries[active])
+            # only the neighbors more similar than the worst of the best nodes can enter,
+            # if they are not among them: the (query, node) pairs are binary searched in
+            # the sorted pairs of the best nodes
+            rows, columns = np.nonzero((neighbors >= 0) & (neighbor_scores > worst_scores))
+            pairs = np.sort(best & _NODE_MASK, axis=1)
+            pairs += np.arange(len(active), dtype=np.uint64)[:, None] << np.uint64(31)
+            pairs = pairs.reshape(-1)
+            searched = neighbors[rows, columns].astype(np.uint64)
+            searched += rows.astype(np.uint64) << np.uint64(31)
+            found = np.minimum(np.searchsorted(pairs, searched), len(pairs) - 1)
+            known = pairs[found] == searched
+            new = np.zeros(neighbors.shape, dtype=bool)
+            new[rows[~known], columns[~known]] = True
+            neighbor_scores[~new] = -np.inf
+
+            keys[active] = np.sort(
+                np.concatenate([best, _candidate_keys(neighbor_scores, neighbors)], axis=1),
+                axis=1,
+            )[:, :ef]
+
+        scores, nodes, _ = _from_candidate_keys(keys)
+        return scores, nodes
+
+    def search(self, queries: np.ndarray, k: int):
+        """Returns the top-k scores and ids of `queries` (numpy arrays), padded with
+        -inf scores and -1 ids when the index has less than `k` candidates."""
+        top_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        top_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        if self._entry_point < 0:
+            return top_scores, top_ids
+
+        # the upper layers only lead to the entry point of the bottom layer
+        available = None if self.available is None else self.available.numpy()
+        for i, query in enumerate(np.asarray(queries, dtype=np.float32)):
+            entry_points = [self._entry_point]
+            for layer in range(self._levels[self._entry_point], 0, -1):
+                entry_points = self._search_layer(query, entry_points, 1, layer)[1][:1]
+            scores, nodes = self._search_layer(
+                query, entry_points, max(self.ef_search, k), 0, available
+            )
+            top_scores[i, : min(k, len(nodes))] = scores[:k]
+            top_ids[i, : min(k, len(nodes))] = self._ids[nodes[:k]]
+
+        return top_scores, top_ids
+
+    def call(
+        self, inputs: tf.Tensor, k=None, exclude=None, **kwargs
+    ) -> Union[tf.Tensor, tf.Tensor]:
+        """
+        Compute approximate Top-k scores and related ids from query inputs
+
+        Parameters:
+        ----------
+        inputs: tf.Tensor
+            Tensor of pre-computed query embeddings.
+        k: int
+            Number of top candidates to retrieve
+            Defaults to constructor `_k` parameter.
+        exclude: Optional[Union[tf.RaggedTensor, tf.Tensor]]
+            Candidates ids excluded from the top-k of every query, see
+            `TopKIndexBlock.call`. Not supported by the graph search.
+        Returns
+        -------
+        top_scores, top_indices: tf.Tensor, tf.Tensor
+            2D Tensors with the scores for the top-k candidates and related ids.
+        """
+        if exclude is not None:
+            raise NotImplementedError("HNSWTopKIndexBlock doesn't support `exclude`.")
+        k = k if k is not None else self._k
+        top_scores, top_indices = tf.numpy_function(
+            lambda queries: self.search(queries, k), [inputs], [tf.float32, tf.int64]
+        )
+        top_scores.set_shape([inputs.shape[0], k])
+        top_indices.set_shape([inputs.shape[0], k])
+
+        return top_scores, top_indices
+
+    def _index_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = dict(
+            values=self._values[: self._size],
+            ids=self._ids[: self._size],
+            levels=self._levels[: self._size],
+            entry_point=np.array(self._entry_point),
+        )
+        for i, neighbors in enumerate(self._neighbors):
+            arrays[f"neighbors_{i}"] = neighbors[: self._size]
+        return arrays
+
+    def _index_config(self) -> dict:
+        return dict(
+            super()._index_config(),
+            M=self.M,
+            ef_construction=self.ef_construction,
+            ef_search=self.ef_search,
+            seed=self.seed,
+        )
+
+    def _restore(self, arrays: Dict[str, np.ndarray], mmap: bool):
+        # the graph is searched in numpy, memory-mapped or not; `add` copies it
+        # into growable buffers
+        self._values, self._ids, self._levels = arrays["values"], arrays["ids"], arrays["levels"]
+        num_layers = len([name for name in arrays if name.startswith("neighbors_")])
+        self._neighbors = [arrays[f"neighbors_{i}"] for i in range(num_layers)]
+        self._entry_point = int(arrays["entry_point"])
+        self._size = len(self._ids)
+        self.values, self.ids = self._values, self._ids
+
+
+@tf.keras.utils.register_keras_serializable(package="merlin_models")
+class ShardedTopKIndexBlock(TopKIndexBlock):
+    """Top-K index partitioned into shards that are built and searched in parallel.
+
+    The candidates are split into `num_shards` contiguous shards, or into one shard
+    per distinct value of `shard_ids` (e.g. the category of the items). Every shard is
+    an index of `shard_cls` (by default `TopKIndexBlock`), the shards are built on a
+    pool of threads, and a query batch is scattered to all the shards (or only to the
+    ones listed in `shards`, for filtered retrieval), whose top-k are merged into the
+    top-k of the index.
+
+    The shards are searched by a pool of threads when the index is called eagerly,
+    and by the inter-op thread pool of TensorFlow inside a `tf.function`. With
+    `processes=True`, the index is saved once to a temporary directory and the
+    shards are searched by worker processes that memory-map it, which also
+    parallelizes the indices searched in Python, such as `HNSWTopKIndexBlock`.
+
+    Example usage::
+        index = ShardedTopKIndexBlock(
+            k=20, values=embeddings, ids=item_ids, shard_ids=item_categories
+        )
+        scores, ids = index(queries, shards=["shoes", "socks"])
+
+    Parameters:
+    -----------
+        k: int
+            Number of top candidates to retrieve.
+        values: tf.Tensor
+            The pre-computed embedddings of candidates.
+        ids: tf.Tensor
+            The candidates ids.
+        num_shards: Optional[int]
+            Number of contiguous shards, ignored when `shard_ids` is set.
+            Defaults to the number of CPUs.
+        shard_ids: Optional[Union[tf.Tensor, np.ndarray]]
+            The shard of every candidate, e.g. its category. Candidates of the
+            same shard are searched together and `call` can be restricted to a
+            subset of the shards.
+        shard_cls: Union[Type[TopKIndexBlock], str]
+            The index of every shard (or its registered name). Defaults to
+            `TopKIndexBlock`.
+        shard_kwargs: Optional[dict]
+            Parameters of the index of every shard, e.g. `nlist` and `nprobe` for
+            an `IVFTopKIndexBlock`. `block_size` and `quantization` can also be
+            passed directly, they are parameters of the shards as well.
+        num_workers: Optional[int]
+            Number of shards built or searched concurrently. Defaults to the number
+            of shards (threads) or of CPUs (processes).
+        processes: bool
+            Whether the shards are searched by worker processes instead of threads.
+            Defaults to False.
+    """
+
+    _incremental_updates = False
+
+    def __init__(
+        self,
+        k,
+        values: tf.Tensor,
+        ids: Optional[tf.Tensor] = None,
+        num_shards: Optional[int] = None,
+        shard_ids=None,
+        shard_cls: Optional[Union[Type[TopKIndexBlock], str]] = None,
+        shard_kwargs: Optional[dict] = None,
+        num_workers: Optional[int] = None,
+        processes: bool = False,
+        **kwargs,
+    ):
+        shard_kwargs = dict(shard_kwargs or {})
+        # the candidates are searched by the shards, which get the search parameters
+        for name in ["block_size", "quantization"]:
+            if name in kwargs:
+                if name in shard_kwargs and shard_kwargs[name] != kwargs[name]:
+                    raise ValueError(
+                        f"Conflicting values of {name}: {kwargs[name]} and "
+                        f"{shard_kwargs[name]} in shard_kwargs."
+                    )
+                shard_kwargs[name] = kwargs.pop(name)
+        super(ShardedTopKIndexBlock, self).__init__(k, None, None, **kwargs)
+        if isinstance(shard_cls, str):
+            shard_cls = tf.keras.utils.get_registered_object(shard_cls)
+        self.num_shards = num_shards
+        self.shard_cls = shard_cls or TopKIndexBlock
+        self.shard_kwargs = shard_kwargs
+        self.num_workers = num_workers
+        self.processes = processes
+        self.shards: Dict[Any, TopKIndexBlock] = {}
+        self.shard_sizes: Dict[Any, int] = {}
+        self._executor = None
+        self._path = None
+        self._pool_lock = threading.Lock()
+        if values is not None:
+            self._build(values, ids, shard_ids)
+
+    @classmethod
+    def from_block(  # type: ignore
+        cls,
+        block: Block,
+        data: merlin.io.Dataset,
+        k: int = 20,
+        id_column: Optional[str] = None,
+        shard_column: Optional[str] = None,
+        **kwargs,
+    ) -> "ShardedTopKIndexBlock":
+        """Builds the index from the embeddings of `block` applied to the item features
+        `data`, see `TopKIndexBlock.from_block`. With `shard_column` (e.g. the item
+        category), the candidates are sharded by the values of this column."""
+        if shard_column is not None:
+            ddf = data.to_ddf()
+            kwargs["shard_ids"] = ddf[shard_column].compute().to_numpy()
+
+        return super().from_block(block=block, data=data, k=k, id_column=id_column, **kwargs)
+
+    def build(self, input_shape):
+        # the shards are built by their first search
+        self.built = True
+
+    def _build(self, values, ids=None, shard_ids=None):
+        values = tf.convert_to_tensor(values)
+        if len(values.shape) != 2:
+            raise ValueError(f"The candidates embeddings tensor must be 2D (got {values.shape}).")
+        num_rows = int(values.shape[0])
+        ids = tf.range(num_rows) if ids is None else tf.convert_to_tensor(ids)
+
+        if shard_ids is None:
+            num_shards = min(self.num_shards or os.cpu_count() or 1, max(num_rows, 1))
+            shard_rows = np.array_split(np.arange(num_rows), num_shards)
+            keys = list(range(num_shards))
+        else:
+            shard_ids = np.asarray(shard_ids).reshape(-1)
+            if len(shard_ids) != num_rows:
+                raise ValueError(
+                    f"shard_ids has {len(shard_ids)} values for {num_rows} candidates."
+                )
+            keys, inverse, counts = np.unique(shard_ids, return_inverse=True, return_counts=True)
+            shard_rows = np.split(np.argsort(inverse, kind="stable"), np.cumsum(counts)[:-1])
+            keys = keys.tolist()
+
+        def build(rows):
+            rows = tf.constant(rows, dtype=tf.int64)
+            return self.shard_cls(
+                k=self._k,
+                values=tf.gather(values, rows),
+                ids=tf.gather(ids, rows),
+                **self.shard_kwargs,
+            )
+
+        # no shard at all when `shard_ids` is empty
+        num_workers = self.num_workers or max(len(keys), 1)
+        with concurrent.futures.ThreadPoolExecutor(num_workers) as pool:
+            shards = list(pool.map(build, shard_rows))
+
+        if self._availability is not None:
+            for shard in shards:
+                shard.set_availability(*self._availability)
+
+        self.close()
+        self.shards = dict(zip(keys, shards))
+        self.shard_sizes = {key: len(rows) for key, rows in zip(keys, shard_rows)}
+
+    def update(self, values: tf.Tensor, ids: Optional[tf.Tensor] = None, shard_ids=None):
+        """Rebuilds all the shards."""
+        self._build(values, ids, shard_ids)
+        return self
+
+    def set_availability(self, allow=None, deny=None):
+        """Restricts the searches to the available candidates of every shard, see
+        `IndexBlock.set_availability`.
+
+        With `processes=True`, the worker processes search a saved copy of the index,
+        so they are restarted by the next search to load the new availability.
+        """
+        allow = None if allow is None else np.asarray(allow).reshape(-1)
+        deny = None if deny is None else np.asarray(deny).reshape(-1)
+        self._availability = None if allow is None and deny is None else (allow, deny)
+        for shard in self.shards.values():
+            shard.set_availability(allow=allow, deny=deny)
+        if self.processes:
+            self.close()
+
+        return self
+
+    def call(
+        self, inputs: tf.Tensor, k=None, exclude=None, shards=None, **kwargs
+    ) -> Union[tf.Tensor, tf.Tensor]:
+        """
+        Compute Top-k scores and related ids from query inputs, searching the
+        shards in parallel
+
+        Parameters:
+        ----------
+        inputs: tf.Tensor
+            Tensor of pre-computed query embeddings.
+        k: int
+            Number of top candidates to retrieve
+            Defaults to constructor `_k` parameter.
+        exclude: Optional[Union[tf.RaggedTensor, tf.Tensor]]
+            Candidates ids excluded from the top-k of every query, see
+            `TopKIndexBlock.call`.
+        shards: Optional[List]
+            The keys of the shards searched (e.g. categories), by default all of
+            them.
+        Returns
+        -------
+        top_scores, top_indices: tf.Tensor, tf.Tensor
+            2D Tensors with the scores for the top-k candidates and related ids.
+            When the searched shards have less than `k` candidates, the top-k is
+            padded with -inf scores and -1 ids.
+        """
+        k = k if k is not None else self._k
+        if shards is None:
+            keys = list(self.shards)
+        else:
+            keys = list(shards)
+            unknown = [key for key in keys if key not in self.shards]
+            if unknown:
+                raise ValueError(f"Unknown shards: {unknown}.")
+        searches = [(key, min(k, self.shard_sizes[key])) for key in keys]
+        searches = [(key, shard_k) for key, shard_k in searches if shard_k > 0]
+
+        if self.processes:
+            results = self._search_in_processes(inputs, searches, exclude)
+        elif tf.executing_eagerly() and len(searches) > 1:
+            pool = self._pool()
+            results = list(
+                pool.map(
+                    lambda search: self.shards[search[0]](inputs, k=search[1], exclude=exclude),
+                    searches,
+                )
+            )
+        else:
+            # independent ops, run concurrently by the inter-op thread pool
+            results = [
+                self.shards[key](inputs, k=shard_k, exclude=exclude) for key, shard_k in searches
+            ]
+
+        return self._merge(inputs, results, k, sum(shard_k for _, shard_k in searches))
+
+    def _search_in_processes(self, inputs: tf.Tensor, searches, exclude):
+        if not searches:
+            return []
+        if isinstance(exclude, tf.RaggedTensor):
+            # padded with an id that isn't indexed
+            exclude = exclude.to_tensor(default_value=-1)
+        ids_dtypes = [tf.as_dtype(self.shards[key].ids.dtype) for key, _ in searches]
+
+        def search(queries, *exclude):
+            pool = self._pool()
+            futures = [
+                pool.submit(_search_shard_in_worker, key, queries, shard_k, *exclude)
+                for key, shard_k in searches
+            ]
+            outputs = []
+            for future, dtype in zip(futures, ids_dtypes):
+                scores, ids = future.result()
+                outputs += [scores.astype(np.float32), ids.astype(dtype.as_numpy_dtype)]
+            return outputs
+
+        args = [inputs] if exclude is None else [inputs, exclude]
+        dtypes = [dtype for ids_dtype in ids_dtypes for dtype in (tf.float32, ids_dtype)]
+        outputs = tf.numpy_function(search, args, dtypes, stateful=True)
+
+        results = []
+        for i, (_, shard_k) in enumerate(searches):
+            scores, ids = outputs[2 * i], outputs[2 * i + 1]
+            scores.set_shape([inputs.shape[0], shard_k])
+            ids.set_shape([inputs.shape[0], shard_k])
+            results.append((scores, ids))
+        return results
+
+    def _merge(self, inputs: tf.Tensor, results, k: int, num_results: int):
+        """Merges the top-k of the shards into the top-k of the index."""
+        batch_size = tf.shape(inputs)[0]
+        ids_dtype = results[0][1].dtype if results else tf.int64
+        scores = [tf.cast(shard_scores, tf.float32) for shard_scores, _ in results]
+        ids = [tf.cast(shard_ids, ids_dtype) for _, shard_ids in results]
+        if num_results < k:
+            scores.append(tf.fill([batch_size, k - num_results], -np.inf))
+            ids.append(tf.fill([batch_size, k - num_results], tf.cast(-1, ids_dtype)))
+        scores, ids = tf.concat(scores, axis=1), tf.concat(ids, axis=1)
+
+        # ties are broken by shard, as with a full scan of contiguous shards
+        top_scores, positions = tf.math.top_k(scores, k=k)
+        return top_scores, tf.gather(ids, positions, batch_dims=1)
+
+    def _pool(self) -> concurrent.futures.Executor:
+        with self._pool_lock:
+            if self._executor is None:
+                if self.processes:
+                    # the workers memory-map the saved index, sharing its pages
+                    self._path = tempfile.mkdtemp(prefix="sharded_index_")
+                    self.save(self._path)
+                    self._executor = concurrent.futures.ProcessPoolExecutor(
+                        self.num_workers or min(len(self.shards), os.cpu_count() or 1),
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_shard_worker,
+                        initargs=(self._path,),
+                    )
+                else:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        self.num_workers or max(len(self.shards), 1)
+                    )
+            return self._executor
+
+    def close(self):
+        """Stops the workers searching the shards, they are restarted by the next search."""
+        with self._pool_lock:
+            executor, path = self._executor, self._path
+            self._executor, self._path = None, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        if path is not None:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _index_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = dict(shard_keys=np.asarray(list(self.shards)))
+        for i, shard in enumerate(self.shards.values()):
+            for name, array in shard._index_arrays().items():
+                arrays[f"shard_{i}.{name}"] = array
+        return arrays
+
+    def _index_config(self) -> dict:
+        return dict(
+            k=self._k,
+            num_shards=len(self.shards),
+            shard_cls=tf.keras.utils.get_registered_name(self.shard_cls),
+            shard_kwargs=self.shard_kwargs,
+            num_workers=self.num_workers,
+            processes=self.processes,
+        )
+
+    def _restore(self, arrays: Dict[str, np.ndarray], mmap: bool):
+        self.shards, self.shard_sizes = {}, {}
+        for i, key in enumerate(arrays["shard_keys"].tolist()):
+            prefix = f"shard_{i}."
+            shard_arrays = {
+                name[len(prefix) :]: array
+                for name, array in arrays.items()
+                if name.startswith(prefix)
+            }
+            shard = self.shard_cls(k=self._k, values=None, **self.shard_kwargs)
+            shard._restore(shard_arrays, mmap)
+            self.shards[key] = shard
+            self.shard_sizes[key] = len(shard_arrays["ids"])
+
+
+def _num_rows(array):
+    if isinstance(array, np.ndarray):
+        return array.shape[0]
+    return tf.shape(array)[0]
+
+
+def _slice_rows(array, start, size) -> tf.Tensor:
+    """Rows `start` to `start + size` of a tensor or of a (memory-mapped) numpy array."""
+    if not isinstance(array, np.ndarray):
+        return array[start : start + size]
+
+    # only the block is copied out of the memory-mapped array
+    rows = tf.numpy_function(
+        lambda start, size: np.asarray(array[start : start + size]),
+        [start, size],
+        tf.as_dtype(array.dtype),
+        stateful=False,
+    )
+    rows.set_shape((None,) + array.shape[1:])
+    return rows
+
+
+def _gather_rows(array, indices: tf.Tensor) -> tf.Tensor:
+    """`tf.gather` along the first axis of a tensor or of a (memory-mapped) numpy array."""
+    if not isinstance(array, np.ndarray):
+        return tf.gather(array, indices)
+
+    rows = tf.numpy_function(
+        lambda indices: np.asarray(array[indices]),
+        [indices],
+        tf.as_dtype(array.dtype),
+        stateful=False,
+    )
+    rows.set_shape(indices.shape.concatenate(array.shape[1:]))
+    return rows
+
+
+# index loaded by the worker processes of a `ShardedTopKIndexBlock`
+_worker_index: Optional[ShardedTopKIndexBlock] = None
+
+
+def _init_shard_worker(path: str):
+    global _worker_index
+    _worker_index = IndexBlock.load(path, mmap=True, processes=False)
+
+
+def _search_shard_in_worker(key, queries: np.ndarray, k: int, exclude=None):
+    shard = _worker_index.shards[key]
+    exclude = None if exclude is None else tf.constant(exclude)
+    scores, ids = shard(tf.constant(queries), k=k, exclude=exclude)
+    return np.asarray(scores), np.asarray(ids)
+
+
+class _Exclusions:
+    """Candidates excluded from the top-k of every query of a batch.
+
+    `exclude` is either a (ragged) tensor of the excluded ids of every query, whose
+    ids are converted once to (query, row) pairs, or a `uint8` tensor of bitsets,
+    where bit `id % 8` of byte `id // 8` is set for the excluded ids of a query.
+    """
+
+    def __init__(self, index: IndexBlock, exclude):
+        self.index = index
+        self.bitsets = None
+        if not isinstance(exclude, tf.RaggedTensor):
+            exclude = tf.convert_to_tensor(exclude)
+            if exclude.dtype == tf.uint8:
+                self.bitsets, self.bitsets_t = exclude, tf.transpose(exclude)
+                return
+            exclude = tf.RaggedTensor.from_tensor(exclude)
+
+        rows = index._lookup_rows(exclude.flat_values)
+        pairs = tf.stack([tf.cast(exclude.value_rowids(), tf.int64), rows], axis=1)
+        # unknown ids (e.g. padding) are dropped
+        self.pairs = tf.boolean_mask(pairs, rows >= 0)
+
+    def mask_block(self, scores: tf.Tensor, start) -> tf.Tensor:
+        """Masks the `scores` of the candidates `start` to `start + scores.shape[1]`."""
+        size = tf.shape(scores)[1]
+        if self.bitsets is not None:
+            # the candidates of a block are the same for all the queries, so their bytes
+            # are gathered as contiguous rows of the transposed bitsets
+            ids = tf.cast(_slice_rows(self.index.ids, start, size), tf.int64)
+            valid = (ids >= 0) & (ids < 8 * tf.shape(self.bitsets_t, out_type=tf.int64)[0])
+            ids = tf.where(valid, ids, tf.zeros_like(ids))
+            bytes_ = tf.gather(self.bitsets_t, ids // 8)
+            bits = tf.bitwise.right_shift(bytes_, tf.cast(ids % 8, tf.uint8)[:, None]) & 1
+            return self._mask(scores, tf.transpose((bits > 0) & valid[:, None]))
+
+        start, end = tf.cast(start, tf.int64), tf.cast(start + size, tf.int64)
+        in_block = (self.pairs[:, 1] >= start) & (self.pairs[:, 1] < end)
+        pairs = tf.boolean_mask(self.pairs, in_block) - tf.stack([tf.constant(0, tf.int64), start])
+        inf = tf.fill(tf.shape(pairs)[:1], tf.constant(-np.inf, dtype=scores.dtype))
+        return tf.tensor_scatter_nd_update(scores, pairs, inf)
+
+    def mask_rows(self, scores: tf.Tensor, rows: tf.Tensor) -> tf.Tensor:
+        """Masks the `scores` of the candidates of the [batch, num_candidates] `rows`."""
+        if self.bitsets is not None:
+            return self._mask(scores, self._bits(_gather_rows(self.index.ids, rows)))
+
+        num_rows = tf.cast(_num_rows(self.index.values), tf.int64)
+        keys = self.pairs[:, 0] * num_rows + self.pairs[:, 1]
+        # sorted keys, with a sentinel so that the search never falls off the end
+        keys = tf.concat([tf.sort(keys), [tf.int64.max]], axis=0)
+        queries = tf.range(tf.shape(rows, out_type=tf.int64)[0])[:, None]
+        candidates = tf.reshape(queries * num_rows + tf.cast(rows, tf.int64), [-1])
+        found = tf.gather(keys, tf.searchsorted(keys, candidates)) == candidates
+        return self._mask(scores, tf.reshape(found, tf.shape(rows)))
+
+    def _bits(self, ids: tf.Tensor) -> tf.Tensor:
+        """Whether the [batch, num_candidates] `ids` are set in the bitsets."""
+        ids = tf.cast(ids, tf.int64)
+        num_bits = 8 * tf.shape(self.bitsets, out_type=tf.int64)[1]
+        valid = (ids >= 0) & (ids < num_bits)
+        ids = tf.where(valid, ids, tf.zeros_like(ids))
+        bytes_ = tf.gather(self.bitsets, ids // 8, batch_dims=1)
+        bits = tf.bitwise.right_shift(bytes_, tf.cast(ids % 8, tf.uint8)) & 1
+        return valid & (bits > 0)
+
+    @staticmethod
+    def _mask(scores: tf.Tensor, excluded: tf.Tensor) -> tf.Tensor:
+        return tf.where(excluded, tf.constant(-np.inf, dtype=scores.dtype), scores)
+
+
+class _IdLookup:
+    """Rows of the candidates ids of an index, by binary search on the sorted ids."""
+
+    def __init__(self, ids):
+        self.ids = ids
+        ids = np.asarray(ids)
+        self.order = np.argsort(ids, kind="stable")
+        self.sorted_ids = ids[self.order]
+
+    def rows(self, ids: np.ndarray) -> np.ndarray:
+        if len(self.sorted_ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.sorted_ids, ids), len(self.sorted_ids) - 1)
+        found = self.sorted_ids[positions] == ids
+        return np.where(found, self.order[positions], -1).astype(np.int64)
+
+
+class _Slots:
+    """Rows of the candidates of an index updated incrementally."""
+
+    def __init__(self, rows: Dict, size: int):
+        # id -> row of the indexed candidates
+        self.rows = rows
+        # rows of the deleted candidates, reused by the next inserted ones
+        self.free: List[int] = []
+        # number of rows used, the next rows are spare capacity
+        self.size = size
+        # incremented by every change, a compaction is discarded if the index changed
+        self.version = 0
+        self.lock = threading.Lock()
+        self.compaction: Optional[threading.Thread] = None
+        # ids set by `set_availability`, applied to the upserted candidates
+        self.allow: Optional[set] = None
+        self.deny: set = set()
+
+    def set_availability(self, allow: Optional[np.ndarray], deny: Optional[np.ndarray]):
+        self.allow = None if allow is None else set(allow.tolist())
+        self.deny = set() if deny is None else set(deny.tolist())
+
+    def is_available(self, ids: np.ndarray) -> np.ndarray:
+        return np.array(
+            [(self.allow is None or i in self.allow) and i not in self.deny for i in ids.tolist()],
+            dtype=bool,
+        )
+
+
+def _pq_encode(values, codebooks):
+    """Index of the nearest centroid of every sub-vector of `values`."""
+    subvectors = np.split(values, codebooks.shape[0], axis=1)
+    return np.stack(
+        [_nearest_centroids(sub, codebook) for sub, codebook in zip(subvectors, codebooks)],
+        axis=1,
+    )
+
+
+def _pq_decode(codes, codebooks):
+    return np.concatenate([codebooks[i][codes[:, i]] for i in range(codebooks.shape[0])], axis=1)
+
+
+# flag of the expanded candidates and mask of the nodes in the keys of `_candidate_keys`
+_EXPANDED = np.uint64(1 << 31)
+_NODE_MASK = np.uint64(0x7FFFFFFF)
+
+
+def _candidate_keys(scores: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+    """Packs the float32 `scores` and `nodes` (below 2 ** 31) of candidates into uint64
+    keys whose increasing order is the decreasing order of the scores, so that the
+    candidates are sorted with `np.sort`, several times faster than `np.argsort`.
+    Bit 31 of the keys is the `_EXPANDED` flag, -1 nodes must have -inf scores."""
+    bits = np.asarray(scores, dtype=np.float32).view(np.int32).astype(np.int64)
+    # the order of the float32 values is the order of these integers
+    ordered = np.where(bits < 0, bits ^ 0x7FFFFFFF, bits)
+    return ((2 ** 31 - 1 - ordered).astype(np.uint64) << np.uint64(32)) | (
+        np.asarray(nodes) & 0x7FFFFFFF
+    ).astype(np.uint64)
+
+
+def _from_candidate_keys(keys: np.ndarray):
+    """The scores, nodes and expanded flags of the keys of `_candidate_keys`."""
+    ordered = 2 ** 31 - 1 - (keys >> np.uint64(32)).astype(np.int64)
+    bits = np.where(ordered < 0, ordered ^ 0x7FFFFFFF, ordered).astype(np.int32)
+    scores = bits.view(np.float32)
+    nodes = (keys & _NODE_MASK).astype(np.int64)
+    nodes[np.isneginf(scores)] = -1
+
+    return scores, nodes, (keys & _EXPANDED) > 0
+
+
+def _batch_dot(vectors: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """Inner products of `vectors` (rows, n, dim) with `queries` (rows, dim), (rows, n)."""
+    return np.matmul(vectors, queries[:, :, None])[:, :, 0]
+
+
+def _quantize_int8(values):
+    """Per-dimension int8 scalar quantization, returns the int8 values, scale and offset."""
+    values = tf.convert_to_tensor(values, dtype=tf.float32)
+    minimum = tf.reduce_min(values, axis=0)
+    scale = (tf.reduce_max(values, axis=0) - minimum) / 255.0
+    scale = tf.where(scale > 0, scale, tf.ones_like(scale))
+    quantized = tf.round((values - minimum) / scale) - 128.0
+    quantized = tf.cast(tf.clip_by_value(quantized, -128.0, 127.0), tf.int8)
+
+    return quantized, scale, minimum + 128.0 * scale
+
+
+def _nearest_centroids(values, centroids, batch_size=65536):
+    """Index of the nearest centroid (L2) of every row of `values`."""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignments = np.empty(values.shape[0], dtype=np.int64)
+    for start in range(0, values.shape[0], batch_size):
+        batch = values[start : start + batch_size]
+        distances = centroid_norms - 2 * batch @ centroids.T
+        assignments[start : start + batch_size] = distances.argmin(axis=1)
+
+    return assignments
+
+
+def _kmeans(values, num_clusters, iterations, rng):
+    """Lloyd's k-means, returns the `num_clusters` centroids of `values`."""
+    centroids = values[rng.choice(values.shape[0], num_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest_centroids(values, centroids)
+        counts = np.bincount(assignments, minlength=num_clusters)
+        order = np.argsort(assignments, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        non_empty = counts > 0
+        sums = np.add.reduceat(values[order], starts[non_empty], axis=0)
+        centroids[non_empty] = sums / counts[non_empty, None]
+
+        # re-seed the empty clusters with random points
+        num_empty = int((~non_empty).sum())
+        if num_empty:
+            centroids[~non_empty] = values[rng.choice(values.shape[0], num_empty, replace=False)]
+
+    return centroids
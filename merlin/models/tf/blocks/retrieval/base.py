@@ -14,13 +14,14 @@
 # limitations under the License.
 #
 import logging
-from typing import List, Sequence, Union
+from typing import List, Optional, Sequence, Union
 
 import tensorflow as tf
 from tensorflow.python.ops import embedding_ops
 
 from merlin.models.tf.blocks.core.base import Block, EmbeddingWithMetadata, PredictionOutput
 from merlin.models.tf.blocks.sampling.base import ItemSampler
+from merlin.models.tf.blocks.sampling.frequency import ItemFrequencyEstimator
 from merlin.models.tf.models.base import ModelBlock
 from merlin.models.tf.typing import TabularData
 from merlin.models.tf.utils.tf_utils import (
@@ -68,6 +69,12 @@ class ItemRetrievalScorer(Block):
         Identify query tower for query/user embeddings, by default 'query'
     item_name: str
         Identify item tower for item embeddings, by default'item'
+    frequency_estimator: ItemFrequencyEstimator, optional
+        Streaming estimator of the item probabilities, updated with the positive item ids
+        of every training batch. When set, the logQ correction is applied to the scores of
+        the positive items and of the negatives from popularity-biased samplers (e.g.
+        `InBatchSampler`, `CachedCrossBatchSampler`), by default None. No correction is
+        applied when none of the samplers is popularity-biased.
     """
 
     def __init__(
@@ -79,6 +86,7 @@ class ItemRetrievalScorer(Block):
         query_name: str = "query",
         item_name: str = "item",
         cache_query: bool = False,
+        frequency_estimator: Optional[ItemFrequencyEstimator] = None,
         **kwargs,
     ):
         super().__init__(**kwargs)
@@ -89,6 +97,7 @@ class ItemRetrievalScorer(Block):
         self.query_name = query_name
         self.item_name = item_name
         self.cache_query = cache_query
+        self.frequency_estimator = frequency_estimator
 
         if not isinstance(samplers, (list, tuple)):
             samplers = (samplers,)  # type: ignore
@@ -112,7 +121,7 @@ class ItemRetrievalScorer(Block):
 
     def set_required_features(self):
         required_features = set()
-        if self.downscore_false_negatives:
+        if self.downscore_false_negatives or self.frequency_estimator is not None:
             required_features.add(self.item_id_feature_name)
 
         required_features.update(
@@ -224,8 +233,26 @@ class ItemRetrievalScorer(Block):
                 axis=-1,
             )
 
+            # the logQ correction only applies to the negatives of popularity-biased samplers
+            logq_correction = self.frequency_estimator is not None and any(
+                sampler.popularity_biased for sampler in self.samplers
+            )
+
+            if self.downscore_false_negatives or logq_correction:
+                if isinstance(targets, tf.Tensor):
+                    positive_item_ids = targets
+                else:
+                    positive_item_ids = self.context[self.item_id_feature_name]
+
+            if logq_correction:
+                self.frequency_estimator.update(positive_item_ids)
+                positive_logq = self.frequency_estimator.log_probabilities(positive_item_ids)
+                positive_logq = tf.reshape(positive_logq, [-1, 1])
+                positive_scores -= tf.cast(positive_logq, positive_scores.dtype)
+
             neg_items_embeddings_list = []
             neg_items_ids_list = []
+            neg_items_samplers = []
 
             # Adds items from the current batch into samplers and sample a number of negatives
             for sampler in self.samplers:
@@ -238,8 +265,9 @@ class ItemRetrievalScorer(Block):
                 if tf.shape(neg_items.embeddings)[0] > 0:
                     # Accumulates sampled negative items from all samplers
                     neg_items_embeddings_list.append(neg_items.embeddings)
-                    if self.downscore_false_negatives:
+                    if self.downscore_false_negatives or logq_correction:
                         neg_items_ids_list.append(neg_items.metadata[self.item_id_feature_name])
+                        neg_items_samplers.append(sampler)
                 else:
                     LOG.warn(
                         f"The sampler {type(sampler).__name__} returned no samples for this batch."
@@ -256,12 +284,17 @@ class ItemRetrievalScorer(Block):
                 predictions[self.query_name], neg_items_embeddings, transpose_b=True
             )
 
-            if self.downscore_false_negatives:
-                if isinstance(targets, tf.Tensor):
-                    positive_item_ids = targets
-                else:
-                    positive_item_ids = self.context[self.item_id_feature_name]
+            if logq_correction:
+                neg_items_logq = tf.concat(
+                    [
+                        self._logq(sampler, ids)
+                        for sampler, ids in zip(neg_items_samplers, neg_items_ids_list)
+                    ],
+                    axis=0,
+                )
+                negative_scores -= tf.cast(tf.expand_dims(neg_items_logq, 0), negative_scores.dtype)
 
+            if self.downscore_false_negatives:
                 if len(neg_items_ids_list) == 1:
                     neg_items_ids = neg_items_ids_list[0]
                 else:
@@ -292,6 +325,15 @@ class ItemRetrievalScorer(Block):
         )
         return PredictionOutput(predictions, targets)
 
+    def _logq(self, sampler: ItemSampler, neg_items_ids: tf.Tensor) -> tf.Tensor:
+        """The logQ correction of the items sampled by `sampler`, zeros when the
+        sampler is not biased by the item popularity."""
+        neg_items_ids = tf.reshape(neg_items_ids, [-1])
+        if not sampler.popularity_biased:
+            return tf.zeros(tf.shape(neg_items_ids), dtype=tf.float32)
+
+        return self.frequency_estimator.log_probabilities(neg_items_ids)
+
     def get_batch_items_metadata(self):
         result = {feat_name: self.context[feat_name] for feat_name in self._required_features}
         return result
@@ -318,7 +360,7 @@ class ItemRetrievalScorer(Block):
 
     def get_config(self):
         config = super().get_config()
-        config = maybe_serialize_keras_objects(self, config, ["samplers"])
+        config = maybe_serialize_keras_objects(self, config, ["samplers", "frequency_estimator"])
         config["downscore_false_negatives"] = self.downscore_false_negatives
         config["false_negatives_score"] = self.false_negatives_score
         config["item_id_feature_name"] = self.item_id_feature_name
@@ -327,6 +369,6 @@ class ItemRetrievalScorer(Block):
 
     @classmethod
     def from_config(cls, config):
-        config = maybe_deserialize_keras_objects(config, ["samplers"])
+        config = maybe_deserialize_keras_objects(config, ["samplers", "frequency_estimator"])
 
         return super().from_config(config)
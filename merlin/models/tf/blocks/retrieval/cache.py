@@ -0,0 +1,309 @@
+#
+# Copyright (c) 2021, NVIDIA CORPORATION.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+import tensorflow as tf
+
+from merlin.models.tf.blocks.core.base import Block
+from merlin.schema import Tags
+
+_EMBEDDING_COLUMN = "embedding"
+
+
+@dataclass
+class CacheStats:
+    """Hit-rate statistics of a `QueryEmbeddingCache`."""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+    @property
+    def requests(self) -> int:
+        return self.hits + self.misses
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.requests if self.requests else 0.0
+
+
+class QueryEmbeddingCache:
+    """Size-bounded LRU cache of query embeddings, with an optional time-to-live.
+
+    Parameters
+    ----------
+    max_size: int
+        Maximum number of cached embeddings, the least recently used ones are evicted
+        first. By default 100_000.
+    ttl: float, optional
+        Number of seconds after which a cached embedding expires and is recomputed,
+        by default the embeddings don't expire.
+    clock: Callable[[], float]
+        The clock of the time-to-live, by default `time.monotonic`.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 100_000,
+        ttl: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if max_size < 1:
+            raise ValueError(f"max_size must be at least 1, got {max_size}")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[int, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the positions of the cached `keys` with their embeddings, and the
+        positions of the other keys."""
+        now = self.clock()
+        hits, values, misses = [], [], []
+        with self._lock:
+            for i, key in enumerate(keys.tolist()):
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] <= now:
+                    del self._entries[key]
+                    self.stats.expirations += 1
+                    entry = None
+                if entry is None:
+                    misses.append(i)
+                    continue
+                self._entries.move_to_end(key)
+                hits.append(i)
+                values.append(entry[1])
+            self.stats.hits += len(hits)
+            self.stats.misses += len(misses)
+
+        hit_values = np.stack(values) if values else np.zeros((0, 0), dtype=np.float32)
+        return np.array(hits, dtype=np.int64), hit_values, np.array(misses, dtype=np.int64)
+
+    def insert(self, keys: np.ndarray, embeddings: np.ndarray) -> np.int64:
+        """Caches the `embeddings` of `keys`, and returns the number of evictions."""
+        expires = self.clock() + self.ttl if self.ttl is not None else np.inf
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        evictions = 0
+        with self._lock:
+            for key, embedding in zip(keys.tolist(), embeddings):
+                self._entries[key] = (expires, embedding.copy())
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                evictions += 1
+            self.stats.evictions += evictions
+
+        return np.int64(evictions)
+
+    def warm_up(self, keys: np.ndarray, embeddings: np.ndarray):
+        """Caches pre-computed embeddings, e.g. of the most active users."""
+        self.insert(np.asarray(keys, dtype=np.int64), embeddings)
+
+        return self
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        self.stats = CacheStats()
+
+
+@tf.keras.utils.register_keras_serializable(package="merlin_models")
+class CachedQueryBlock(Block):
+    """Serves the embeddings of a query block (e.g. the query tower of a retrieval model)
+    from a `QueryEmbeddingCache`, so that the repeated requests of the same users don't
+    recompute the tower.
+
+    The embeddings are keyed by `id_column`, by default the column tagged with
+    `Tags.USER_ID` in the schema of `block`, or else by a hash of all the features of
+    the query. Only the queries missing from the cache go through `block`. The cache is
+    bypassed during training.
+
+    Parameters
+    ----------
+    block: Block
+        The query block.
+    cache: QueryEmbeddingCache, optional
+        The cache of the embeddings, by default `QueryEmbeddingCache()`.
+    id_column: str, optional
+        The column of the query ids.
+    """
+
+    def __init__(
+        self,
+        block: Block,
+        cache: Optional[QueryEmbeddingCache] = None,
+        id_column: Optional[str] = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.block = block
+        self.cache = cache if cache is not None else QueryEmbeddingCache()
+        self.feature_names = None
+        if getattr(block, "has_schema", False):
+            self._schema = block.schema
+            self.feature_names = block.schema.column_names
+            if id_column is None:
+                tagged = block.schema.select_by_tag(Tags.USER_ID)
+                if tagged.column_schemas:
+                    id_column = tagged.first.name
+        self.id_column = id_column
+
+    def build(self, input_shapes):
+        self.block.build(input_shapes)
+        self.built = True
+
+    def call(self, inputs, training=False):
+        if training:
+            return self.block(inputs, training=training)
+
+        keys = self.keys(inputs)
+        hits, hit_values, misses = tf.numpy_function(
+            self.cache.lookup, [keys], [tf.int64, tf.float32, tf.int64], stateful=True
+        )
+        if tf.executing_eagerly() and misses.shape[0] == 0:
+            return hit_values
+
+        missing_inputs = tf.nest.map_structure(lambda x: tf.gather(x, misses), inputs)
+        computed = tf.cast(self.block(missing_inputs), tf.float32)
+        tf.numpy_function(
+            self.cache.insert, [tf.gather(keys, misses), computed], tf.int64, stateful=True
+        )
+        hit_values = tf.reshape(hit_values, [-1, tf.shape(computed)[-1]])
+
+        return tf.dynamic_stitch(
+            [tf.cast(hits, tf.int32), tf.cast(misses, tf.int32)], [hit_values, computed]
+        )
+
+    def keys(self, inputs) -> tf.Tensor:
+        """The int64 cache keys of a batch of queries."""
+        if self.id_column:
+            return _id_keys(inputs[self.id_column])
+
+        features = inputs if isinstance(inputs, dict) else {"": inputs}
+        if self.feature_names:
+            features = {name: features[name] for name in self.feature_names if name in features}
+
+        return _hash_features(features)
+
+    def warm_up(self, embeddings, id_column: Optional[str] = None):
+        """Fills the cache with the output of `RetrievalModel.query_embeddings`.
+
+        Parameters
+        ----------
+        embeddings: Union[merlin.io.Dataset, DataFrame]
+            The query features and their embeddings, either in a fixed-size list
+            column `embedding` or in one column per dimension.
+        id_column: str, optional
+            The column of the query ids, by default the `id_column` of the block.
+        """
+        df = embeddings.to_ddf() if hasattr(embeddings, "to_ddf") else embeddings
+        if hasattr(df, "compute"):
+            df = df.compute()
+        if hasattr(df, "to_pandas"):
+            df = df.to_pandas()
+
+        if _EMBEDDING_COLUMN in df.columns:
+            values = np.stack(df[_EMBEDDING_COLUMN].to_numpy())
+            feature_columns = [col for col in df.columns if col != _EMBEDDING_COLUMN]
+        else:
+            dims = sorted((col for col in df.columns if str(col).isdigit()), key=int)
+            values = df[dims].to_numpy()
+            feature_columns = [col for col in df.columns if col not in dims]
+
+        id_column = id_column or self.id_column
+        if id_column:
+            keys = _id_keys(tf.constant(df[id_column].to_numpy()))
+        else:
+            features = {col: _to_tensor(df[col].to_numpy()) for col in feature_columns}
+            keys = self.keys(features)
+        self.cache.warm_up(keys.numpy(), values)
+
+        return self
+
+    def compute_output_shape(self, input_shape):
+        return self.block.compute_output_shape(input_shape)
+
+    @classmethod
+    def from_config(cls, config, custom_objects=None):
+        block = tf.keras.utils.deserialize_keras_object(config.pop("block"))
+        cache = QueryEmbeddingCache(max_size=config.pop("max_size"), ttl=config.pop("ttl"))
+
+        return cls(block, cache=cache, **config)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update(
+            block=tf.keras.utils.serialize_keras_object(self.block),
+            max_size=self.cache.max_size,
+            ttl=self.cache.ttl,
+            id_column=self.id_column,
+        )
+
+        return config
+
+
+def _id_keys(ids: tf.Tensor) -> tf.Tensor:
+    ids = tf.reshape(ids, [-1])
+    if ids.dtype == tf.string:
+        return tf.strings.to_hash_bucket_fast(ids, np.iinfo(np.int64).max)
+
+    return tf.cast(ids, tf.int64)
+
+
+def _hash_features(features) -> tf.Tensor:
+    """Hashes all the features of every row to an int64.
+
+    A feature of shape [batch_size] or [batch_size, 1] and of any integer (or floating)
+    type gets the same hash, so that the keys of the features of a DataFrame match the
+    ones of the batches of the dataloader.
+    """
+    strings = []
+    for name in sorted(features):
+        feature = features[name]
+        if isinstance(feature, tf.SparseTensor):
+            feature = tf.RaggedTensor.from_sparse(feature)
+        if feature.dtype.is_floating:
+            feature = tf.ragged.map_flat_values(
+                lambda x: tf.bitcast(tf.cast(x, tf.float32), tf.int32), feature
+            )
+        if feature.dtype != tf.string:
+            feature = tf.ragged.map_flat_values(tf.strings.as_string, feature)
+        while feature.shape.rank > 1:
+            feature = tf.strings.reduce_join(feature, axis=-1, separator=",")
+        strings.append(feature)
+
+    return tf.strings.to_hash_bucket_fast(
+        tf.strings.join(strings, separator="|"), np.iinfo(np.int64).max
+    )
+
+
+def _to_tensor(values: np.ndarray):
+    if values.dtype == object and len(values) and not isinstance(values[0], (str, bytes)):
+        return tf.ragged.constant([list(value) for value in values])
+
+    return tf.constant(values)
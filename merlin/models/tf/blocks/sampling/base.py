@@ -57,6 +57,12 @@ class ItemSampler(abc.ABC, Layer):
     def required_features(self) -> List[str]:
         return []
 
+    @property
+    def popularity_biased(self) -> bool:
+        """Whether items are sampled in proportion to their frequency in the training
+        batches, so that their scores need the logQ correction of `ItemRetrievalScorer`"""
+        return False
+
     @property
     def max_num_samples(self) -> int:
         return self._max_num_samples
@@ -74,6 +74,10 @@ class CachedCrossBatchSampler(ItemSampler):
         self._last_batch_size = 0
         self._item_embeddings_queue: Optional[FIFOQueue] = None
 
+    @property
+    def popularity_biased(self) -> bool:
+        return True
+
     @property
     def item_embeddings_queue(self) -> FIFOQueue:
         if not self._item_embeddings_queue:
@@ -236,6 +240,10 @@ class CachedUniformSampler(CachedCrossBatchSampler):
         )
         self.item_id_feature_name = item_id_feature_name
 
+    @property
+    def popularity_biased(self) -> bool:
+        return False
+
     def _check_inputs(self, inputs):
         assert (
             str(self.item_id_feature_name) in inputs["metadata"]
@@ -0,0 +1,151 @@
+#
+# Copyright (c) 2021, NVIDIA CORPORATION.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import tensorflow as tf
+from tensorflow.keras.layers import Layer
+
+
+@tf.keras.utils.register_keras_serializable(package="merlin_models")
+class ItemFrequencyEstimator(Layer):
+    """Streaming estimator of the sampling probability of the items in the training batches,
+    for the logQ correction of popularity-biased negative sampling [1]_.
+
+    Every training step, the item ids of the batch are hashed into `num_hash_functions`
+    arrays of `num_buckets` buckets, which keep the step an item was last seen and a moving
+    average of the number of steps between two occurrences of the item (its gap).
+    The probability of an item to be in a batch is estimated as the inverse of its gap,
+    taking the largest gap over the hash functions, as hash collisions only shorten gaps.
+    The memory is fixed by `num_buckets`, whatever the number of items, and no popularity
+    feature needs to be computed offline.
+
+    Estimates start at 1 (no correction) and converge after about `1 / alpha` steps.
+
+    References
+    ----------
+    .. [1] Yi, Xinyang, et al. "Sampling-bias-corrected neural modeling for large corpus item
+       recommendations." Proceedings of the 13th ACM Conference on Recommender Systems. 2019.
+
+    Parameters
+    ----------
+    num_buckets : int, optional
+        Number of buckets of every hash function, by default 2 ** 20
+    num_hash_functions : int, optional
+        Number of hash functions, by default 1
+    alpha : float, optional
+        Learning rate of the moving average of the gaps, by default 0.01
+    """
+
+    def __init__(
+        self,
+        num_buckets: int = 2 ** 20,
+        num_hash_functions: int = 1,
+        alpha: float = 0.01,
+        **kwargs,
+    ):
+        assert num_buckets > 0 and num_hash_functions > 0
+        super(ItemFrequencyEstimator, self).__init__(**kwargs)
+        self.num_buckets = num_buckets
+        self.num_hash_functions = num_hash_functions
+        self.alpha = alpha
+
+        self.step = tf.Variable(
+            initial_value=tf.Variable(lambda: tf.zeros((), dtype=tf.int64)),
+            name="frequency_estimator/step",
+            trainable=False,
+            dtype=tf.int64,
+        )
+        self.last_seen_step = tf.Variable(
+            initial_value=tf.Variable(
+                lambda: tf.zeros([num_hash_functions, num_buckets], dtype=tf.int64)
+            ),
+            name="frequency_estimator/last_seen_step",
+            trainable=False,
+            dtype=tf.int64,
+        )
+        self.average_gap = tf.Variable(
+            initial_value=tf.Variable(
+                lambda: tf.zeros([num_hash_functions, num_buckets], dtype=tf.float32)
+            ),
+            name="frequency_estimator/average_gap",
+            trainable=False,
+            dtype=tf.float32,
+        )
+
+    def call(self, item_ids: tf.Tensor, training=False) -> tf.Tensor:
+        """Returns the estimated probabilities of `item_ids`, after counting them as the
+        items of a new step if `training=True`."""
+        if training:
+            self.update(item_ids)
+
+        return self.probabilities(item_ids)
+
+    def update(self, item_ids: tf.Tensor) -> None:
+        """Counts the (possibly repeated) `item_ids` as the items of a new training step."""
+        step = self.step.assign_add(1)
+        # a bucket is updated once, even when several of its items are in the batch
+        buckets, _ = tf.unique(tf.reshape(self._buckets(item_ids), [-1]))
+        indices = tf.stack([buckets // self.num_buckets, buckets % self.num_buckets], axis=-1)
+
+        gaps = tf.cast(step - tf.gather_nd(self.last_seen_step, indices), tf.float32)
+        average_gaps = tf.gather_nd(self.average_gap, indices)
+        self.average_gap.scatter_nd_update(
+            indices, (1 - self.alpha) * average_gaps + self.alpha * gaps
+        )
+        self.last_seen_step.scatter_nd_update(indices, tf.fill(tf.shape(buckets), step))
+
+    def probabilities(self, item_ids: tf.Tensor) -> tf.Tensor:
+        """The estimated probabilities of `item_ids` to be in a batch, with their shape."""
+        buckets = self._buckets(item_ids)
+        gaps = tf.reduce_max(tf.gather(tf.reshape(self.average_gap, [-1]), buckets), axis=0)
+
+        return tf.reshape(1.0 / tf.maximum(gaps, 1.0), tf.shape(item_ids))
+
+    def log_probabilities(self, item_ids: tf.Tensor) -> tf.Tensor:
+        """The logQ correction of `item_ids`, to be subtracted from their scores."""
+        return tf.math.log(self.probabilities(item_ids))
+
+    def reset(self) -> None:
+        """Forgets the items seen so far."""
+        self.step.assign(tf.zeros_like(self.step))
+        self.last_seen_step.assign(tf.zeros_like(self.last_seen_step))
+        self.average_gap.assign(tf.zeros_like(self.average_gap))
+
+    def _buckets(self, item_ids: tf.Tensor) -> tf.Tensor:
+        """The buckets of the flattened `item_ids` in the flattened hash arrays,
+        with shape (num_hash_functions, number of ids)."""
+        item_ids = tf.reshape(item_ids, [-1])
+        if item_ids.dtype != tf.string:
+            item_ids = tf.strings.as_string(item_ids)
+
+        return tf.stack(
+            [
+                tf.strings.to_hash_bucket_strong(item_ids, self.num_buckets, key=[i, i + 1])
+                + i * self.num_buckets
+                for i in range(self.num_hash_functions)
+            ]
+        )
+
+    def compute_output_shape(self, input_shape):
+        return input_shape
+
+    def get_config(self):
+        config = super().get_config()
+        config.update(
+            num_buckets=self.num_buckets,
+            num_hash_functions=self.num_hash_functions,
+            alpha=self.alpha,
+        )
+
+        return config
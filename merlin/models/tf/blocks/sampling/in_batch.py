@@ -52,6 +52,10 @@ class InBatchSampler(ItemSampler):
         self._last_batch_items_metadata: TabularData = {}
         self.set_batch_size(batch_size)
 
+    @property
+    def popularity_biased(self) -> bool:
+        return True
+
     @property
     def batch_size(self) -> int:
         return self._batch_size
@@ -43,9 +43,14 @@ class FIFOQueue(Layer):
         initialize_tensor : tf.Tensor, optional
             Allows for initializing the storage with values, by default None which initializes
             the storage with -1.
-            P.s. It is important that for categorical features the storage Variable is not
-            initialized with a valid categorical value (e.g. values >= 0), so that `index_of()`
-            works properly
+
+    Queues of integer scalars (e.g. item ids) also keep a hash table mapping every
+    value in the queue to its index, which is updated by the enqueue, dequeue and update
+    operations, so that `index_of()` costs O(number of searched ids) instead of
+    comparing them with the whole storage. The values of `initialize_tensor` are indexed
+    as well. The number of slots holding every value is also kept, so that a value
+    still in the queue is re-pointed to another of its slots when its indexed slot is
+    overwritten by `update_by_indices()`.
     """
 
     def __init__(
@@ -99,6 +104,26 @@ class FIFOQueue(Layer):
             dtype=self.queue_dtype,
         )
 
+        # value -> index of the values in the queue, for `index_of()`, and value -> number of
+        # slots holding it, to re-point a value to another slot when its indexed slot is removed
+        self._index_table = None
+        if self.dims == [] and self.queue_dtype in [tf.int8, tf.int16, tf.int32, tf.int64]:
+            self._index_table = tf.lookup.experimental.MutableHashTable(
+                key_dtype=tf.int64, value_dtype=tf.int64, default_value=-1
+            )
+            self._value_counts = tf.lookup.experimental.MutableHashTable(
+                key_dtype=tf.int64, value_dtype=tf.int64, default_value=0
+            )
+            # whether the slots of the storage hold indexed values
+            self._indexed_slots = tf.Variable(
+                initial_value=tf.Variable(lambda: tf.zeros([capacity], dtype=tf.bool)),
+                trainable=False,
+                synchronization=tf.VariableSynchronization.NONE,
+                dtype=tf.bool,
+            )
+            if self.initialize_tensor is not None:
+                self._index_values(tf.range(capacity), self.storage)
+
     def enqueue(self, val: tf.Tensor) -> None:
         """Enqueues an example into the queue
 
@@ -111,6 +136,7 @@ class FIFOQueue(Layer):
         assert len(val.shape) == len(self.dims), "The rank of val and self.dims should match"
         assert list(val.shape) == self.dims, "The shape of val and self.dims should match"
 
+        self._index_values(tf.expand_dims(self.next_available_pointer, 0), val[None])
         self.storage[self.next_available_pointer].assign(val)
 
         self.next_available_pointer.assign_add(1)
@@ -147,6 +173,7 @@ class FIFOQueue(Layer):
         # if values are larger than the queue capacity N, enqueueing only the last N items
         vals = vals[-self.capacity :]
         num_vals = int(tf.shape(vals)[0])
+        self._index_values((self.next_available_pointer + tf.range(num_vals)) % self.capacity, vals)
 
         next_pos_start = self.next_available_pointer
         next_pos_end = next_pos_start + num_vals
@@ -167,7 +194,13 @@ class FIFOQueue(Layer):
             next_pos_end = num_overplus_items
             self.storage[next_pos_start:next_pos_end].assign(vals[num_vals - num_overplus_items :])
 
-            if self.at_full_capacity or next_pos_end >= self.first_pointer:
+            # the oldest examples are overwritten when the first pointer is passed, either
+            # before wrapping around the storage or after
+            if (
+                self.at_full_capacity
+                or self.next_available_pointer < self.first_pointer
+                or next_pos_end >= self.first_pointer
+            ):
                 self.first_pointer.assign(next_pos_end)
                 self.at_full_capacity.assign(True)
 
@@ -190,6 +223,7 @@ class FIFOQueue(Layer):
             raise IndexError("The queue is empty")
         self.at_full_capacity.assign(False)
         val = self.storage[self.first_pointer]
+        self._unindex(tf.expand_dims(self.first_pointer, 0))
         self.first_pointer.assign_add(1)
         if self.first_pointer >= self.capacity:
             self.first_pointer.assign(0)
@@ -239,6 +273,7 @@ class FIFOQueue(Layer):
 
             vals = tf.concat([vals1, vals2], axis=0)
 
+        self._unindex((self.first_pointer + tf.range(tf.shape(vals)[0])) % self.capacity)
         self.first_pointer.assign(next_pos_end)
         return vals
 
@@ -280,6 +315,10 @@ class FIFOQueue(Layer):
 
     def clear(self) -> None:
         """Removes all examples from the queue"""
+        if self._index_table is not None:
+            self._index_table.remove(self._index_table.export()[0])
+            self._value_counts.remove(self._value_counts.export()[0])
+            self._indexed_slots.assign(tf.zeros_like(self._indexed_slots))
         self.first_pointer.assign(0)
         self.next_available_pointer.assign(0)
         self.at_full_capacity.assign(False)
@@ -297,7 +336,8 @@ class FIFOQueue(Layer):
         -------
         tf.Tensor
             1D tensor with the same size of the input ids, containing the indices of the
-            ids in the queue (-1 if not found)
+            ids in the queue (-1 if not found). An id added several times to the queue gets
+            the index of its last occurrence.
         """
         assert self.queue_dtype in [tf.int8, tf.int16, tf.int32, tf.int64], (
             "The index_of method is only available for queues with an int dtype "
@@ -307,18 +347,7 @@ class FIFOQueue(Layer):
             self.dims == []
         ), "The index_of method is only available for queues of scalars (dims=[])"
 
-        # item_ids_indices = tf.where(tf.equal(ids, self.storage))
-        equal_tensor = tf.cast(tf.equal(self.storage, tf.expand_dims(ids, -1)), tf.int32)
-        # Artificially adding a first zero column so that index 0 is returned if
-        # there is not an equal value (1) row-wise
-        equal_tensor_extended = tf.concat(
-            [tf.zeros(shape=(tf.shape(equal_tensor)[0], 1), dtype=tf.int32), equal_tensor],
-            axis=1,
-        )
-        # Subtracting the indices to account for the first collumn added, so that
-        # values not found become -1
-        item_ids_indices = tf.argmax(equal_tensor_extended, axis=1) - 1
-        return item_ids_indices
+        return self._index_table.lookup(tf.cast(ids, tf.int64))
 
     def get_values_by_indices(self, indices: tf.Tensor) -> tf.Tensor:
         """Retrieves values of the queue based on their index
@@ -353,4 +382,58 @@ class FIFOQueue(Layer):
             "The number of indices and values should match",
         )
 
+        self._index_values(tf.reshape(indices, [-1]), values)
         self.storage.scatter_nd_update(indices, values)
+
+    def _index_values(self, indices: tf.Tensor, values: tf.Tensor) -> None:
+        """Maps the `values` about to be written to the queue `indices` to these indices,
+        replacing the values they held"""
+        if self._index_table is None:
+            return
+        indices = tf.cast(indices, tf.int64)
+        values = tf.cast(values, tf.int64)
+        self._unindex(indices)
+
+        unique_values, _, counts = tf.unique_with_counts(values)
+        self._value_counts.insert(
+            unique_values, self._value_counts.lookup(unique_values) + tf.cast(counts, tf.int64)
+        )
+        # duplicated values are only mapped to the index of their last occurrence
+        self._index_table.insert(values, indices)
+        self._indexed_slots.scatter_nd_update(
+            tf.expand_dims(indices, -1), tf.ones_like(indices, dtype=tf.bool)
+        )
+
+    def _unindex(self, indices: tf.Tensor) -> None:
+        """Removes the values at the queue `indices` from the index table"""
+        if self._index_table is None:
+            return
+        indices = tf.cast(indices, tf.int64)
+        indices = tf.boolean_mask(indices, tf.gather(self._indexed_slots, indices))
+        values = tf.cast(tf.gather(self.storage, indices), tf.int64)
+        self._indexed_slots.scatter_nd_update(
+            tf.expand_dims(indices, -1), tf.zeros_like(indices, dtype=tf.bool)
+        )
+
+        unique_values, positions, counts = tf.unique_with_counts(values)
+        remaining = tf.reshape(
+            self._value_counts.lookup(unique_values) - tf.cast(counts, tf.int64), [-1]
+        )
+        self._value_counts.insert(unique_values, remaining)
+        self._value_counts.remove(tf.boolean_mask(unique_values, remaining <= 0))
+        self._index_table.remove(tf.boolean_mask(unique_values, remaining <= 0))
+
+        # the values whose indexed slot is removed while other slots still hold them are
+        # re-pointed to their last other occurrence, the only case that scans the storage
+        moved = tf.equal(tf.reshape(self._index_table.lookup(values), [-1]), indices) & (
+            tf.gather(remaining, positions) > 0
+        )
+        moved_values, _ = tf.unique(tf.boolean_mask(values, moved))
+        order = (
+            tf.range(self.capacity, dtype=tf.int64) - tf.cast(self.first_pointer, tf.int64)
+        ) % self.capacity
+        matches = tf.equal(
+            tf.expand_dims(moved_values, -1), tf.cast(tf.expand_dims(self.storage, 0), tf.int64)
+        ) & tf.expand_dims(self._indexed_slots, 0)
+        last = tf.argmax(tf.where(matches, tf.expand_dims(order, 0), -1), axis=1)
+        self._index_table.insert(moved_values, last)
@@ -242,6 +242,9 @@ class BatchedDataset(tf.keras.utils.Sequence, DataLoader):
         dictionary of key: column_name + value: integer representing max sequence length for column
     sparse_dense : bool
         bool value to activate transforming sparse tensors to dense
+    transforms : list(callable) or None
+        Functions taking and returning a dataframe, applied to every partition
+        in the loading thread before it is chunked, e.g. `NegativeSampling`
     """
 
     _use_nnz = True
@@ -269,6 +272,7 @@ class BatchedDataset(tf.keras.utils.Sequence, DataLoader):
         multi_label_as_dict=True,
         sparse_as_dense=False,
         schema=None,
+        transforms=None,
     ):
         dataset = _validate_dataset(
             paths_or_dataset, batch_size, buffer_size, engine, device, reader_kwargs
@@ -297,6 +301,7 @@ class BatchedDataset(tf.keras.utils.Sequence, DataLoader):
             sparse_names=sparse_names,
             sparse_max=sparse_max,
             sparse_as_dense=sparse_as_dense,
+            transforms=transforms,
         )
         self._map_fns = []
         if len(label_names) > 1 and multi_label_as_dict:
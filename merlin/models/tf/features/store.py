@@ -0,0 +1,281 @@
+#
+# Copyright (c) 2021, NVIDIA CORPORATION.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import tensorflow as tf
+
+from merlin.models.tf.typing import TabularData
+from merlin.schema import Tags
+
+_STORE_METADATA = "store.json"
+
+
+class ItemFeatureStore:
+    """In-memory columnar store of the item features, indexed by item id.
+
+    Every feature is a numpy array with one row per item, and list features are stored
+    ragged, as their flat values and row offsets. When the ids are dense (e.g.
+    categorified ids), the row of an item is its id; otherwise ids are looked up in
+    their sorted array. A batch of ids is looked up once, then every column is
+    gathered with a single `take`. Unknown ids get zeros (or empty lists)::
+
+        store = ItemFeatureStore.from_dataset(train)
+        features = store(item_ids)  # dict of tensors, as the ones of the dataloader
+
+    A store saved with `save` can be loaded memory-mapped, so that the processes serving
+    the same store share its pages.
+
+    Parameters
+    ----------
+    columns: Dict[str, np.ndarray]
+        The features, by row.
+    offsets: Dict[str, np.ndarray]
+        The row offsets of the list features, whose column holds the flat values.
+    id_column: str
+        The column of the item ids.
+    ids: np.ndarray, optional
+        The sorted ids of the rows, when the row of an item is not its id.
+    expand_dims: bool
+        Whether scalar features are returned with a shape `[batch_size, 1]`, like the
+        ones of the dataloader, instead of `[batch_size]`. Defaults to True.
+    """
+
+    def __init__(
+        self,
+        columns: Dict[str, np.ndarray],
+        offsets: Dict[str, np.ndarray],
+        id_column: str,
+        ids: Optional[np.ndarray] = None,
+        expand_dims: bool = True,
+    ):
+        self.columns = columns
+        self.offsets = offsets
+        self.id_column = id_column
+        self.ids = ids
+        self.expand_dims = expand_dims
+
+    @classmethod
+    def from_dataset(
+        cls,
+        dataset,
+        id_column: Optional[str] = None,
+        tag: Tags = Tags.ITEM,
+        **kwargs,
+    ) -> "ItemFeatureStore":
+        """Builds the store of the columns tagged `tag` (by default `Tags.ITEM`) in the
+        schema of a `merlin.io.Dataset`, keeping the first values of every item."""
+        from merlin.models.utils.dataset import unique_rows_by_id
+
+        schema = dataset.schema
+        id_column = id_column or schema.select_by_tag(Tags.ITEM_ID).first.name
+        columns = schema.select_by_tag(tag).column_names
+        if id_column not in columns:
+            columns = [id_column, *columns]
+        df = unique_rows_by_id(dataset.to_ddf()[columns], id_column).compute()
+
+        return cls.from_dataframe(df, id_column, **kwargs)
+
+    @classmethod
+    def from_dataframe(
+        cls,
+        df,
+        id_column: str,
+        columns: Optional[List[str]] = None,
+        expand_dims: bool = True,
+    ) -> "ItemFeatureStore":
+        """Builds the store from a (pandas or cudf) DataFrame with one row per item."""
+        if hasattr(df, "to_pandas"):
+            df = df.to_pandas()
+        if df[id_column].duplicated().any():
+            raise ValueError(f"The DataFrame has duplicated {id_column}.")
+        columns = columns or [col for col in df.columns if col != id_column]
+
+        ids = df[id_column].to_numpy()
+        dense = (
+            np.issubdtype(ids.dtype, np.integer)
+            and len(ids) > 0
+            and ids.min() >= 0
+            and ids.max() < 2 * len(ids)
+        )
+        if dense:
+            # the row of an item is its id
+            rows, num_rows, store_ids = ids, int(ids.max()) + 1, None
+        else:
+            order = np.argsort(ids, kind="stable")
+            rows, num_rows, store_ids = np.argsort(order), len(ids), ids[order]
+
+        store_columns, offsets = {}, {}
+        for name in [id_column, *columns]:
+            values = df[name].to_numpy()
+            if values.dtype == object and not _is_list(values):
+                values = values.astype(bytes)
+            if values.dtype == object:
+                lengths = np.zeros(num_rows, dtype=np.int64)
+                lengths[rows] = [len(value) for value in values]
+                by_row = np.empty(num_rows, dtype=object)
+                by_row[:] = [()] * num_rows
+                by_row[rows] = values
+                offsets[name] = np.concatenate([[0], np.cumsum(lengths)])
+                store_columns[name] = np.concatenate(
+                    [np.asarray(value) for value in by_row if len(value)]
+                    or [np.zeros(0, dtype=np.float32)]
+                )
+            else:
+                column = np.zeros((num_rows, *values.shape[1:]), dtype=values.dtype)
+                column[rows] = values
+                store_columns[name] = column
+
+        return cls(store_columns, offsets, id_column, ids=store_ids, expand_dims=expand_dims)
+
+    def __len__(self):
+        return len(self.ids) if self.ids is not None else len(self.columns[self.id_column])
+
+    @property
+    def column_names(self) -> List[str]:
+        return list(self.columns)
+
+    def rows(self, ids: np.ndarray) -> np.ndarray:
+        """The rows of `ids`, or -1 for the unknown ids."""
+        ids = np.asarray(ids).reshape(-1)
+        num_rows = len(self)
+        if self.ids is None:
+            positions = ids.astype(np.int64)
+            found = (positions >= 0) & (positions < num_rows)
+        else:
+            positions = np.minimum(np.searchsorted(self.ids, ids), max(num_rows - 1, 0))
+            found = self.ids[positions] == ids if num_rows else np.zeros(len(ids), bool)
+
+        return np.where(found, positions, -1)
+
+    def lookup(self, ids: np.ndarray) -> Dict[str, np.ndarray]:
+        """The features of `ids` as numpy arrays, the list features as a tuple of their
+        flat values and row lengths."""
+        rows = self.rows(ids)
+        known = rows >= 0
+        rows = np.where(known, rows, 0)
+
+        features = {}
+        for name, column in self.columns.items():
+            if name in self.offsets:
+                offsets = self.offsets[name]
+                starts = offsets[rows]
+                lengths = np.where(known, offsets[rows + 1] - starts, 0)
+                positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+                positions += np.arange(len(positions), dtype=positions.dtype)
+                features[name] = (np.take(column, positions, axis=0), lengths)
+            else:
+                values = np.take(column, rows, axis=0)
+                if not known.all():
+                    values[~known] = np.zeros((), dtype=values.dtype)
+                features[name] = values
+
+        return features
+
+    def __call__(self, ids) -> TabularData:
+        """The features of a batch of ids as tensors: dense for the scalar features and
+        ragged for the list features."""
+        if isinstance(ids, tf.Tensor) and not tf.executing_eagerly():
+            return self._graph_lookup(ids)
+
+        ids = ids.numpy() if isinstance(ids, tf.Tensor) else ids
+        return self._to_tensors(self.lookup(ids))
+
+    def save(self, path: str):
+        """Saves the store to the directory `path`, as one `.npy` file per array."""
+        os.makedirs(path, exist_ok=True)
+        arrays = dict(self.columns)
+        arrays.update({f"{name}.offsets": offsets for name, offsets in self.offsets.items()})
+        if self.ids is not None:
+            arrays["ids"] = self.ids
+        for i, array in enumerate(arrays.values()):
+            np.save(os.path.join(path, f"{i}.npy"), array)
+        metadata = dict(
+            arrays=list(arrays),
+            columns=list(self.columns),
+            lists=list(self.offsets),
+            id_column=self.id_column,
+            expand_dims=self.expand_dims,
+        )
+        with open(os.path.join(path, _STORE_METADATA), "w") as f:
+            json.dump(metadata, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, **kwargs) -> "ItemFeatureStore":
+        """Restores a store saved with `save`.
+
+        With `mmap` (the default), the arrays are memory-mapped (read-only) instead of
+        read in memory: loading is instant, only the pages of the looked-up items are
+        read, and the processes loading the same store share them.
+        """
+        with open(os.path.join(path, _STORE_METADATA)) as f:
+            metadata = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f"{i}.npy"), mmap_mode="r" if mmap else None)
+            for i, name in enumerate(metadata["arrays"])
+        }
+        kwargs.setdefault("expand_dims", metadata["expand_dims"])
+
+        return cls(
+            {name: arrays[name] for name in metadata["columns"]},
+            {name: arrays[f"{name}.offsets"] for name in metadata["lists"]},
+            metadata["id_column"],
+            ids=arrays.get("ids"),
+            **kwargs,
+        )
+
+    def _to_tensors(self, features) -> TabularData:
+        outputs = {}
+        for name, values in features.items():
+            if isinstance(values, tuple):
+                values, lengths = values
+                outputs[name] = tf.RaggedTensor.from_row_lengths(values, lengths)
+            else:
+                outputs[name] = tf.convert_to_tensor(values)
+                if self.expand_dims and values.ndim == 1:
+                    outputs[name] = tf.expand_dims(outputs[name], -1)
+
+        return outputs
+
+    def _graph_lookup(self, ids: tf.Tensor) -> TabularData:
+        names, dtypes = [], []
+        for name, column in self.columns.items():
+            names.append(name)
+            dtypes.append(tf.as_dtype(column.dtype))
+            if name in self.offsets:
+                dtypes.append(tf.int64)
+
+        def lookup(ids):
+            flat = []
+            for values in self.lookup(ids).values():
+                flat.extend(values if isinstance(values, tuple) else [values])
+            return flat
+
+        flat = iter(tf.numpy_function(lookup, [ids], dtypes, stateful=False))
+        features = {}
+        for name in names:
+            column = self.columns[name]
+            values = next(flat)
+            values.set_shape([None, *column.shape[1:]])
+            features[name] = (values, next(flat)) if name in self.offsets else values
+
+        return self._to_tensors(features)
+
+
+def _is_list(values: np.ndarray) -> bool:
+    return len(values) > 0 and isinstance(values[0], (list, tuple, np.ndarray))
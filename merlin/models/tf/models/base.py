@@ -414,7 +414,12 @@ class Model(tf.keras.Model, LossMixin, MetricsMixin):
         )
 
     def batch_predict(
-        self, dataset: merlin.io.Dataset, batch_size: int, **kwargs
+        self,
+        dataset: merlin.io.Dataset,
+        batch_size: int,
+        num_workers: Optional[int] = None,
+        output_path: Optional[str] = None,
+        **kwargs,
     ) -> merlin.io.Dataset:
         """Batched prediction using the Dask.
         Parameters
@@ -423,6 +428,12 @@ class Model(tf.keras.Model, LossMixin, MetricsMixin):
             Dataset to predict on.
         batch_size: int
             Batch size to use for prediction.
+        num_workers: int, optional
+            When set, the partitions are predicted eagerly by a `ParallelEncode` pool
+            of `num_workers` threads sharing the model, instead of lazily with Dask.
+        output_path: str, optional
+            When set, the predictions are streamed batch by batch to parquet files
+            in this directory, and a lazy dataset of the files is returned.
         Returns merlin.io.Dataset
         -------
         """
@@ -437,10 +448,16 @@ class Model(tf.keras.Model, LossMixin, MetricsMixin):
         if hasattr(dataset, "to_ddf"):
             dataset = dataset.to_ddf()
 
-        from merlin.models.tf.utils.batch_utils import TFModelEncode
+        from merlin.models.tf.utils.batch_utils import (
+            ParquetSink,
+            TFModelEncode,
+            encode_partitions,
+        )
 
         model_encode = TFModelEncode(self, batch_size=batch_size, **kwargs)
-        predictions = dataset.map_partitions(model_encode)
+        if output_path:
+            return ParquetSink(model_encode, output_path).write(dataset, num_workers)
+        predictions = encode_partitions(model_encode, dataset, num_workers)
 
         return merlin.io.Dataset(predictions)
 
@@ -489,8 +506,13 @@ class RetrievalModel(Model):
 
         columns = dataset.schema.select_by_tag(tag).column_names
         if columns:
-            id_col = dataset.schema.select_by_tag(id_tag).first.name
-            ddf = ddf[columns].groupby(id_col).agg("first").reset_index()
+            id_col = dataset.schema.select_by_tag(id_tag).first
+            ddf = ddf[columns]
+            # a feature table can be marked as unique in the schema to skip the check
+            if not id_col.properties.get("unique", False):
+                from merlin.models.utils.dataset import unique_rows_by_id
+
+                ddf = unique_rows_by_id(ddf, id_col.name)
 
         return ddf
 
@@ -500,6 +522,8 @@ class RetrievalModel(Model):
         query_tag=Tags.USER,
         query_id_tag=Tags.USER_ID,
         batch_size=None,
+        num_workers: Optional[int] = None,
+        output_path: Optional[str] = None,
     ) -> merlin.io.Dataset:
         """Export query embeddings from the model.
         Parameters
@@ -512,16 +536,29 @@ class RetrievalModel(Model):
             Tag to use for the query id.
         batch_size: int
             Batch size to use for embedding extraction.
+        num_workers: int, optional
+            When set, the embeddings are computed eagerly by a `ParallelEncode` pool
+            of `num_workers` threads sharing the model, instead of lazily with Dask.
+        output_path: str, optional
+            When set, the embeddings are streamed batch by batch to parquet files
+            in this directory, with a fixed-size list column `embedding`, and a lazy
+            dataset of the files is returned.
         Returns
         -------
         merlin.io.Dataset
         """
-        from merlin.models.tf.utils.batch_utils import QueryEmbeddings
+        from merlin.models.tf.utils.batch_utils import (
+            QueryEmbeddings,
+            ParquetSink,
+            encode_partitions,
+        )
 
         get_user_emb = QueryEmbeddings(self, batch_size=batch_size)
 
         dataset = self._ensure_unique(dataset, query_tag, query_id_tag)
-        embeddings = dataset.map_partitions(get_user_emb)
+        if output_path:
+            return ParquetSink(get_user_emb, output_path).write(dataset, num_workers)
+        embeddings = encode_partitions(get_user_emb, dataset, num_workers)
 
         return merlin.io.Dataset(embeddings)
 
@@ -531,6 +568,8 @@ class RetrievalModel(Model):
         item_tag=Tags.ITEM,
         item_id_tag=Tags.ITEM_ID,
         batch_size=None,
+        num_workers: Optional[int] = None,
+        output_path: Optional[str] = None,
     ) -> merlin.io.Dataset:
         """Export item embeddings from the model.
         Parameters
@@ -543,16 +582,29 @@ class RetrievalModel(Model):
             Tag to use for the item id.
         batch_size: int
             Batch size to use for embedding extraction.
+        num_workers: int, optional
+            When set, the embeddings are computed eagerly by a `ParallelEncode` pool
+            of `num_workers` threads sharing the model, instead of lazily with Dask.
+        output_path: str, optional
+            When set, the embeddings are streamed batch by batch to parquet files
+            in this directory, with a fixed-size list column `embedding`, and a lazy
+            dataset of the files is returned.
         Returns
         -------
         merlin.io.Dataset
         """
-        from merlin.models.tf.utils.batch_utils import ItemEmbeddings
+        from merlin.models.tf.utils.batch_utils import (
+            ItemEmbeddings,
+            ParquetSink,
+            encode_partitions,
+        )
 
         get_item_emb = ItemEmbeddings(self, batch_size=batch_size)
 
         dataset = self._ensure_unique(dataset, item_tag, item_id_tag)
-        embeddings = dataset.map_partitions(get_item_emb)
+        if output_path:
+            return ParquetSink(get_item_emb, output_path).write(dataset, num_workers)
+        embeddings = encode_partitions(get_item_emb, dataset, num_workers)
 
         return merlin.io.Dataset(embeddings)
 
@@ -589,7 +641,15 @@ class RetrievalModel(Model):
 
         return self
 
-    def to_top_k_recommender(self, data: merlin.io.Dataset, k: int, **kwargs) -> ModelBlock:
+    def to_top_k_recommender(
+        self,
+        data: merlin.io.Dataset,
+        k: int,
+        index_cls=None,
+        query_cache=None,
+        query_embeddings: Optional[merlin.io.Dataset] = None,
+        **kwargs,
+    ) -> ModelBlock:
         """Convert the model to a Top-k Recommender.
         Parameters
         ----------
@@ -597,15 +657,32 @@ class RetrievalModel(Model):
             Dataset to convert to a Top-k Recommender.
         k: int
             Number of recommendations to make.
+        index_cls: Type[TopKIndexBlock], optional
+            The top-k index to build, e.g. `HNSWTopKIndexBlock` for an approximate index,
+            by default `TopKIndexBlock`. `kwargs` are passed to its `from_block`.
+            The recommender accepts the `exclude` argument of the index, to filter out
+            e.g. the items already seen by the users: `recommender(batch, exclude=seen)`.
+        query_cache: QueryEmbeddingCache, optional
+            When set, the query embeddings are served from this cache (see
+            `CachedQueryBlock`), and only the queries missing from it go through the
+            query tower.
+        query_embeddings: merlin.io.Dataset, optional
+            The output of `query_embeddings`, to warm up `query_cache` with.
         Returns
         -------
         SequentialBlock
         """
         import merlin.models.tf as ml
 
-        topk_index = ml.TopKIndexBlock.from_block(
+        index_cls = index_cls or ml.TopKIndexBlock
+        topk_index = index_cls.from_block(
             self.retrieval_block.item_block(), data=data, k=k, **kwargs
         )
-        recommender = self.retrieval_block.query_block().connect(topk_index)
+        query_block = self.retrieval_block.query_block()
+        if query_cache is not None:
+            query_block = ml.CachedQueryBlock(query_block, query_cache)
+            if query_embeddings is not None:
+                query_block.warm_up(query_embeddings)
+        recommender = query_block.connect(topk_index)
 
         return ModelBlock(recommender)
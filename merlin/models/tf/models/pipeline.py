@@ -0,0 +1,133 @@
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+import tensorflow as tf
+
+from merlin.models.tf.models.base import Model
+from merlin.models.tf.typing import TabularData
+
+
+@dataclass
+class StageTimings:
+    """Wall-clock time (in seconds) spent in every stage of a `RetrieveAndRankPipeline`,
+    summed over its calls."""
+
+    num_batches: int = 0
+    num_queries: int = 0
+    retrieval: float = 0.0
+    item_features: float = 0.0
+    ranking: float = 0.0
+
+    @property
+    def total(self) -> float:
+        return self.retrieval + self.item_features + self.ranking
+
+    def per_batch_ms(self) -> Dict[str, float]:
+        """The mean time of every stage per batch, in milliseconds."""
+        num_batches = max(self.num_batches, 1)
+        return {
+            stage: 1000 * getattr(self, stage) / num_batches
+            for stage in ["retrieval", "item_features", "ranking", "total"]
+        }
+
+
+class RetrieveAndRankPipeline:
+    """Two-stage recommender: retrieves `num_candidates` items per query with a retrieval
+    model and its index, then re-ranks them with a ranking model.
+
+    The features of the candidates are gathered by id from `item_features`, the query
+    features are repeated for every candidate, and the `batch_size x num_candidates`
+    pairs are scored in a single call of the ranker::
+
+        retrieval = two_tower.to_top_k_recommender(items, k=100)
+        pipeline = RetrieveAndRankPipeline(retrieval, dlrm, item_features, num_candidates=100)
+        scores, item_ids = pipeline(batch, k=10)
+        print(pipeline.timings.per_batch_ms())
+
+    Parameters
+    ----------
+    retrieval: Callable
+        Returns the `(scores, item_ids)` of the top-k candidates of a batch of queries,
+        e.g. the recommender returned by `RetrievalModel.to_top_k_recommender`.
+    ranker: Model
+        The ranking model, e.g. a `DLRMModel` or a `DCNModel`.
+    item_features: Callable[[tf.Tensor], TabularData]
+        Returns the features of a 1D tensor of item ids, e.g. an `ItemFeatureStore`.
+    num_candidates: int
+        Number of candidates retrieved per query, by default 100.
+    k: int
+        Number of re-ranked items returned per query, by default 10.
+    ranking_output: str, optional
+        The output of the ranker to rank by, when it has several (e.g. multi-task).
+        By default its first output.
+    """
+
+    def __init__(
+        self,
+        retrieval: Callable,
+        ranker: Model,
+        item_features: Callable[[tf.Tensor], TabularData],
+        num_candidates: int = 100,
+        k: int = 10,
+        ranking_output: Optional[str] = None,
+    ):
+        self.retrieval = retrieval
+        self.ranker = ranker
+        self.item_features = item_features
+        self.num_candidates = num_candidates
+        self.k = k
+        self.ranking_output = ranking_output
+        self.timings = StageTimings()
+
+    def __call__(self, inputs: TabularData, k: Optional[int] = None, **kwargs):
+        """Returns the ranker scores and the ids of the top-k items of every query.
+
+        `kwargs` are passed to the retrieval, e.g. `exclude` for a top-k index."""
+        k = k or self.k
+        timings = self.timings
+
+        start = time.perf_counter()
+        retrieval_scores, candidates = self.retrieval(inputs, k=self.num_candidates, **kwargs)
+        retrieved = time.perf_counter()
+
+        features = self.candidate_features(inputs, candidates)
+        gathered = time.perf_counter()
+
+        scores = self.rank(features, tf.shape(candidates))
+        # candidates filtered out by the retrieval (e.g. excluded items) stay last
+        scores = tf.where(retrieval_scores > float("-inf"), scores, float("-inf"))
+        top_scores, top_indices = tf.math.top_k(scores, k=tf.minimum(k, tf.shape(scores)[1]))
+        top_ids = tf.gather(candidates, top_indices, batch_dims=1)
+        ranked = time.perf_counter()
+
+        timings.num_batches += 1
+        timings.num_queries += int(candidates.shape[0])
+        timings.retrieval += retrieved - start
+        timings.item_features += gathered - retrieved
+        timings.ranking += ranked - gathered
+
+        return top_scores, top_ids
+
+    def candidate_features(self, inputs: TabularData, candidates: tf.Tensor) -> TabularData:
+        """The features of the `batch_size x num_candidates` (query, candidate) pairs,
+        flattened to a batch of pairs."""
+        num_candidates = tf.shape(candidates)[1]
+        features = {
+            name: tf.repeat(feature, num_candidates, axis=0) for name, feature in inputs.items()
+        }
+        features.update(self.item_features(tf.reshape(candidates, [-1])))
+
+        return features
+
+    def rank(self, features: TabularData, shape: Tuple[int, int]) -> tf.Tensor:
+        """Scores a batch of pairs with the ranker, reshaped to `shape`."""
+        outputs = self.ranker(features, training=False)
+        if isinstance(outputs, dict):
+            name = self.ranking_output or next(iter(outputs))
+            outputs = outputs[name]
+
+        return tf.reshape(tf.cast(outputs, tf.float32), shape)
+
+    def reset_timings(self):
+        self.timings = StageTimings()
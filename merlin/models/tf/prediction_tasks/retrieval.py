@@ -22,6 +22,7 @@ from merlin.models.tf.blocks.core.base import Block, MetricOrMetrics
 from merlin.models.tf.blocks.core.transformations import L2Norm, PredictionsScaler
 from merlin.models.tf.blocks.retrieval.base import ItemRetrievalScorer
 from merlin.models.tf.blocks.sampling.base import ItemSampler
+from merlin.models.tf.blocks.sampling.frequency import ItemFrequencyEstimator
 from merlin.models.tf.blocks.sampling.in_batch import InBatchSampler
 from merlin.models.tf.losses import LossType, loss_registry
 from merlin.models.tf.metrics.ranking import ranking_metrics
@@ -62,6 +63,10 @@ class ItemRetrievalTask(MultiClassClassificationTask):
         normalize: bool
             Apply L2 normalization before computing dot interactions.
             Defaults to True.
+        logq_correction: bool
+            Corrects the popularity bias of the negative sampling with the item probabilities
+            of an `ItemFrequencyEstimator`, estimated from the training batches.
+            Defaults to False.
 
     Returns
     -------
@@ -85,10 +90,12 @@ class ItemRetrievalTask(MultiClassClassificationTask):
         softmax_temperature: float = 1.0,
         normalize: bool = True,
         cache_query: bool = False,
+        logq_correction: bool = False,
         **kwargs,
     ):
         self.item_id_feature_name = schema.select_by_tag(Tags.ITEM_ID).column_names[0]
         self.cache_query = cache_query
+        self.logq_correction = logq_correction
         pre = self._build_prediction_call(samplers, normalize, softmax_temperature, extra_pre_call)
         self.loss = loss_registry.parse(loss)
 
@@ -116,6 +123,7 @@ class ItemRetrievalTask(MultiClassClassificationTask):
             samplers=samplers,
             item_id_feature_name=self.item_id_feature_name,
             cache_query=self.cache_query,
+            frequency_estimator=ItemFrequencyEstimator() if self.logq_correction else None,
         )
 
         if normalize:
@@ -1,16 +1,37 @@
+import concurrent.futures
+import glob
+import inspect
+import logging
+import multiprocessing
+import os
+import shutil
 import tempfile
+import threading
+import time
 import typing as tp
+import weakref
+from collections import deque
+from dataclasses import dataclass
 
 import numpy as np
 import tensorflow as tf
+from packaging import version
 
-from merlin.core.dispatch import DataFrameType, concat_columns, get_lib
+from merlin.core.dispatch import DataFrameType, concat, concat_columns, get_lib
 from merlin.models.tf.blocks.core.base import Block
 from merlin.models.tf.dataset import BatchedDataset
 from merlin.models.tf.models.base import Model, RetrievalModel
 from merlin.models.utils.schema_utils import select_targets
 from merlin.schema import Schema, Tags
 
+LOG = logging.getLogger("merlin.models")
+
+# `experimental_relax_shapes` was renamed `reduce_retracing` in TF 2.9
+if version.parse(tf.__version__) < version.parse("2.9.0"):
+    _RELAX_SHAPES = {"experimental_relax_shapes": True}
+else:
+    _RELAX_SHAPES = {"reduce_retracing": True}
+
 
 class ModelEncode:
     def __init__(
@@ -59,11 +80,448 @@ class ModelEncode:
 
         return output_df
 
+    def encode_batches(self, df: DataFrameType) -> tp.Iterator[tp.Tuple[DataFrameType, tp.Any]]:
+        """Yields the rows of every batch of `df` along with the model outputs of the
+        batch, without concatenating the outputs of the whole partition."""
+        iterator_func = self.data_iterator_func or (lambda x: [x])
+        encode_func = self.model_encode_func or (lambda x, y: x(y))
+
+        start = 0
+        for batch in iterator_func(df):
+            outputs = encode_func(self.model, batch)
+            num_rows = len(outputs)
+            yield df.iloc[start : start + num_rows], outputs
+            start += num_rows
+
     def transform(self, col_selector, df: DataFrameType, **kwargs) -> DataFrameType:
         return self(df[col_selector], **kwargs)
 
 
+@dataclass
+class EncodeReport:
+    """Throughput of a `ParallelEncode` run.
+
+    `read_seconds` and `encode_seconds` are summed over the workers, so comparing them
+    tells whether a job is bound by reading the data or by the model.
+    """
+
+    num_workers: int
+    num_partitions: int = 0
+    num_rows: int = 0
+    seconds: float = 0.0
+    read_seconds: float = 0.0
+    encode_seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.num_rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (
+            f"Encoded {self.num_rows} rows ({self.num_partitions} partitions) in "
+            f"{self.seconds:.2f}s with {self.num_workers} workers: "
+            f"{self.rows_per_second:.0f} rows/s (read {self.read_seconds:.2f}s, "
+            f"encode {self.encode_seconds:.2f}s)"
+        )
+
+
+class ParallelEncode:
+    """Batch-inference engine running a `ModelEncode` over the partitions of a dataset
+    on a pool of workers.
+
+    With threads (the default), the workers share the model of `model_encode`. With
+    processes, every worker process unpickles `model_encode` once, e.g. a
+    `TFModelEncode` saves its model once and every process loads it on its first
+    partition. The next partitions are read while the previous ones are encoded, at
+    most `max_pending` partitions are in flight, and the encoded partitions are
+    returned in the order of the dataset::
+
+        encode = ParallelEncode(TFModelEncode(model, batch_size=1024), num_workers=8)
+        for predictions in encode(dataset):
+            ...
+        print(encode.report)
+
+    Parameters
+    ----------
+    model_encode: ModelEncode
+        The encoder of a partition.
+    num_workers: int
+        Number of partitions encoded concurrently, by default 4.
+    processes: bool
+        Whether the workers are processes instead of threads, by default False.
+    max_pending: int, optional
+        Maximum number of partitions read or encoded ahead of the consumer,
+        by default `2 * num_workers`.
+    mp_context: str
+        The `multiprocessing` start method of the worker processes, by default "spawn".
+    """
+
+    def __init__(
+        self,
+        model_encode: ModelEncode,
+        num_workers: int = 4,
+        processes: bool = False,
+        max_pending: tp.Optional[int] = None,
+        mp_context: str = "spawn",
+    ):
+        if num_workers < 1:
+            raise ValueError(f"num_workers must be at least 1, got {num_workers}")
+
+        self.model_encode = model_encode
+        self.num_workers = num_workers
+        self.processes = processes
+        self.max_pending = max(max_pending or 2 * num_workers, 1)
+        self.mp_context = mp_context
+        self.report = EncodeReport(num_workers)
+
+    def __call__(self, data, **kwargs) -> tp.Iterator[DataFrameType]:
+        """Yields the encoded partitions of `data` in order, `kwargs` are passed to
+        `model_encode` (e.g. `filter_input_columns`)."""
+        ddf = data.to_ddf() if hasattr(data, "to_ddf") else data
+        self.report = report = EncodeReport(self.num_workers)
+        start = time.perf_counter()
+
+        pool = self._pool()
+        pending: tp.Deque[concurrent.futures.Future] = deque()
+        try:
+            for i in range(ddf.npartitions):
+                if self.processes:
+                    # partitions are read by the consumer thread while the workers encode
+                    partition, read_seconds = _read_partition(ddf, i)
+                    report.read_seconds += read_seconds
+                    partition_kwargs = _with_partition_info(self.model_encode, kwargs, i)
+                    pending.append(pool.submit(_encode_in_worker, partition, partition_kwargs))
+                else:
+                    pending.append(pool.submit(self._read_and_encode, ddf, i, kwargs))
+
+                if len(pending) >= self.max_pending:
+                    yield self._collect(pending.popleft(), report, start)
+            while pending:
+                yield self._collect(pending.popleft(), report, start)
+        finally:
+            # `shutdown(cancel_futures=True)` needs python 3.9
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+        LOG.info(str(report))
+
+    def compute(self, data, **kwargs) -> DataFrameType:
+        """Encodes `data` and returns the concatenated partitions."""
+        return concat(list(self(data, **kwargs)), ignore_index=True)
+
+    def _pool(self) -> concurrent.futures.Executor:
+        if not self.processes:
+            return concurrent.futures.ThreadPoolExecutor(self.num_workers)
+
+        import cloudpickle
+
+        return concurrent.futures.ProcessPoolExecutor(
+            self.num_workers,
+            mp_context=multiprocessing.get_context(self.mp_context),
+            initializer=_init_encode_worker,
+            initargs=(cloudpickle.dumps(self.model_encode),),
+        )
+
+    def _read_and_encode(self, ddf, i, kwargs):
+        partition, read_seconds = _read_partition(ddf, i)
+        kwargs = _with_partition_info(self.model_encode, kwargs, i)
+        output, encode_seconds = _encode(self.model_encode, partition, kwargs)
+        return output, read_seconds, encode_seconds
+
+    @staticmethod
+    def _collect(future, report, start):
+        output, read_seconds, encode_seconds = future.result()
+        report.num_partitions += 1
+        report.num_rows += len(output)
+        report.read_seconds += read_seconds
+        report.encode_seconds += encode_seconds
+        report.seconds = time.perf_counter() - start
+
+        return output
+
+
+class ParquetSink:
+    """Streams the outputs of a `ModelEncode` to a directory of parquet files, instead
+    of concatenating them into a DataFrame.
+
+    Every partition is written to its own `part.<i>.parquet` file, with one row group
+    per batch, so the memory used is bounded by a partition of inputs and a batch of
+    outputs, whatever the size of the output. Outputs with several values per row and
+    no name per value (e.g. embeddings) are written to a single fixed-size list
+    column::
+
+        sink = ParquetSink(ItemEmbeddings(model, batch_size=1024), "item_embeddings/")
+        item_embeddings = sink.write(dataset, num_workers=4)
+
+    Parameters
+    ----------
+    model_encode: ModelEncode
+        The encoder of a partition.
+    output_path: str
+        The directory of the parquet files.
+    list_column: str
+        The name of the fixed-size list column, by default "embedding".
+    """
+
+    def __init__(self, model_encode: ModelEncode, output_path: str, list_column="embedding"):
+        self.model_encode = model_encode
+        self.output_path = output_path
+        self.list_column = list_column
+
+    def __call__(
+        self,
+        df: DataFrameType,
+        filter_input_columns: tp.Optional[tp.List[str]] = None,
+        filter_output_columns: tp.Optional[tp.List[str]] = None,
+        partition_info: tp.Optional[tp.Dict[str, tp.Any]] = None,
+    ) -> DataFrameType:
+        """Writes the outputs of the partition `df` and returns its number of rows."""
+        import pyarrow.parquet as pq
+
+        number = partition_info["number"] if partition_info else 0
+        path = os.path.join(self.output_path, f"part.{number}.parquet")
+
+        writer, num_rows = None, 0
+        if len(df) == 0:
+            return type(df)({"num_rows": [num_rows]})
+        try:
+            for inputs, outputs in self.model_encode.encode_batches(df):
+                if filter_input_columns:
+                    inputs = inputs[filter_input_columns]
+                table = self._to_table(inputs, outputs, filter_output_columns)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+                num_rows += table.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+
+        return type(df)({"num_rows": [num_rows]})
+
+    def __dask_tokenize__(self):
+        # dask pickles the callables without a token to name the tasks, which would
+        # save the model of a `TFModelEncode` on every `write()`
+        tokenize = getattr(self.model_encode, "__dask_tokenize__", None)
+        encode_token = tokenize() if tokenize is not None else id(self.model_encode)
+        return type(self).__name__, encode_token, self.output_path, self.list_column
+
+    def write(self, data, num_workers: tp.Optional[int] = None, **kwargs):
+        """Writes the outputs of all the partitions of `data`, and returns a lazy
+        `merlin.io.Dataset` of the parquet files.
+
+        The partitions are encoded with Dask, or on a `ParallelEncode` pool of
+        `num_workers` threads when given. `kwargs` are passed to `__call__`.
+        The parquet files of a previous `write()` to `output_path` are removed first.
+        Empty partitions are not written; when `data` has no rows at all, the returned
+        dataset is empty and only has the input columns, as no output was computed.
+        """
+        import merlin.io
+
+        ddf = data.to_ddf() if hasattr(data, "to_ddf") else data
+        os.makedirs(self.output_path, exist_ok=True)
+        for path in glob.glob(os.path.join(self.output_path, "part.*.parquet")):
+            os.remove(path)
+
+        if num_workers is None:
+            counts = ddf.map_partitions(self, meta={"num_rows": "int64"}, **kwargs).compute()
+        else:
+            counts = ParallelEncode(self, num_workers=num_workers).compute(ddf, **kwargs)
+        num_rows = int(counts["num_rows"].sum())
+        LOG.info(f"Wrote {num_rows} rows to {self.output_path}")
+
+        if num_rows == 0:
+            LOG.warning(f"No rows to encode, {self.output_path} is left empty")
+            empty = ddf._meta
+            if kwargs.get("filter_input_columns"):
+                empty = empty[kwargs["filter_input_columns"]]
+            return merlin.io.Dataset(empty)
+
+        return merlin.io.Dataset(self.output_path, engine="parquet")
+
+    def _to_table(self, inputs, outputs, filter_output_columns=None):
+        import pyarrow as pa
+
+        table = _to_arrow(inputs)
+        if hasattr(outputs, "columns"):
+            output_table = _to_arrow(outputs)
+            columns = list(zip(output_table.column_names, output_table.columns))
+        else:
+            outputs = np.asarray(outputs)
+            names = self.model_encode.output_names
+            if outputs.ndim == 1:
+                columns = [(names[0] if names else "0", pa.array(outputs))]
+            elif names and len(names) == outputs.shape[1]:
+                columns = [(name, pa.array(outputs[:, i])) for i, name in enumerate(names)]
+            else:
+                values = pa.array(np.ascontiguousarray(outputs).reshape(-1))
+                columns = [
+                    (self.list_column, pa.FixedSizeListArray.from_arrays(values, outputs.shape[1]))
+                ]
+
+        for name, column in columns:
+            if not filter_output_columns or name in filter_output_columns:
+                table = table.append_column(name, column)
+
+        return table
+
+
+class ArraySink:
+    """Writes the outputs of a `ModelEncode` (e.g. item embeddings) and the ids of their
+    rows into two preallocated numpy arrays, instead of concatenating DataFrames.
+
+    The rows of every partition are counted first (reading the id column only), so
+    that every partition is encoded straight into its final rows. The partitions are
+    encoded concurrently by a pool of threads, and the memory used is a single copy of
+    the outputs, plus a partition in flight per worker. With `output_path`, the arrays
+    are memory-mapped `.npy` files in this directory::
+
+        sink = ArraySink(ItemEmbeddings(model, batch_size=1024), id_column="item_id")
+        embeddings, item_ids = sink.write(dataset, num_workers=8)
+
+    Parameters
+    ----------
+    model_encode: ModelEncode
+        The encoder of a partition.
+    id_column: str
+        The column of the ids of the rows.
+    output_path: str, optional
+        The directory of the memory-mapped `values.npy` and `ids.npy` arrays,
+        by default the arrays are in memory.
+    dtype: np.dtype
+        The type of the outputs array, by default float32.
+    """
+
+    def __init__(
+        self,
+        model_encode: ModelEncode,
+        id_column: str,
+        output_path: tp.Optional[str] = None,
+        dtype=np.float32,
+    ):
+        self.model_encode = model_encode
+        self.id_column = id_column
+        self.output_path = output_path
+        self.dtype = dtype
+
+    def write(self, data, num_workers: int = 4) -> tp.Tuple[np.ndarray, np.ndarray]:
+        """Encodes all the partitions of `data` on `num_workers` threads, and returns
+        the outputs and the ids of the rows, in the order of the dataset."""
+        ddf = data.to_ddf() if hasattr(data, "to_ddf") else data
+        sizes = ddf[self.id_column].map_partitions(len).compute().to_numpy()
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        num_rows = int(offsets[-1])
+        ids = self._allocate("ids", (num_rows,), ddf[self.id_column].dtype)
+
+        # the outputs are allocated once the first batch gives their shape
+        values, lock = [], threading.Lock()
+
+        def buffer(outputs: np.ndarray) -> np.ndarray:
+            with lock:
+                if not values:
+                    shape = (num_rows, *outputs.shape[1:])
+                    values.append(self._allocate("values", shape, self.dtype))
+            return values[0]
+
+        def encode(i: int):
+            partition, _ = _read_partition(ddf, i)
+            row = offsets[i]
+            for inputs, outputs in self.model_encode.encode_batches(partition):
+                outputs = np.asarray(outputs)
+                end = row + len(outputs)
+                buffer(outputs)[row:end] = outputs
+                ids[row:end] = inputs[self.id_column].to_numpy()
+                row = end
+            if row != offsets[i + 1]:
+                raise ValueError(
+                    f"Partition {i} has {sizes[i]} rows but {row - offsets[i]} were encoded."
+                )
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max(num_workers, 1)) as pool:
+            list(pool.map(encode, range(ddf.npartitions)))
+        LOG.info(
+            f"Encoded {num_rows} rows ({ddf.npartitions} partitions) in "
+            f"{time.perf_counter() - start:.2f}s with {num_workers} workers"
+        )
+
+        if not values:
+            values.append(self._allocate("values", (0, 0), self.dtype))
+        return values[0], ids
+
+    def _allocate(self, name: str, shape, dtype) -> np.ndarray:
+        if self.output_path is None:
+            return np.empty(shape, dtype=dtype)
+
+        os.makedirs(self.output_path, exist_ok=True)
+        path = os.path.join(self.output_path, f"{name}.npy")
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+
+def _to_arrow(df):
+    if hasattr(df, "to_arrow"):
+        return df.to_arrow(preserve_index=False)
+
+    import pyarrow as pa
+
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _with_partition_info(model_encode, kwargs, i):
+    # like `map_partitions`, tells the encoders that accept it which partition is encoded
+    if "partition_info" in inspect.signature(model_encode).parameters:
+        return dict(kwargs, partition_info={"number": i, "division": None})
+    return kwargs
+
+
+def encode_partitions(model_encode: ModelEncode, ddf, num_workers: tp.Optional[int] = None):
+    """Encodes the partitions of `ddf` lazily with `map_partitions`, or eagerly on a
+    `ParallelEncode` pool of `num_workers` threads when given."""
+    if num_workers is None:
+        return ddf.map_partitions(model_encode)
+
+    return ParallelEncode(model_encode, num_workers=num_workers).compute(ddf)
+
+
+_worker_encode: tp.Optional[ModelEncode] = None
+
+
+def _init_encode_worker(payload):
+    import cloudpickle
+
+    global _worker_encode
+    _worker_encode = cloudpickle.loads(payload)
+
+
+def _encode_in_worker(partition, kwargs):
+    output, encode_seconds = _encode(_worker_encode, partition, kwargs)
+    return output, 0.0, encode_seconds
+
+
+def _read_partition(ddf, i):
+    start = time.perf_counter()
+    partition = ddf.get_partition(i).compute(scheduler="synchronous")
+    return partition, time.perf_counter() - start
+
+
+def _encode(model_encode, partition, kwargs):
+    start = time.perf_counter()
+    output = model_encode(partition, **kwargs)
+    return output, time.perf_counter() - start
+
+
 class TFModelEncode(ModelEncode):
+    """Encodes the partitions of a dataset with a model (or a block), e.g. with
+    `ddf.map_partitions(TFModelEncode(model))`.
+
+    The partitions are encoded in-process with the live model, through an inference
+    `tf.function` traced once and cached by the encoder. The model is only saved
+    (to `save_path`, or a temporary directory removed with the encoder) when the
+    encoder is pickled to be sent to out-of-process workers, which load it lazily
+    with `block_load_func` (by default `tf.keras.models.load_model`).
+    """
+
     def __init__(
         self,
         model: tp.Union[Model, tf.keras.Model],
@@ -74,8 +532,9 @@ class TFModelEncode(ModelEncode):
         schema: tp.Optional[Schema] = None,
         output_concat_func=None,
     ):
-        save_path = save_path or tempfile.mkdtemp()
-        model.save(save_path)
+        self.save_path = save_path
+        self._saved_path: tp.Optional[str] = None
+        self._inference_fn = None
 
         model_load_func = block_load_func if block_load_func else tf.keras.models.load_model
         if not output_names:
@@ -92,14 +551,43 @@ class TFModelEncode(ModelEncode):
         self.schema = schema or model.schema
 
         super().__init__(
-            save_path,
+            model,
             output_names,
             data_iterator_func=data_iterator_func(self.schema, batch_size=batch_size),
             model_load_func=model_load_func,
-            model_encode_func=model_encode,
+            model_encode_func=self._encode,
             output_concat_func=output_concat_func,
         )
 
+    def _encode(self, model, batch):
+        if self._inference_fn is None:
+            # traced once per input signature, the batch dimension is kept unknown
+            self._inference_fn = tf.function(model, **_RELAX_SHAPES)
+        return model_encode(self._inference_fn, batch)
+
+    def __getstate__(self):
+        # pickling is for out-of-process workers: the model is saved once and sent
+        # by path, the workers load it on their first partition
+        state = self.__dict__.copy()
+        state["_inference_fn"] = None
+        if not isinstance(self._model, str):
+            state["_model"] = self._save_model()
+        return state
+
+    def __dask_tokenize__(self):
+        # avoids pickling (and saving the model) to compute the dask task names
+        return type(self).__name__, id(self)
+
+    def _save_model(self) -> str:
+        if self._saved_path is None:
+            save_path = self.save_path
+            if save_path is None:
+                save_path = tempfile.mkdtemp()
+                weakref.finalize(self, shutil.rmtree, save_path, ignore_errors=True)
+            self._model.save(save_path)
+            self._saved_path = save_path
+        return self._saved_path
+
     # def fit_transform(self, data) -> nvt.Dataset:
     #     features = self.schema.column_names >> self
     #
@@ -156,7 +644,7 @@ def model_encode(model, batch):
 
 def encode_output(output: tf.Tensor):
     if len(output.shape) == 2 and output.shape[1] == 1:
-        output = tf.squeeze(output)
+        output = tf.squeeze(output, axis=1)
 
     return output.numpy()
 
@@ -175,6 +663,7 @@ def data_iterator_func(schema, batch_size: int = 512):
             cat_names=cat_cols,
             cont_names=cont_cols,
             label_names=targets,
+            shuffle=False,
         )
 
     return data_iterator
@@ -0,0 +1,193 @@
+#
+# Copyright (c) 2021, NVIDIA CORPORATION.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import asyncio
+import concurrent.futures
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+import tensorflow as tf
+
+
+@dataclass
+class BatchingStats:
+    """Statistics of the batches run by a `MicroBatcher`."""
+
+    num_requests: int = 0
+    num_batches: int = 0
+    num_rows: int = 0
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.num_rows / self.num_batches if self.num_batches else 0.0
+
+
+class MicroBatcher:
+    """Asyncio serving front-end coalescing concurrent requests into batches.
+
+    Requests (e.g. of a single user) are queued, and a batch is run as soon as it has
+    `max_batch_size` rows or `max_latency_ms` milliseconds after its first request.
+    The batch goes through `predict_fn` once, e.g. the query tower and the index of
+    `to_top_k_recommender`, on a worker thread so that the event loop keeps collecting
+    the next batch, and the outputs are scattered back to the awaiting callers::
+
+        recommender = model.to_top_k_recommender(items, k=20)
+        async with MicroBatcher(recommender, max_batch_size=64) as batcher:
+            scores, ids = await batcher.predict(user_features)
+
+    Parameters
+    ----------
+    predict_fn: Callable
+        Called on the features of a batch (a dict of tensors), returns a tensor or a
+        nested structure of tensors (e.g. the `(scores, ids)` of a top-k index) of the
+        same batch size.
+    max_batch_size: int
+        Maximum number of rows of a batch, by default 64.
+    max_latency_ms: float
+        Maximum time a request waits for other requests to fill its batch,
+        by default 2ms.
+    max_concurrent_batches: int
+        Number of batches run by `predict_fn` concurrently, by default 1. While a
+        batch runs, the next requests are coalesced into the next batch.
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable,
+        max_batch_size: int = 64,
+        max_latency_ms: float = 2.0,
+        max_concurrent_batches: int = 1,
+    ):
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be at least 1, got {max_batch_size}")
+
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency_ms = max_latency_ms
+        self.max_concurrent_batches = max_concurrent_batches
+        self.stats = BatchingStats()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+    async def __aenter__(self) -> "MicroBatcher":
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def start(self):
+        """Starts collecting the requests, in the running event loop."""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._executor = concurrent.futures.ThreadPoolExecutor(self.max_concurrent_batches)
+            self._worker = asyncio.get_running_loop().create_task(self._collect())
+
+    async def close(self):
+        """Runs the pending requests and stops the batcher."""
+        if self._worker is None:
+            return
+        await self._queue.put(None)
+        await self._worker
+        self._executor.shutdown(wait=True)
+        self._queue, self._worker, self._executor = None, None, None
+
+    async def predict(self, features):
+        """Returns the outputs of `predict_fn` for the rows of `features` (a dict of
+        tensors or arrays with a batch dimension), as numpy arrays."""
+        if self._worker is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((features, _num_rows(features), future))
+
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        running = asyncio.Semaphore(self.max_concurrent_batches)
+        batches = set()
+        # a pending `get` is kept for the next batch instead of being cancelled on
+        # timeout, which could lose its request
+        getter = None
+        closing = False
+        while not closing:
+            if getter is None:
+                getter = loop.create_task(self._queue.get())
+            request, getter = await getter, None
+            if request is None:
+                break
+            requests, num_rows = [request], request[1]
+            deadline = loop.time() + self.max_latency_ms / 1000
+            while num_rows < self.max_batch_size:
+                try:
+                    request = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    getter = loop.create_task(self._queue.get())
+                    done, _ = await asyncio.wait({getter}, timeout=timeout)
+                    if not done:
+                        break
+                    request, getter = getter.result(), None
+                if request is None:
+                    closing = True
+                    break
+                requests.append(request)
+                num_rows += request[1]
+
+            await running.acquire()
+            batch = loop.create_task(self._run(requests, num_rows))
+            batches.add(batch)
+            batch.add_done_callback(lambda task: (batches.discard(task), running.release()))
+
+        if batches:
+            await asyncio.gather(*batches)
+
+    async def _run(self, requests: List[Tuple[Any, int, asyncio.Future]], num_rows: int):
+        self.stats.num_requests += len(requests)
+        self.stats.num_batches += 1
+        self.stats.num_rows += num_rows
+        loop = asyncio.get_running_loop()
+        try:
+            outputs = await loop.run_in_executor(
+                self._executor, self._predict, [features for features, _, _ in requests]
+            )
+        except Exception as e:
+            for _, _, future in requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        start = 0
+        for _, size, future in requests:
+            if not future.done():
+                future.set_result(tf.nest.map_structure(lambda x: x[start : start + size], outputs))
+            start += size
+
+    def _predict(self, features: List[Any]):
+        if len(features) == 1:
+            batch = features[0]
+        else:
+            batch = tf.nest.map_structure(lambda *x: tf.concat(x, axis=0), *features)
+        outputs = self.predict_fn(batch)
+
+        return tf.nest.map_structure(lambda x: np.asarray(x), outputs)
+
+
+def _num_rows(features) -> int:
+    return int(tf.nest.flatten(features)[0].shape[0])
@@ -163,6 +163,14 @@ def unpack_df(gdf):
     return from_dlpack(gdf)
 
 
+def array_to_tensor(array: np.ndarray) -> tf.Tensor:
+    """Converts a numpy array to a tensor sharing its memory (through DLPack) when
+    possible, instead of copying it."""
+    if array.dtype.kind in "iuf" and array.flags.c_contiguous and hasattr(array, "__dlpack__"):
+        return from_dlpack(array.__dlpack__())
+    return tf.convert_to_tensor(array)
+
+
 def df_to_tensor(gdf, dtype=None):
     if gdf.empty:
         return
@@ -50,6 +50,9 @@ class Dataset(torch.utils.data.IterableDataset, DataLoader):
         dictionary of key: column_name + value: integer representing max sequence length for column
     sparse_dense : bool
         bool value to activate transforming sparse tensors to dense
+    transforms : [callable]
+        functions taking and returning a dataframe, applied to every partition
+        in the loading thread before it is chunked, e.g. `NegativeSampling`
     """
 
     def __init__(
@@ -69,6 +72,7 @@ class Dataset(torch.utils.data.IterableDataset, DataLoader):
         sparse_names=None,
         sparse_max=None,
         sparse_as_dense=False,
+        transforms=None,
     ):
         DataLoader.__init__(
             self,
@@ -87,6 +91,7 @@ class Dataset(torch.utils.data.IterableDataset, DataLoader):
             sparse_names=sparse_names,
             sparse_max=sparse_max,
             sparse_as_dense=sparse_as_dense,
+            transforms=transforms,
         )
 
     def __iter__(self):
@@ -16,7 +16,6 @@
 
 import numpy as np
 import pandas as pd
-from scipy.sparse import coo_matrix
 
 from merlin.io import Dataset
 from merlin.schema import Tags
@@ -24,6 +23,8 @@ from merlin.schema import Tags
 
 def dataset_to_coo(dataset: Dataset):
     """Converts a merlin.io.Dataset object to a scipy coo matrix"""
+    from scipy.sparse import coo_matrix
+
     user_id_column = dataset.schema.select_by_tag(Tags.USER_ID).first.name
     item_id_column = dataset.schema.select_by_tag(Tags.ITEM_ID).first.name
 
@@ -55,3 +56,71 @@ def _to_numpy(series):
         return series.values
     else:
         return series.values_host
+
+
+def unique_rows_by_id(ddf, id_column: str):
+    """Returns the first values of every id of a Dask DataFrame, like
+    `ddf.groupby(id_column).agg("first").reset_index()` (the first non-null value of every
+    column, the rows with a null id are dropped), without sorting the rows by id.
+
+    Every partition is first reduced by id with a local groupby. Then, only the range and
+    number of ids of the partitions are computed: an id can only be found in several
+    partitions if it is in the ranges of several partitions. When the ranges don't overlap
+    (e.g. for a table sorted or partitioned by id), the partitions are only reordered by
+    range, without any shuffle. Otherwise, only the rows whose id is in the overlap of
+    several ranges are merged with a groupby.
+    """
+    import dask.dataframe as dd
+
+    ddf = ddf.map_partitions(_first_rows, id_column)
+
+    ids = ddf[id_column]
+    meta = {"min": ids.dtype, "max": ids.dtype, "count": "int64"}
+    ranges = ids.map_partitions(_id_range, meta=meta).compute()
+    if not isinstance(ranges, pd.DataFrame):
+        ranges = ranges.to_pandas()
+    # one row per partition, in the order of the partitions
+    ranges = ranges.reset_index(drop=True)
+    ranges = ranges[ranges["count"] > 0].sort_values("min", kind="stable")
+    if len(ranges) == 0:
+        return ddf
+    overlaps = _overlaps(ranges["min"].to_numpy(), ranges["max"].to_numpy())
+    if not overlaps:
+        return ddf.partitions[ranges.index.tolist()]
+
+    is_colliding = ids.map_partitions(_in_ranges, overlaps, meta=(id_column, bool))
+    # the first values of an id are the ones of its first partition
+    merged = ddf[is_colliding].groupby(id_column).agg("first").reset_index()
+
+    return dd.concat([ddf[~is_colliding], merged[list(ddf.columns)]])
+
+
+def _first_rows(df, id_column):
+    return df.groupby(id_column, sort=True).agg("first").reset_index()
+
+
+def _id_range(ids):
+    return type(ids.to_frame())({"min": [ids.min()], "max": [ids.max()], "count": [len(ids)]})
+
+
+def _overlaps(mins, maxs):
+    """Disjoint ranges of the ids found in at least two of the ranges `[mins, maxs]`,
+    sorted by `mins`."""
+    overlaps = []
+    upper = maxs[0]
+    for low, high in zip(mins[1:], maxs[1:]):
+        if low <= upper:
+            high_overlap = min(high, upper)
+            if overlaps and low <= overlaps[-1][1]:
+                overlaps[-1][1] = max(overlaps[-1][1], high_overlap)
+            else:
+                overlaps.append([low, high_overlap])
+        upper = max(upper, high)
+    return overlaps
+
+
+def _in_ranges(ids, ranges):
+    in_ranges = ids.between(*ranges[0])
+    for low, high in ranges[1:]:
+        in_ranges |= ids.between(low, high)
+    return in_ranges
@@ -0,0 +1,147 @@
+"""Recall-vs-latency benchmark of the approximate top-k indices against the exact index.
+
+Example usage::
+    python scripts/benchmark_index.py --num-items 1000000 --dim 64 --nlist 1024
+"""
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import merlin.models.tf as ml
+
+
+def synthetic_embeddings(num_items, num_queries, dim, num_clusters=1000, seed=0):
+    """Clustered item embeddings (and queries), closer to trained embeddings than noise."""
+    rng = np.random.RandomState(seed)
+    centers = rng.normal(scale=2.0, size=(num_clusters, dim))
+    items = centers[rng.randint(num_clusters, size=num_items)] + rng.normal(
+        size=(num_items, dim)
+    )
+    queries = centers[rng.randint(num_clusters, size=num_queries)] + rng.normal(
+        size=(num_queries, dim)
+    )
+    return items.astype(np.float32), queries.astype(np.float32)
+
+
+def measure(index, queries, k, batch_size, repeats=3):
+    """Returns the top-k ids of `queries` and the best latency per query batch (ms)."""
+    search = tf.function(lambda x: index(x, k=k))
+    batches = [queries[i : i + batch_size] for i in range(0, len(queries), batch_size)]
+    top_ids = np.concatenate([search(batch)[1].numpy() for batch in batches])
+
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for batch in batches:
+            search(batch)[1].numpy()
+        latencies.append((time.perf_counter() - start) / len(batches))
+
+    return top_ids, 1000 * min(latencies)
+
+
+def recall(approximate_ids, exact_ids):
+    return np.mean([len(np.intersect1d(a, e)) / len(e) for a, e in zip(approximate_ids, exact_ids)])
+
+
+def main(args):
+    items, queries = synthetic_embeddings(args.num_items, args.num_queries, args.dim)
+    ids = tf.range(args.num_items)
+
+    print(f"{'index':<28}{'recall@' + str(args.k):>12}{'ms/batch':>12}{'build (s)':>12}")
+
+    def report(name, index, build_time=0.0, batch_size=args.batch_size, num_queries=None):
+        top_ids, latency = measure(index, queries[:num_queries], args.k, batch_size)
+        exact = exact_ids[: len(top_ids)]
+        print(f"{name:<28}{recall(top_ids, exact):>12.4f}{latency:>12.2f}{build_time:>12.2f}")
+
+    exact = ml.TopKIndexBlock(k=args.k, values=tf.constant(items), ids=ids)
+    exact_ids, _ = measure(exact, queries, args.k, args.batch_size)
+    report("exact", exact)
+
+    start = time.perf_counter()
+    int8 = ml.TopKIndexBlock(k=args.k, values=items, ids=ids, quantization="int8")
+    report("exact int8", int8, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    ivf = ml.IVFTopKIndexBlock(k=args.k, values=items, ids=ids, nlist=args.nlist, seed=0)
+    build_time = time.perf_counter() - start
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        report(f"ivf nlist={args.nlist} nprobe={nprobe}", ivf, build_time)
+
+    for opq in [False, True]:
+        start = time.perf_counter()
+        pq = ml.PQTopKIndexBlock(
+            k=args.k,
+            values=items,
+            ids=ids,
+            num_subvectors=args.pq_subvectors,
+            opq=opq,
+            rerank=10 * args.k,
+            seed=0,
+        )
+        build_time = time.perf_counter() - start
+        name = f"{'opq' if opq else 'pq'} m={args.pq_subvectors}"
+        for rerank in [None, 10 * args.k]:
+            pq.rerank = rerank
+            report(f"{name} rerank={rerank}", pq, build_time)
+        memory = pq.memory_usage()
+        print(
+            f"  {name}: codes {memory['codes'] / 2 ** 20:.1f} MiB, "
+            f"float32 embeddings {memory['float32_values'] / 2 ** 20:.1f} MiB "
+            f"({memory['compression_ratio']:.0f}x)"
+        )
+
+    for num_shards in args.num_shards:
+        start = time.perf_counter()
+        sharded = ml.ShardedTopKIndexBlock(
+            k=args.k, values=tf.constant(items), ids=ids, num_shards=num_shards
+        )
+        report(f"sharded shards={num_shards}", sharded, time.perf_counter() - start)
+
+    # graph indices are meant for online requests of a single query
+    print(f"\nbatch size 1, {args.num_single_queries} queries")
+    report("exact", exact, batch_size=1, num_queries=args.num_single_queries)
+    start = time.perf_counter()
+    hnsw = ml.HNSWTopKIndexBlock(k=args.k, values=items, ids=ids, M=args.hnsw_m, seed=0)
+    build_time = time.perf_counter() - start
+    for ef_search in args.ef_search:
+        hnsw.ef_search = ef_search
+        report(
+            f"hnsw M={args.hnsw_m} ef={ef_search}",
+            hnsw,
+            build_time,
+            batch_size=1,
+            num_queries=args.num_single_queries,
+        )
+    for num_shards in args.num_shards:
+        sharded = ml.ShardedTopKIndexBlock(
+            k=args.k, values=tf.constant(items), ids=ids, num_shards=num_shards
+        )
+        report(
+            f"sharded shards={num_shards}",
+            sharded,
+            batch_size=1,
+            num_queries=args.num_single_queries,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-items", type=int, default=200_000)
+    parser.add_argument("--num-queries", type=int, default=2048)
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--nlist", type=int, default=512)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--pq-subvectors", type=int, default=16)
+    parser.add_argument("--num-single-queries", type=int, default=200)
+    parser.add_argument("--hnsw-m", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[20, 64, 128])
+    parser.add_argument("--num-shards", type=int, nargs="+", default=[2, 4, 8])
+
+    with tf.device("/CPU:0"):
+        main(parser.parse_args())
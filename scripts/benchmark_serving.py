@@ -0,0 +1,90 @@
+"""QPS and tail-latency benchmark of top-k serving, with and without micro-batching.
+
+Closed-loop clients send single-user requests concurrently to a query tower followed by a
+top-k index, either one request at a time (unbatched) or through a `MicroBatcher`.
+
+Example usage::
+    python scripts/benchmark_serving.py --num-items 1000000 --clients 64 --max-batch-size 64
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import merlin.models.tf as ml
+from merlin.models.tf.utils.serving_utils import MicroBatcher
+
+
+def build_recommender(num_items, num_features, dim, k, seed=0):
+    """A random query tower connected to an exact top-k index."""
+    tf.keras.utils.set_random_seed(seed)
+    tower = tf.keras.Sequential(
+        [tf.keras.layers.Dense(256, activation="relu"), tf.keras.layers.Dense(dim)]
+    )
+    items = np.random.RandomState(seed).normal(size=(num_items, dim)).astype(np.float32)
+    index = ml.TopKIndexBlock(k=k, values=tf.constant(items), ids=tf.range(num_items))
+
+    @tf.function(reduce_retracing=True)
+    def recommend(features):
+        return index(tower(features["query"]), k=k)
+
+    recommend({"query": tf.zeros((1, num_features))})
+    return recommend
+
+
+async def load(predict, queries, num_clients, duration):
+    """Runs `num_clients` closed-loop clients for `duration` seconds, returns the request
+    latencies (ms) and the QPS."""
+    latencies = []
+    stop = time.perf_counter() + duration
+
+    async def client(seed):
+        rng = np.random.RandomState(seed)
+        while time.perf_counter() < stop:
+            features = {"query": queries[rng.randint(len(queries))][None]}
+            start = time.perf_counter()
+            await predict(features)
+            latencies.append(1000 * (time.perf_counter() - start))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(seed) for seed in range(num_clients)])
+    return np.array(latencies), len(latencies) / (time.perf_counter() - start)
+
+
+async def main(args):
+    recommend = build_recommender(args.num_items, args.num_features, args.dim, args.k)
+    queries = np.random.RandomState(1).normal(size=(4096, args.num_features)).astype(np.float32)
+
+    print(
+        f"{'mode':<28}{'clients':>8}{'QPS':>10}{'p50 ms':>10}{'p95 ms':>10}"
+        f"{'p99 ms':>10}{'batch':>8}"
+    )
+    for num_clients in args.clients:
+        for name, max_batch_size in [("unbatched", 1), ("micro-batched", args.max_batch_size)]:
+            async with MicroBatcher(
+                recommend, max_batch_size=max_batch_size, max_latency_ms=args.max_latency_ms
+            ) as batcher:
+                await load(batcher.predict, queries, num_clients, duration=0.5)  # warm-up
+                batcher.stats = type(batcher.stats)()
+                latencies, qps = await load(batcher.predict, queries, num_clients, args.duration)
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            print(
+                f"{name:<28}{num_clients:>8}{qps:>10.0f}{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}"
+                f"{batcher.stats.mean_batch_size:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-items", type=int, default=200_000)
+    parser.add_argument("--num-features", type=int, default=64)
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-latency-ms", type=float, default=2.0)
+    parser.add_argument("--duration", type=float, default=5.0)
+
+    asyncio.run(main(parser.parse_args()))
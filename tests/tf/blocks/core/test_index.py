@@ -14,7 +14,9 @@
 # limitations under the License.
 #
 
+import numpy as np
 import pytest
+import tensorflow as tf
 
 import merlin.models.tf as ml
 from merlin.io.dataset import Dataset
@@ -57,3 +59,474 @@ def test_topk_index_duplicate_indices(ecommerce_data: SyntheticData):
     with pytest.raises(ValueError) as excinfo:
         _ = model.to_top_k_recommender(item_dataset, k=20)
     assert "Please make sure that `data` contains unique indices" in str(excinfo.value)
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_topk_index_from_block(ecommerce_data: SyntheticData, tmpdir, mmap):
+    model: ml.RetrievalModel = ml.TwoTowerModel(
+        ecommerce_data.schema, query_tower=ml.MLPBlock([64, 128])
+    )
+    item_block = model.retrieval_block.item_block()
+    item_features = ecommerce_data.schema.select_by_tag(Tags.ITEM).column_names
+    item_id = ecommerce_data.schema.select_by_tag(Tags.ITEM_ID).first.name
+    items = ecommerce_data.dataframe[item_features].drop_duplicates(subset=[item_id])
+    item_dataset = Dataset(items, npartitions=3)
+
+    mmap_path = str(tmpdir.join("embeddings")) if mmap else None
+    index = ml.TopKIndexBlock.from_block(
+        item_block, item_dataset, k=10, num_workers=2, mmap_path=mmap_path
+    )
+    assert isinstance(index.values, np.memmap) == mmap
+    # the partitions are written at their offsets, in the order of the dataset
+    np.testing.assert_array_equal(np.asarray(index.ids), items[item_id].to_numpy())
+    embeddings = np.asarray(index.values)
+    assert embeddings.shape[0] == len(items)
+
+    _, top_indices = index(tf.constant(embeddings[:4]))
+    assert top_indices.shape == (4, 10)
+    assert set(top_indices.numpy().reshape(-1)) <= set(items[item_id].tolist())
+
+
+@pytest.mark.parametrize("block_size", [7, 64, 1000])
+def test_topk_index_blocked_scan(block_size):
+    values = tf.random.normal((500, 16))
+    ids = tf.range(1000, 1500)
+    queries = tf.random.normal((32, 16))
+
+    full = ml.TopKIndexBlock(k=10, values=values, ids=ids)
+    blocked = ml.TopKIndexBlock(k=10, values=values, ids=ids, block_size=block_size)
+
+    scores, indices = full(queries)
+    blocked_scores, blocked_indices = blocked(queries)
+    np.testing.assert_allclose(blocked_scores.numpy(), scores.numpy(), rtol=1e-5)
+    np.testing.assert_array_equal(blocked_indices.numpy(), indices.numpy())
+
+    _, blocked_indices = tf.function(lambda x: blocked(x, k=5))(queries)
+    np.testing.assert_array_equal(blocked_indices.numpy(), indices.numpy()[:, :5])
+
+
+def test_ivf_topk_index():
+    centers = tf.random.normal((20, 16), stddev=3.0)
+    values = tf.gather(centers, tf.random.uniform((2000,), maxval=20, dtype=tf.int32))
+    values += tf.random.normal((2000, 16))
+    ids = tf.range(2000) + 100
+    queries = tf.random.normal((32, 16))
+
+    _, exact_indices = ml.TopKIndexBlock(k=10, values=values, ids=ids)(queries)
+
+    # scanning all the lists is an exact search
+    index = ml.IVFTopKIndexBlock(k=10, values=values, ids=ids, nlist=20, nprobe=20, seed=0)
+    _, indices = index(queries)
+    np.testing.assert_array_equal(np.sort(indices, axis=1), np.sort(exact_indices, axis=1))
+
+    index = ml.IVFTopKIndexBlock(k=10, values=values, ids=ids, nlist=20, nprobe=4, seed=0)
+    scores, indices = index(queries, k=5)
+    assert scores.shape == (32, 5)
+    recall = np.mean(
+        [len(set(a) & set(b)) / 5 for a, b in zip(indices.numpy(), exact_indices.numpy())]
+    )
+    assert recall > 0.5
+
+
+def test_ivf_topk_index_int8():
+    values = tf.random.normal((1000, 16))
+    ids = tf.range(1000) + 100
+    queries = tf.random.normal((32, 16))
+    exact = ml.TopKIndexBlock(k=10, values=values, ids=ids, quantization="int8")
+
+    # probing all the lists scores the same int8 candidates as the exact index
+    index = ml.IVFTopKIndexBlock(
+        k=10, values=values, ids=ids, nlist=20, nprobe=20, seed=0, quantization="int8"
+    )
+    assert index.values.dtype == tf.int8
+    scores, indices = index(queries)
+    exact_scores, exact_indices = exact(queries)
+    np.testing.assert_allclose(scores, exact_scores, rtol=1e-4, atol=1e-4)
+    np.testing.assert_array_equal(np.sort(indices, axis=1), np.sort(exact_indices, axis=1))
+
+
+@pytest.mark.parametrize("opq", [False, True])
+def test_pq_topk_index(opq):
+    values = tf.random.normal((1000, 16))
+    ids = tf.range(1000) + 100
+    queries = tf.random.normal((32, 16))
+    _, exact_indices = ml.TopKIndexBlock(k=10, values=values, ids=ids)(queries)
+
+    index = ml.PQTopKIndexBlock(
+        k=10, values=values, ids=ids, num_subvectors=4, num_centroids=16, opq=opq, seed=0
+    )
+    scores, indices = index(queries)
+    assert scores.shape == indices.shape == (32, 10)
+    assert set(np.unique(indices)) <= set(ids.numpy())
+
+    usage = index.memory_usage()
+    assert usage["codes"] == 1000 * 4
+    assert usage["compression_ratio"] == 16
+
+    # re-ranking all the candidates with exact scores is an exact search
+    index = ml.PQTopKIndexBlock(
+        k=10, values=values, ids=ids, num_subvectors=4, num_centroids=16, rerank=1000, seed=0
+    )
+    _, indices = index(queries)
+    np.testing.assert_array_equal(indices.numpy(), exact_indices.numpy())
+
+
+def test_hnsw_topk_index(tmpdir):
+    values = tf.random.normal((500, 16))
+    ids = tf.range(500) + 100
+    queries = tf.random.normal((8, 16))
+    _, exact_indices = ml.TopKIndexBlock(k=10, values=values, ids=ids)(queries)
+
+    index = ml.HNSWTopKIndexBlock(k=10, values=values[:300], ids=ids[:300], M=8, seed=0)
+    index.add(values[300:], ids[300:])
+    assert len(index) == 500
+
+    # a large `ef_search` makes the search exhaustive on a small index
+    index.ef_search = 500
+    scores, indices = index(queries)
+    assert scores.shape == indices.shape == (8, 10)
+    np.testing.assert_array_equal(indices.numpy(), exact_indices.numpy())
+
+    path = str(tmpdir.join("index"))
+    index.save(path)
+    loaded = ml.HNSWTopKIndexBlock.load(path)
+    np.testing.assert_array_equal(loaded(queries, k=5)[1].numpy(), indices.numpy()[:, :5])
+
+
+def test_hnsw_topk_index_batched_insertions():
+    values = tf.random.normal((600, 16))
+    queries = tf.random.normal((8, 16))
+    _, exact_indices = ml.TopKIndexBlock(k=10, values=values, ids=tf.range(600))(queries)
+
+    # small batches make the insertions search the graph built so far
+    index = ml.HNSWTopKIndexBlock(k=10, values=None, M=8, ef_construction=32, seed=0)
+    index._insert_batch_size = 50
+    index.add(values)
+    assert len(index) == 600
+    for neighbors in index._neighbors:
+        for links in neighbors[: len(index)]:
+            links = links[links >= 0]
+            assert len(set(links.tolist())) == len(links)
+
+    index.ef_search = 600
+    np.testing.assert_array_equal(index(queries)[1].numpy(), exact_indices.numpy())
+
+
+def test_topk_recommender_with_hnsw_index(ecommerce_data: SyntheticData):
+    model: ml.RetrievalModel = ml.TwoTowerModel(
+        ecommerce_data.schema, query_tower=ml.MLPBlock([64, 128])
+    )
+    model.compile(run_eagerly=True, optimizer="adam")
+    dataset = ecommerce_data.tf_dataloader(batch_size=50)
+    model.fit(dataset, epochs=1)
+
+    item_features = ecommerce_data.schema.select_by_tag(Tags.ITEM).column_names
+    item_dataset = Dataset(ecommerce_data.dataframe[item_features].drop_duplicates())
+
+    recommender = model.to_top_k_recommender(
+        item_dataset, k=20, index_cls=ml.HNSWTopKIndexBlock, M=8, ef_search=32
+    )
+    assert isinstance(recommender.block.layers[-1], ml.HNSWTopKIndexBlock)
+
+    batch = next(iter(dataset))[0]
+    _, top_indices = recommender(batch)
+    assert top_indices.shape[-1] == 20
+
+
+def test_topk_index_int8_quantization():
+    centers = tf.random.normal((50, 32), stddev=2.0)
+    values = tf.gather(centers, tf.random.uniform((20000,), maxval=50, dtype=tf.int32))
+    values += tf.random.normal((20000, 32))
+    ids = tf.range(20000)
+    queries = tf.random.normal((64, 32))
+
+    exact = ml.TopKIndexBlock(k=10, values=values, ids=ids)
+    quantized = ml.TopKIndexBlock(
+        k=10, values=values, ids=ids, quantization="int8", block_size=4096
+    )
+    assert quantized.values.dtype == tf.int8
+    assert quantized.values.shape == values.shape
+
+    # the latency trade-off is measured by scripts/benchmark_index.py
+    exact_scores, exact_indices = [t.numpy() for t in tf.function(exact)(queries)]
+    scores, indices = [t.numpy() for t in tf.function(quantized)(queries)]
+    recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(indices, exact_indices)])
+
+    assert recall > 0.9
+    np.testing.assert_allclose(scores[:, 0], exact_scores[:, 0], rtol=0.05, atol=0.5)
+
+    with pytest.raises(ValueError):
+        ml.TopKIndexBlock(k=10, values=values, quantization="int4")
+
+
+@pytest.mark.parametrize("block_size", [None, 64])
+def test_topk_index_upsert_delete(block_size):
+    values = tf.random.normal((500, 16))
+    ids = tf.range(500) + 100
+    queries = tf.random.normal((8, 16))
+    index = ml.TopKIndexBlock(k=10, values=values, ids=ids, block_size=block_size)
+
+    assert index.delete(ids[:200]) == 200
+    assert index.delete([100, 1]) == 0
+    new_values = tf.random.normal((50, 16))
+    new_ids = tf.range(1000, 1050)
+    index.upsert(new_ids, new_values)
+    index.upsert(ids[300:310], tf.zeros((10, 16)))
+
+    expected_values = tf.concat([values[200:300], tf.zeros((10, 16)), values[310:], new_values], 0)
+    expected_ids = tf.concat([ids[200:], new_ids], 0)
+    _, expected = ml.TopKIndexBlock(k=10, values=expected_values, ids=expected_ids)(queries)
+
+    _, indices = index(queries)
+    np.testing.assert_array_equal(np.sort(indices, axis=1), np.sort(expected, axis=1))
+
+    index.compact()
+    assert int(tf.shape(index.values)[0]) == 350
+    _, indices = tf.function(lambda x: index(x))(queries)
+    np.testing.assert_array_equal(np.sort(indices, axis=1), np.sort(expected, axis=1))
+
+    with pytest.raises(NotImplementedError):
+        ml.IVFTopKIndexBlock(k=10, values=values, nlist=4).delete([0])
+
+
+@pytest.mark.parametrize("quantization", [None, "int8"])
+def test_topk_index_update_traced_search(quantization):
+    values = tf.random.normal((100, 16))
+    queries = tf.random.normal((4, 16))
+    index = ml.TopKIndexBlock(k=5, values=values, ids=tf.range(100), quantization=quantization)
+    search = tf.function(lambda x, e: index(x, exclude=e))
+    exclude = tf.constant([[1000], [1001], [-1], [-1]])
+    search(queries, exclude)
+
+    def expected(values, ids):
+        exact = ml.TopKIndexBlock(k=6, values=values, ids=ids, quantization=quantization)
+        _, top_indices = exact(queries)
+        rows = zip(top_indices.numpy(), exclude.numpy()[:, 0])
+        return np.array([[i for i in row if i != excluded][:5] for row, excluded in rows])
+
+    # the traced search retrieves the candidates of the rebuilt index
+    new_values, new_ids = tf.random.normal((300, 16)), tf.range(1000, 1300)
+    index.update(new_values, new_ids)
+    _, indices = search(queries, exclude)
+    np.testing.assert_array_equal(indices.numpy(), expected(new_values, new_ids))
+
+    # the deleted candidates are indexed again by the next update
+    index.delete(new_ids[:150])
+    index.update(new_values, new_ids)
+    _, indices = search(queries, exclude)
+    np.testing.assert_array_equal(indices.numpy(), expected(new_values, new_ids))
+
+
+@pytest.mark.parametrize(
+    "index_cls, kwargs",
+    [
+        (ml.TopKIndexBlock, {}),
+        (ml.TopKIndexBlock, dict(quantization="int8", block_size=128)),
+        (ml.IVFTopKIndexBlock, dict(nlist=8, nprobe=2, seed=0)),
+        (ml.IVFTopKIndexBlock, dict(nlist=8, nprobe=2, seed=0, quantization="int8")),
+        (ml.PQTopKIndexBlock, dict(num_subvectors=4, num_centroids=16, rerank=50, seed=0)),
+    ],
+)
+@pytest.mark.parametrize("mmap", [True, False])
+def test_index_save_load(tmpdir, index_cls, kwargs, mmap):
+    values = tf.random.normal((500, 16))
+    ids = tf.range(500) + 100
+    queries = tf.random.normal((8, 16))
+    index = index_cls(k=10, values=values, ids=ids, **kwargs)
+    scores, indices = index(queries)
+
+    path = str(tmpdir.join("index"))
+    index.save(path)
+    loaded = ml.IndexBlock.load(path, mmap=mmap)
+    assert type(loaded) is index_cls
+    assert isinstance(loaded.ids, np.memmap) == mmap
+
+    loaded_scores, loaded_indices = tf.function(lambda x: loaded(x))(queries)
+    np.testing.assert_array_equal(loaded_indices.numpy(), indices.numpy())
+    np.testing.assert_allclose(loaded_scores.numpy(), scores.numpy(), rtol=1e-5)
+    assert ml.IndexBlock.load(path, k=5)(queries)[1].shape == (8, 5)
+
+    with pytest.raises(ValueError):
+        ml.HNSWTopKIndexBlock.load(path)
+
+
+@pytest.mark.parametrize("block_size", [None, 64])
+@pytest.mark.parametrize("bitsets", [False, True])
+def test_topk_index_exclude(block_size, bitsets):
+    values = tf.random.normal((500, 16))
+    ids = tf.range(500)
+    queries = tf.random.normal((4, 16))
+    index = ml.TopKIndexBlock(k=10, values=values, ids=ids, block_size=block_size)
+
+    _, top_indices = index(queries, k=30)
+    seen = [top_indices[i, : 5 * (i + 1)].numpy().tolist() for i in range(4)]
+    exclude = tf.ragged.constant(seen)
+    if bitsets:
+        exclude = np.zeros((4, 64), dtype=np.uint8)
+        for i, items in enumerate(seen):
+            for item in items:
+                exclude[i, item // 8] |= 1 << (item % 8)
+        exclude = tf.constant(exclude)
+
+    _, indices = tf.function(lambda x, e: index(x, exclude=e))(queries, exclude)
+    for i, items in enumerate(seen):
+        assert not set(indices[i].numpy()) & set(items)
+        # the top-k is made of the next best candidates
+        assert set(indices[i].numpy()) == set(top_indices[i, len(items) : len(items) + 10].numpy())
+
+
+def test_topk_index_availability():
+    values = tf.random.normal((500, 16))
+    ids = tf.range(500) + 100
+    queries = tf.random.normal((4, 16))
+    index = ml.TopKIndexBlock(k=10, values=values, ids=ids)
+
+    index.set_availability(allow=ids[:300], deny=ids[:100])
+    _, indices = index(queries, exclude=tf.ragged.constant([[250], [], [260, 270], []]))
+    assert np.all((indices >= 200) & (indices < 400))
+    assert 250 not in indices[0].numpy()
+
+    # denied candidates stay unavailable when they are upserted
+    index.upsert(ids[:10], values[:10])
+    _, indices = index(queries, k=200)
+    assert np.all((indices >= 200) & (indices < 400))
+
+    index.set_availability()
+    _, indices = index(queries, k=500)
+    assert set(indices[0].numpy()) == set(ids.numpy())
+
+
+@pytest.mark.parametrize(
+    "index_cls,kwargs",
+    [
+        (ml.IVFTopKIndexBlock, dict(nlist=4, nprobe=4, seed=0)),
+        (ml.PQTopKIndexBlock, dict(num_subvectors=4, num_centroids=16, rerank=20, seed=0)),
+        (ml.HNSWTopKIndexBlock, dict(M=8, seed=0)),
+        (ml.ShardedTopKIndexBlock, dict(num_shards=2, processes=True)),
+    ],
+)
+def test_approximate_index_availability(tmpdir, index_cls, kwargs):
+    values = tf.random.normal((500, 16))
+    ids = tf.range(500) + 100
+    queries = tf.random.normal((4, 16))
+    index = index_cls(k=10, values=values, ids=ids, **kwargs)
+
+    # the availability is kept when the index is rebuilt
+    index.set_availability(allow=ids[:300], deny=ids[:100])
+    index.update(values, ids)
+    scores, indices = index(queries)
+    assert np.all((indices >= 200) & (indices < 400))
+    assert np.all(np.isfinite(scores.numpy()))
+
+    index.set_availability(allow=ids[:300], deny=ids[:150])
+    _, indices = index(queries)
+    assert np.all((indices >= 250) & (indices < 400))
+
+    path = str(tmpdir.join("index"))
+    index.save(path)
+    loaded = ml.IndexBlock.load(path)
+    _, indices = loaded(queries)
+    assert np.all((indices >= 250) & (indices < 400))
+
+    index.set_availability()
+    _, indices = index(queries, k=50)
+    assert np.any(indices < 200)
+    for block in [index, loaded]:
+        if isinstance(block, ml.ShardedTopKIndexBlock):
+            block.close()
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_sharded_topk_index(tmpdir, processes):
+    values = tf.random.normal((500, 16))
+    ids = tf.range(500) + 100
+    queries = tf.random.normal((8, 16))
+    exact = ml.TopKIndexBlock(k=10, values=values, ids=ids)
+    exact_scores, exact_indices = exact(queries)
+
+    index = ml.ShardedTopKIndexBlock(
+        k=10, values=values, ids=ids, num_shards=4, processes=processes
+    )
+    assert list(index.shard_sizes.values()) == [125] * 4
+    for search in [index, tf.function(lambda x: index(x))]:
+        scores, indices = search(queries)
+        np.testing.assert_array_equal(indices.numpy(), exact_indices.numpy())
+        np.testing.assert_allclose(scores.numpy(), exact_scores.numpy(), rtol=1e-5)
+
+    seen = tf.ragged.constant([exact_indices[i, : i + 1].numpy().tolist() for i in range(8)])
+    _, indices = index(queries, exclude=seen)
+    np.testing.assert_array_equal(indices.numpy(), exact(queries, exclude=seen)[1].numpy())
+    index.close()
+
+    path = str(tmpdir.join("index"))
+    index.save(path)
+    loaded = ml.IndexBlock.load(path)
+    assert type(loaded) is ml.ShardedTopKIndexBlock
+    np.testing.assert_array_equal(loaded(queries)[1].numpy(), exact_indices.numpy())
+
+
+def test_sharded_topk_index_search_kwargs():
+    values = tf.random.normal((500, 16))
+    ids = tf.range(500)
+    queries = tf.random.normal((8, 16))
+    index = ml.ShardedTopKIndexBlock(
+        k=10, values=values, ids=ids, num_shards=2, block_size=64, quantization="int8"
+    )
+    assert index.shard_kwargs == dict(block_size=64, quantization="int8")
+    for shard in index.shards.values():
+        assert shard.block_size == 64 and shard.quantization == "int8"
+    # the shards are quantized separately, the top-k is close to the exact one
+    _, exact_indices = ml.TopKIndexBlock(k=10, values=values, ids=ids)(queries)
+    _, indices = index(queries)
+    recall = np.mean(
+        [len(set(a) & set(b)) / 10 for a, b in zip(indices.numpy(), exact_indices.numpy())]
+    )
+    assert recall > 0.9
+
+    with pytest.raises(ValueError, match="Conflicting values of block_size"):
+        ml.ShardedTopKIndexBlock(
+            k=10, values=values, ids=ids, block_size=64, shard_kwargs=dict(block_size=128)
+        )
+
+
+@pytest.mark.parametrize("shard_ids", [None, []])
+def test_sharded_topk_index_without_candidates(shard_ids):
+    values = tf.zeros((0, 16))
+    ids = tf.zeros((0,), dtype=tf.int64)
+    index = ml.ShardedTopKIndexBlock(k=5, values=values, ids=ids, shard_ids=shard_ids)
+    assert sum(index.shard_sizes.values()) == 0
+
+    scores, indices = index(tf.random.normal((4, 16)))
+    np.testing.assert_array_equal(scores.numpy(), np.full((4, 5), -np.inf))
+    np.testing.assert_array_equal(indices.numpy(), np.full((4, 5), -1))
+
+
+def test_sharded_topk_index_by_category():
+    values = tf.random.normal((500, 16))
+    ids = tf.range(500)
+    categories = np.array(["a", "b", "c"])[ids.numpy() % 3]
+    queries = tf.random.normal((8, 16))
+    index = ml.ShardedTopKIndexBlock(
+        k=10,
+        values=values,
+        ids=ids,
+        shard_ids=categories,
+        shard_cls=ml.IVFTopKIndexBlock,
+        shard_kwargs=dict(nlist=4, nprobe=4, seed=0),
+    )
+    assert list(index.shards) == ["a", "b", "c"]
+
+    _, indices = index(queries, shards=["b"])
+    rows = np.flatnonzero(categories == "b")
+    _, exact_indices = ml.TopKIndexBlock(
+        k=10, values=tf.gather(values, rows), ids=tf.gather(ids, rows)
+    )(queries)
+    np.testing.assert_array_equal(indices.numpy(), exact_indices.numpy())
+
+    # the top-k of small shards is padded
+    scores, indices = index(queries, k=200, shards=["a"])
+    assert np.all(indices.numpy()[:, 167:] == -1)
+    assert np.all(np.isinf(scores.numpy()[:, 167:]))
+
+    with pytest.raises(ValueError):
+        index(queries, shards=["d"])
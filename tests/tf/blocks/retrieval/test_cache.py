@@ -0,0 +1,96 @@
+#
+# Copyright (c) 2021, NVIDIA CORPORATION.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+import merlin.models.tf as ml
+from merlin.io.dataset import Dataset
+from merlin.models.data.synthetic import SyntheticData
+from merlin.schema import Tags
+
+
+def test_query_embedding_cache_lru_ttl():
+    now = [0.0]
+    cache = ml.QueryEmbeddingCache(max_size=3, ttl=10, clock=lambda: now[0])
+    cache.insert(np.array([1, 2, 3]), np.eye(3, dtype=np.float32))
+
+    hits, values, misses = cache.lookup(np.array([1, 4]))
+    np.testing.assert_array_equal(hits, [0])
+    np.testing.assert_array_equal(values, [[1.0, 0.0, 0.0]])
+    np.testing.assert_array_equal(misses, [1])
+
+    # 2 is the least recently used key
+    cache.insert(np.array([4]), np.ones((1, 3), dtype=np.float32))
+    assert len(cache) == 3
+    np.testing.assert_array_equal(cache.lookup(np.array([2]))[2], [0])
+
+    now[0] = 10.0
+    np.testing.assert_array_equal(cache.lookup(np.array([1, 3, 4]))[2], [0, 1, 2])
+    assert len(cache) == 0
+    assert cache.stats.evictions == 1
+    assert cache.stats.expirations == 3
+    assert cache.stats.hit_rate == pytest.approx(1 / 6)
+
+
+@pytest.mark.parametrize("run_eagerly", [True, False])
+def test_cached_query_block(ecommerce_data: SyntheticData, run_eagerly):
+    model: ml.RetrievalModel = ml.TwoTowerModel(
+        ecommerce_data.schema, query_tower=ml.MLPBlock([64, 128])
+    )
+    model.compile(run_eagerly=True, optimizer="adam")
+    dataset = ecommerce_data.tf_dataloader(batch_size=50)
+    model.fit(dataset, epochs=1)
+
+    query_block = model.retrieval_block.query_block()
+    cached = ml.CachedQueryBlock(query_block, ml.QueryEmbeddingCache(max_size=1000))
+    assert cached.id_column == ecommerce_data.schema.select_by_tag(Tags.USER_ID).first.name
+    call = cached if run_eagerly else tf.function(cached)
+
+    batch = next(iter(dataset))[0]
+    expected = query_block(batch).numpy()
+    np.testing.assert_allclose(call(batch).numpy(), expected, rtol=1e-5)
+    np.testing.assert_allclose(call(batch).numpy(), expected, rtol=1e-5)
+
+    num_users = len(np.unique(batch[cached.id_column].numpy()))
+    assert len(cached.cache) == num_users
+    assert cached.cache.stats.hits >= 50
+
+
+def test_topk_recommender_with_query_cache(ecommerce_data: SyntheticData):
+    model: ml.RetrievalModel = ml.TwoTowerModel(
+        ecommerce_data.schema, query_tower=ml.MLPBlock([64, 128])
+    )
+    model.compile(run_eagerly=True, optimizer="adam")
+    dataset = ecommerce_data.tf_dataloader(batch_size=50)
+    model.fit(dataset, epochs=1)
+
+    item_features = ecommerce_data.schema.select_by_tag(Tags.ITEM).column_names
+    item_dataset = Dataset(ecommerce_data.dataframe[item_features].drop_duplicates())
+    query_embeddings = model.query_embeddings(ecommerce_data.dataset, batch_size=10)
+
+    cache = ml.QueryEmbeddingCache()
+    recommender = model.to_top_k_recommender(
+        item_dataset, k=20, query_cache=cache, query_embeddings=query_embeddings
+    )
+    assert len(cache) == len(query_embeddings.to_ddf().compute())
+
+    batch = next(iter(dataset))[0]
+    _, top_indices = recommender(batch)
+    assert top_indices.shape[-1] == 20
+    # all the users of the batch are served from the warmed-up cache
+    assert cache.stats.misses == 0
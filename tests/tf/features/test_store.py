@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+import tensorflow as tf
+
+import merlin.models.tf as ml
+from merlin.models.data.synthetic import SyntheticData
+
+
+@pytest.mark.parametrize("sparse_ids", [False, True])
+def test_item_feature_store(tmpdir, sparse_ids):
+    rng = np.random.RandomState(0)
+    ids = rng.permutation(100)[:80]
+    if sparse_ids:
+        ids = ids * 1_000_003
+    df = pd.DataFrame(
+        {
+            "item_id": ids,
+            "category": rng.randint(10, size=80),
+            "price": rng.rand(80).astype(np.float32),
+            "tags": [list(rng.randint(5, size=rng.randint(4))) for _ in range(80)],
+        }
+    )
+    store = ml.ItemFeatureStore.from_dataframe(df, "item_id")
+    assert (store.ids is not None) == sparse_ids
+
+    query = np.array([ids[3], ids[0], ids[3], -1])
+    path = str(tmpdir.join("store"))
+    store.save(path)
+    for lookup in [store, tf.function(store), ml.ItemFeatureStore.load(path)]:
+        features = lookup(tf.constant(query))
+        assert features["price"].shape == (4, 1)
+        for row, item_id in enumerate(query[:3]):
+            expected = df[df["item_id"] == item_id].iloc[0]
+            assert features["category"][row, 0] == expected["category"]
+            assert features["price"][row, 0] == expected["price"]
+            assert features["tags"][row].numpy().tolist() == expected["tags"]
+        # unknown ids get empty features
+        assert features["price"][3, 0] == 0
+        assert features["tags"][3].shape[0] == 0
+
+
+def test_item_feature_store_from_dataset(ecommerce_data: SyntheticData):
+    store = ml.ItemFeatureStore.from_dataset(ecommerce_data.dataset)
+    item_ids = ecommerce_data.dataframe[store.id_column].unique()
+
+    features = store(tf.constant(item_ids))
+    np.testing.assert_array_equal(features[store.id_column].numpy()[:, 0], item_ids)
+    assert set(features) == set(store.column_names)
@@ -248,3 +248,62 @@ def test_update_by_indices():
     queue.update_by_indices(indices=tf.constant([[1], [2]]), values=tf.constant([20, 21]))
     values = queue.list_all()
     tf.assert_equal(values, [10, 20, 21, 7, 6, 5, 4, 3, 2, 1])
+
+
+def test_indexof_follows_queue_updates():
+    queue = ml.FIFOQueue(
+        capacity=10,
+        dims=[],
+        dtype=tf.int64,
+    )
+
+    queue.enqueue_many(tf.range(8, dtype=tf.int64))
+    queue.dequeue_many(3)
+    tf.assert_equal(tf.cast(queue.index_of([0, 2, 3, 7]), tf.int32), [-1, -1, 3, 7])
+
+    # wrapping around the storage overwrites the oldest items
+    queue.enqueue_many(tf.range(100, 107, dtype=tf.int64))
+    indices = queue.index_of([3, 4, 5, 100, 104, 106])
+    tf.assert_equal(tf.cast(indices, tf.int32), [-1, -1, 5, 8, 2, 4])
+
+    queue.enqueue(tf.constant(5, dtype=tf.int64))
+    tf.assert_equal(tf.cast(queue.index_of([5, 6]), tf.int32), [5, 6])
+
+    queue.update_by_indices(indices=tf.constant([[5]]), values=tf.constant([200], tf.int64))
+    tf.assert_equal(tf.cast(queue.index_of([5, 200]), tf.int32), [-1, 5])
+
+    queue.clear()
+    tf.assert_equal(tf.cast(queue.index_of([200, 7]), tf.int32), [-1, -1])
+
+
+def test_indexof_repoints_overwritten_duplicates():
+    queue = ml.FIFOQueue(
+        capacity=10,
+        dims=[],
+        dtype=tf.int64,
+    )
+
+    queue.enqueue_many(tf.constant([1, 2, 1, 3, 1], tf.int64))
+    tf.assert_equal(tf.cast(queue.index_of([1]), tf.int32), [4])
+
+    # the last occurrence is overwritten, the id is found in its previous one
+    queue.update_by_indices(indices=tf.constant([[4]]), values=tf.constant([5], tf.int64))
+    tf.assert_equal(tf.cast(queue.index_of([1, 5]), tf.int32), [2, 4])
+
+    queue.update_by_indices(
+        indices=tf.constant([[2], [0]]), values=tf.constant([6, 7], tf.int64)
+    )
+    tf.assert_equal(tf.cast(queue.index_of([1, 6, 7]), tf.int32), [-1, 2, 0])
+
+
+def test_indexof_initialize_tensor():
+    queue = ml.FIFOQueue(
+        capacity=5,
+        dims=[],
+        dtype=tf.int32,
+        initialize_tensor=tf.constant([10, 11, 12, 13, 14]),
+    )
+    tf.assert_equal(tf.cast(queue.index_of([12, 14, 15]), tf.int32), [2, 4, -1])
+
+    queue.enqueue(tf.constant(15))
+    tf.assert_equal(tf.cast(queue.index_of([10, 12, 15]), tf.int32), [-1, 2, 0])
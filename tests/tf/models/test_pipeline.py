@@ -0,0 +1,41 @@
+import numpy as np
+
+import merlin.models.tf as ml
+from merlin.io.dataset import Dataset
+from merlin.models.data.synthetic import SyntheticData
+from merlin.schema import Tags
+
+
+def test_retrieve_and_rank_pipeline(ecommerce_data: SyntheticData):
+    schema = ecommerce_data.schema
+    retrieval_model = ml.TwoTowerModel(schema, query_tower=ml.MLPBlock([64]))
+    retrieval_model.compile(run_eagerly=True, optimizer="adam")
+    retrieval_model.fit(ecommerce_data.dataset, batch_size=50, epochs=1)
+
+    ranker = ml.DLRMModel(
+        schema,
+        embedding_dim=64,
+        bottom_block=ml.MLPBlock([64]),
+        prediction_tasks=ml.BinaryClassificationTask("click"),
+    )
+    ranker.compile(run_eagerly=True, optimizer="adam")
+    ranker.fit(ecommerce_data.dataset, batch_size=50, epochs=1)
+
+    item_features = ml.ItemFeatureStore.from_dataset(ecommerce_data.dataset)
+    item_columns = schema.select_by_tag(Tags.ITEM).column_names
+    items = ecommerce_data.dataframe[item_columns].drop_duplicates(subset=[item_features.id_column])
+
+    retrieval = retrieval_model.to_top_k_recommender(Dataset(items), k=20)
+    pipeline = ml.RetrieveAndRankPipeline(retrieval, ranker, item_features, num_candidates=20)
+
+    batch = next(iter(ecommerce_data.tf_dataloader(batch_size=10)))[0]
+    scores, top_ids = pipeline(batch, k=5)
+    _, candidates = retrieval(batch, k=20)
+
+    assert tuple(top_ids.shape) == (10, 5)
+    assert np.all(np.diff(scores.numpy(), axis=1) <= 0)
+    for ids, row_candidates in zip(top_ids.numpy(), candidates.numpy()):
+        assert set(ids) <= set(row_candidates)
+    assert pipeline.timings.num_batches == 1
+    assert pipeline.timings.num_queries == 10
+    assert pipeline.timings.per_batch_ms()["total"] > 0
@@ -33,6 +33,23 @@ def test_two_tower_model(music_streaming_data: SyntheticData, run_eagerly, num_e
     assert all(measure >= 0 for metric in losses.history for measure in losses.history[metric])
 
 
+@pytest.mark.parametrize("run_eagerly", [True, False])
+def test_two_tower_model_logq_correction(music_streaming_data: SyntheticData, run_eagerly):
+    music_streaming_data._schema = music_streaming_data.schema.remove_by_tag(Tags.TARGET)
+
+    task = mm.ItemRetrievalTask(music_streaming_data.schema, logq_correction=True)
+    model = mm.TwoTowerModel(
+        music_streaming_data.schema,
+        query_tower=mm.MLPBlock([512, 256]),
+        prediction_tasks=task,
+    )
+    model.compile(optimizer="adam", run_eagerly=run_eagerly)
+
+    losses = model.fit(music_streaming_data.dataset, batch_size=50, epochs=1)
+    assert len(losses.epoch) == 1
+    assert int(task.retrieval_scorer.frequency_estimator.step) > 0
+
+
 @pytest.mark.parametrize("run_eagerly", [True, False])
 def test_two_tower_retrieval_model_with_metrics(ecommerce_data: SyntheticData, run_eagerly):
     ecommerce_data._schema = ecommerce_data.schema.remove_by_tag(Tags.TARGET)
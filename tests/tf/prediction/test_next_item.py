@@ -351,3 +351,71 @@ def test_retrieval_task_inbatch_default_sampler(
         tf.assert_equal(tf.shape(output)[0], batch_size)
         # Number of negatives plus one positive
         tf.assert_equal(tf.shape(output)[1], expected_num_samples_inbatch + 1)
+
+
+def test_item_retrieval_scorer_logq_correction():
+    batch_size = 10
+
+    item_ids = tf.range(batch_size) % 3
+    context = ml.BlockContext(feature_names=["item_id"], feature_dtypes={"item_id": tf.int32})
+    _ = context({"item_id": item_ids})
+
+    estimator = ml.ItemFrequencyEstimator(num_buckets=100, alpha=0.5)
+    # item 2 was in one of every 4 previous batches
+    for step in range(20):
+        estimator.update(tf.constant([0, 1, 2]) if step % 4 == 0 else tf.constant([0, 1]))
+
+    item_retrieval_scorer = ml.ItemRetrievalScorer(
+        samplers=[ml.InBatchSampler()],
+        sampling_downscore_false_negatives=False,
+        frequency_estimator=estimator,
+        context=context,
+    )
+
+    users_embeddings = tf.random.uniform(shape=(batch_size, 5), dtype=tf.float32)
+    items_embeddings = tf.random.uniform(shape=(batch_size, 5), dtype=tf.float32)
+
+    output_scores = item_retrieval_scorer.call_outputs(
+        PredictionOutput({"query": users_embeddings, "item": items_embeddings}, {}),
+        training=True,
+    ).predictions
+
+    assert int(estimator.step) == 21
+    logq = tf.math.log(estimator.probabilities(item_ids))
+    tf.debugging.assert_less(logq[2], -0.5)
+    positive_scores = tf.reduce_sum(users_embeddings * items_embeddings, axis=-1)
+    negative_scores = tf.matmul(users_embeddings, items_embeddings, transpose_b=True)
+    tf.debugging.assert_near(output_scores[:, 0], positive_scores - logq)
+    tf.debugging.assert_near(output_scores[:, 1:], negative_scores - tf.expand_dims(logq, 0))
+
+
+def test_item_retrieval_scorer_logq_correction_uniform_sampler():
+    batch_size = 10
+
+    item_ids = tf.range(batch_size) % 3
+    context = ml.BlockContext(feature_names=["item_id"], feature_dtypes={"item_id": tf.int32})
+    _ = context({"item_id": item_ids})
+
+    estimator = ml.ItemFrequencyEstimator(num_buckets=100, alpha=0.5)
+    for step in range(20):
+        estimator.update(tf.constant([0, 1, 2]) if step % 4 == 0 else tf.constant([0, 1]))
+
+    item_retrieval_scorer = ml.ItemRetrievalScorer(
+        samplers=[ml.CachedUniformSampler(capacity=20, ignore_last_batch_on_sample=False)],
+        sampling_downscore_false_negatives=False,
+        frequency_estimator=estimator,
+        context=context,
+    )
+
+    users_embeddings = tf.random.uniform(shape=(batch_size, 5), dtype=tf.float32)
+    items_embeddings = tf.random.uniform(shape=(batch_size, 5), dtype=tf.float32)
+
+    output_scores = item_retrieval_scorer.call_outputs(
+        PredictionOutput({"query": users_embeddings, "item": items_embeddings}, {}),
+        training=True,
+    ).predictions
+
+    # the items of a uniform sampler are not corrected, nor the positive items
+    assert int(estimator.step) == 20
+    positive_scores = tf.reduce_sum(users_embeddings * items_embeddings, axis=-1)
+    tf.debugging.assert_near(output_scores[:, 0], positive_scores)
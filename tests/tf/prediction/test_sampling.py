@@ -374,3 +374,21 @@ def test_cached_uniform_sampler_trying_add_sample_before_built():
         input_data = ml.EmbeddingWithMetadata(embeddings=None, metadata={})
         _ = cached_batches_sampler.sample()
     assert "The CachedUniformSampler layer was not built yet." in str(excinfo.value)
+
+
+def test_item_frequency_estimator():
+    estimator = ml.ItemFrequencyEstimator(num_buckets=1000, num_hash_functions=2, alpha=0.1)
+
+    # item 1 is in every batch, item 2 in one of every 4 batches
+    for step in range(200):
+        item_ids = tf.constant([1, 2] if step % 4 == 0 else [1, 3], dtype=tf.int64)
+        estimator(item_ids, training=True)
+
+    probabilities = estimator(tf.constant([[1], [2], [4]], dtype=tf.int64))
+    assert probabilities.shape == (3, 1)
+    assert int(estimator.step) == 200
+    tf.debugging.assert_near(probabilities[:, 0], [1.0, 0.25, 1.0], atol=0.02)
+
+    estimator.reset()
+    assert int(estimator.step) == 0
+    tf.debugging.assert_near(estimator.probabilities(tf.constant([2])), [1.0])
@@ -13,7 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import math
 import os
+import threading
+import time
 
 import numpy as np
 import pandas as pd
@@ -285,3 +288,345 @@ def test_model_with_sparse_inputs(music_streaming_data: SyntheticData):
     batch = next(iter(train_dataset))[0]
     out = model(batch)
     assert out.shape[-1] == 64
+
+
+@pytest.mark.parametrize("shuffle", [True, False])
+@pytest.mark.parametrize("parts_per_chunk", [1, 2])
+def test_resume_from_state_dict(shuffle, parts_per_chunk):
+    num_rows, batch_size = 103, 10
+    df = pd.DataFrame({"a": np.arange(num_rows), "b": np.zeros(num_rows)})
+
+    def make_loader():
+        return tf_dataloader.BatchedDataset(
+            Dataset(df, npartitions=7),
+            cont_names=["a"],
+            label_names=["b"],
+            batch_size=batch_size,
+            shuffle=shuffle,
+            parts_per_chunk=parts_per_chunk,
+        )
+
+    def remaining_batches(loader):
+        batches = []
+        while True:
+            try:
+                batches.append(next(loader)[0]["a"].numpy().ravel())
+            except StopIteration:
+                return batches
+
+    loader = make_loader()
+    seen = [next(loader)[0]["a"].numpy().ravel() for _ in range(4)]
+    state = loader.state_dict()
+    expected = remaining_batches(loader)
+
+    resumed = make_loader().load_state_dict(state)
+    remaining = remaining_batches(resumed)
+
+    assert len(remaining) == len(expected)
+    for batch, expected_batch in zip(remaining, expected):
+        np.testing.assert_array_equal(batch, expected_batch)
+    all_rows = np.sort(np.concatenate(seen + remaining))
+    np.testing.assert_array_equal(all_rows, np.arange(num_rows))
+
+
+def test_streaming_dataset(tmpdir):
+    from merlin.models.loader.streaming import StreamingDataset
+
+    def write_file(i, num_rows=25):
+        df = pd.DataFrame(
+            {"a": np.arange(i * num_rows, (i + 1) * num_rows), "b": np.zeros(num_rows)}
+        )
+        tmp_path = os.path.join(tmpdir, f"_tmp_{i}")
+        df.to_parquet(tmp_path)
+        os.rename(tmp_path, os.path.join(tmpdir, f"part_{i}.parquet"))
+
+    def all_rows(loader):
+        rows = []
+        while True:
+            try:
+                rows.append(next(loader)[0]["a"].numpy().ravel())
+            except StopIteration:
+                return np.sort(np.concatenate(rows))
+
+    write_file(0)
+    data = StreamingDataset(str(tmpdir), poll_interval=0.05, idle_timeout=2.0)
+    loader = tf_dataloader.BatchedDataset(
+        data, cont_names=["a"], label_names=["b"], batch_size=10, shuffle=True
+    )
+    timers = [threading.Timer(0.2 * i, write_file, args=(i,)) for i in range(1, 4)]
+    for timer in timers:
+        timer.start()
+
+    np.testing.assert_array_equal(all_rows(loader), np.arange(100))
+
+    # Files already consumed are not replayed
+    write_file(4)
+    np.testing.assert_array_equal(all_rows(loader), np.arange(100, 125))
+
+
+@pytest.mark.parametrize("parts_per_chunk", [1, 3])
+def test_streaming_dataset_stop(tmpdir, parts_per_chunk):
+    from merlin.models.loader.streaming import StreamingDataset
+
+    def write_file(i, num_rows=25):
+        df = pd.DataFrame(
+            {"a": np.arange(i * num_rows, (i + 1) * num_rows), "b": np.zeros(num_rows)}
+        )
+        tmp_path = os.path.join(tmpdir, f"_tmp_{i}")
+        df.to_parquet(tmp_path)
+        os.rename(tmp_path, os.path.join(tmpdir, f"part_{i}.parquet"))
+
+    for i in range(4):
+        write_file(i)
+    data = StreamingDataset(str(tmpdir), poll_interval=0.05, idle_timeout=2.0, steps_per_epoch=3)
+    loader = tf_dataloader.BatchedDataset(
+        data,
+        cont_names=["a"],
+        label_names=["b"],
+        batch_size=7,
+        shuffle=True,
+        parts_per_chunk=parts_per_chunk,
+    )
+    timers = [threading.Timer(0.1 * i, write_file, args=(i,)) for i in range(4, 8)]
+    for timer in timers:
+        timer.start()
+
+    # `len` and `iter` (called by Keras at every epoch) stop the loading thread
+    rows, step = [], 0
+    while True:
+        try:
+            rows.append(next(loader)[0]["a"].numpy().ravel())
+        except StopIteration:
+            break
+        step += 1
+        if step % 3 == 0:
+            assert len(loader) == 3
+        if step % 4 == 0:
+            iter(loader)
+
+    # every row is delivered exactly once
+    np.testing.assert_array_equal(np.sort(np.concatenate(rows)), np.arange(200))
+
+
+def test_streaming_dataset_flush(tmpdir):
+    from merlin.models.loader.streaming import StreamingDataset
+
+    df = pd.DataFrame({"a": np.arange(25), "b": np.zeros(25)})
+    df.to_parquet(os.path.join(tmpdir, "part_0.parquet"))
+    data = StreamingDataset(str(tmpdir), poll_interval=0.05, idle_timeout=30.0, flush_timeout=0.2)
+    loader = tf_dataloader.BatchedDataset(
+        data, cont_names=["a"], label_names=["b"], batch_size=10, shuffle=False, parts_per_chunk=4
+    )
+    with pytest.raises(TypeError):
+        len(loader)
+
+    # the partition doesn't wait for 3 more partitions nor for the end of the stream
+    start = time.monotonic()
+    inputs, _ = next(loader)
+    assert time.monotonic() - start < 10.0
+    np.testing.assert_array_equal(inputs["a"].numpy().ravel(), np.arange(10))
+    loader.stop()
+
+    data = StreamingDataset(str(tmpdir), steps_per_epoch=100)
+    assert len(tf_dataloader.BatchedDataset(data, cont_names=["a"], batch_size=10)) == 100
+
+
+def test_negative_sampling(tmpdir):
+    from merlin.models.loader.transforms import NegativeSampling
+
+    num_rows, num_negatives = 100, 3
+    df = pd.DataFrame(
+        {
+            "user_id": np.arange(num_rows),
+            "item_id": np.random.randint(4, size=num_rows),
+        }
+    )
+    df["item_category"] = df["item_id"] * 10
+    item_frequencies = pd.Series([50.0, 0.0, 30.0, 20.0], index=np.arange(4))
+    item_features = pd.DataFrame({"item_category": np.arange(4) * 10}, index=np.arange(4))
+    df.to_parquet(os.path.join(tmpdir, "dataset.parquet"))
+
+    sampling = NegativeSampling(
+        "item_id", item_frequencies, num_negatives=num_negatives, item_features=item_features
+    )
+    loader = tf_dataloader.BatchedDataset(
+        Dataset(str(tmpdir), engine="parquet"),
+        cat_names=["user_id", "item_id", "item_category"],
+        label_names=["click"],
+        batch_size=16,
+        shuffle=True,
+        transforms=[sampling],
+    )
+    assert len(loader) == math.ceil(num_rows * (1 + num_negatives) / 16)
+
+    inputs, labels = [], []
+    for _ in range(len(loader)):
+        X, y = next(loader)
+        inputs.append({name: value.numpy().ravel() for name, value in X.items()})
+        labels.append(y.numpy().ravel())
+    labels = np.concatenate(labels)
+    users, items, categories = [
+        np.concatenate([x[name] for x in inputs])
+        for name in ["user_id", "item_id", "item_category"]
+    ]
+
+    assert labels.sum() == num_rows
+    assert len(labels) == num_rows * (1 + num_negatives)
+    np.testing.assert_array_equal(np.bincount(users), np.full(num_rows, 1 + num_negatives))
+    # item features are gathered from the item table and items without frequency are not sampled
+    np.testing.assert_array_equal(categories, items * 10)
+    assert not np.any(items[labels == 0] == 1)
+
+
+@pytest.mark.parametrize("parts_per_chunk", [1, 2])
+def test_resume_with_negative_sampling(parts_per_chunk):
+    from merlin.models.loader.transforms import NegativeSampling
+
+    num_rows = 53
+    df = pd.DataFrame({"user_id": np.arange(num_rows), "item_id": np.arange(num_rows) % 5})
+    item_frequencies = pd.Series([5.0, 1.0, 3.0, 2.0, 7.0], index=np.arange(5))
+
+    def make_loader(seed):
+        return tf_dataloader.BatchedDataset(
+            Dataset(df, npartitions=7),
+            cat_names=["user_id", "item_id"],
+            label_names=["click"],
+            batch_size=7,
+            shuffle=True,
+            parts_per_chunk=parts_per_chunk,
+            transforms=[NegativeSampling("item_id", item_frequencies, num_negatives=2, seed=seed)],
+        )
+
+    def remaining_batches(loader):
+        batches = []
+        while True:
+            try:
+                batches.append(next(loader)[0]["item_id"].numpy().ravel())
+            except StopIteration:
+                return batches
+
+    loader = make_loader(seed=0)
+    for _ in range(5):
+        next(loader)
+    state = loader.state_dict()
+    expected = remaining_batches(loader)
+
+    # the negatives sampled after resuming don't depend on the seed of the new loader
+    remaining = remaining_batches(make_loader(seed=1).load_state_dict(state))
+    assert len(remaining) == len(expected)
+    for batch, expected_batch in zip(remaining, expected):
+        np.testing.assert_array_equal(batch, expected_batch)
+
+
+def test_sliding_window():
+    from merlin.models.loader.transforms import SlidingWindow
+
+    df = pd.DataFrame(
+        {
+            "session_id": [1, 2, 3],
+            "item_ids": [[1, 2, 3, 4, 5], [6], [7, 8]],
+            "session_length": [5, 1, 2],
+        }
+    )
+    loader = tf_dataloader.BatchedDataset(
+        Dataset(df),
+        cat_names=["session_id", "item_ids"],
+        label_names=["session_length"],
+        batch_size=10,
+        shuffle=False,
+        sparse_names=["item_ids"],
+        sparse_max={"item_ids": 3},
+        sparse_as_dense=True,
+        transforms=[SlidingWindow(window_size=3, stride=1)],
+    )
+
+    inputs, _ = next(loader)
+    np.testing.assert_array_equal(inputs["session_id"].numpy().ravel(), [1, 1, 1, 1, 3])
+    np.testing.assert_array_equal(
+        inputs["item_ids"].numpy(),
+        [[1, 2, 0], [1, 2, 3], [2, 3, 4], [3, 4, 5], [7, 8, 0]],
+    )
+
+
+def test_shared_memory_loader():
+    from merlin.models.loader.shared_memory import SharedMemoryLoader
+
+    num_rows, num_ranks = 1000, 2
+    df = pd.DataFrame({"a": np.arange(num_rows), "b": np.zeros(num_rows)})
+    service = SharedMemoryLoader(
+        Dataset(df, npartitions=4),
+        num_ranks=num_ranks,
+        batch_size=64,
+        cat_names=["a"],
+        label_names=["b"],
+        epochs=2,
+    )
+    rows = [[] for _ in range(num_ranks)]
+
+    def consume(rank):
+        consumer = service.consumer(rank)
+        for _ in range(2):
+            for X, _ in consumer:
+                rows[rank].append(X["a"].ravel().copy())
+
+    with service:
+        threads = [threading.Thread(target=consume, args=(rank,)) for rank in range(num_ranks)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # every rank gets its own shard of every epoch
+    assert abs(len(rows[0]) - len(rows[1])) <= 2
+    all_rows = np.sort(np.concatenate(rows[0] + rows[1]))
+    np.testing.assert_array_equal(all_rows, np.repeat(np.arange(num_rows), 2))
+
+
+@pytest.mark.parametrize("drop_last", [False, True])
+def test_shared_memory_loader_equal_batches(drop_last):
+    from merlin.models.loader.shared_memory import SharedMemoryLoader
+
+    num_rows, num_ranks = 1000, 3
+    df = pd.DataFrame({"a": np.arange(num_rows), "b": np.zeros(num_rows)})
+    service = SharedMemoryLoader(
+        Dataset(df, npartitions=2),
+        num_ranks=num_ranks,
+        batch_size=100,
+        shuffle=False,
+        cat_names=["a"],
+        label_names=["b"],
+        drop_last=drop_last,
+    )
+
+    with service:
+        rows = [[X["a"].ravel().copy() for X, _ in service.consumer(rank)] for rank in range(3)]
+
+    # the 10 batches are dropped to 9 or padded to 12, for the ranks to run the same steps
+    assert [len(batches) for batches in rows] == ([3] * 3 if drop_last else [4] * 3)
+    all_rows = np.concatenate(sum(rows, []))
+    assert set(all_rows) == set(range(900 if drop_last else num_rows))
+
+
+def test_shared_memory_loader_stop():
+    from merlin.models.loader.shared_memory import SharedMemoryLoader
+
+    df = pd.DataFrame({"a": np.arange(1000), "b": np.zeros(1000)})
+    service = SharedMemoryLoader(
+        Dataset(df),
+        num_ranks=1,
+        batch_size=10,
+        cat_names=["a"],
+        label_names=["b"],
+        num_slots=2,
+        epochs=10,
+    ).start()
+    consumer = service.consumer(0)
+    next(consumer)
+
+    # the service is blocked on the full ring buffer, the consumer gets the
+    # published batches then stops instead of waiting for more
+    service._stop_event.set()
+    service.join()
+    assert sum(1 for _ in consumer) == 1
+    assert list(consumer) == []
+    service.stop()
@@ -1,7 +1,12 @@
+import os
+
+import cloudpickle
+import numpy as np
 import pytest
 
 import merlin.models.tf as ml
 from merlin.models.data.synthetic import SyntheticData
+from merlin.models.tf.utils.batch_utils import ParallelEncode, ParquetSink, TFModelEncode
 
 
 @pytest.mark.parametrize("run_eagerly", [True, False])
@@ -39,3 +44,152 @@ def test_two_tower_embedding_extraction(ecommerce_data: SyntheticData):
     user_embs_ddf = user_embs.compute(scheduler="synchronous")
 
     assert len(list(user_embs_ddf.columns)) == 13 + 128
+
+
+def test_model_encode_in_process(ecommerce_data: SyntheticData, tmpdir):
+    prediction_task = ml.PredictionTasks(ecommerce_data.schema)
+    model = ml.InputBlock(ecommerce_data.schema).connect(ml.MLPBlock([64]), prediction_task)
+    model.compile(run_eagerly=True, optimizer="adam")
+    model.fit(ecommerce_data.dataset, batch_size=50, epochs=1)
+
+    save_path = str(tmpdir.join("model"))
+    model_encode = TFModelEncode(model, batch_size=10, save_path=save_path)
+    partition = ecommerce_data.dataset.to_ddf().get_partition(0).compute()
+    predictions = model_encode(partition)
+    # the live model is used, without a SavedModel round-trip
+    assert not os.path.exists(save_path)
+
+    # the model is only saved when the encoder is sent to other processes
+    worker_encode = cloudpickle.loads(cloudpickle.dumps(model_encode))
+    assert os.path.exists(save_path)
+    worker_predictions = worker_encode(partition)
+    for task in model.block.last.task_names:
+        np.testing.assert_allclose(
+            worker_predictions[task].to_numpy(), predictions[task].to_numpy(), rtol=1e-5
+        )
+
+
+def test_parallel_encode(ecommerce_data: SyntheticData):
+    prediction_task = ml.PredictionTasks(ecommerce_data.schema)
+    model = ml.InputBlock(ecommerce_data.schema).connect(ml.MLPBlock([64]), prediction_task)
+    model.compile(run_eagerly=True, optimizer="adam")
+    model.fit(ecommerce_data.dataset, batch_size=50, epochs=1)
+
+    ddf = ecommerce_data.dataset.to_ddf().repartition(npartitions=4)
+    model_encode = TFModelEncode(model, batch_size=10)
+    expected = ddf.map_partitions(model_encode).compute(scheduler="synchronous")
+
+    parallel_encode = ParallelEncode(model_encode, num_workers=3, max_pending=2)
+    predictions = parallel_encode.compute(ddf)
+    for task in model.block.last.task_names:
+        np.testing.assert_allclose(
+            predictions[task].to_numpy(), expected[task].to_numpy(), rtol=1e-5
+        )
+    assert parallel_encode.report.num_partitions == 4
+    assert parallel_encode.report.num_rows == len(expected)
+    assert parallel_encode.report.rows_per_second > 0
+
+    data = model.batch_predict(ecommerce_data.dataset, batch_size=10, num_workers=2)
+    assert len(data.to_ddf().compute()) == len(expected)
+
+
+@pytest.mark.parametrize("num_workers", [None, 2])
+def test_batch_predict_to_parquet(ecommerce_data: SyntheticData, tmpdir, num_workers):
+    prediction_task = ml.PredictionTasks(ecommerce_data.schema)
+    model = ml.InputBlock(ecommerce_data.schema).connect(ml.MLPBlock([64]), prediction_task)
+    model.compile(run_eagerly=True, optimizer="adam")
+    model.fit(ecommerce_data.dataset, batch_size=50, epochs=1)
+
+    output_path = str(tmpdir.join("predictions"))
+    data = model.batch_predict(
+        ecommerce_data.dataset, batch_size=10, num_workers=num_workers, output_path=output_path
+    )
+    expected = model.batch_predict(ecommerce_data.dataset, batch_size=10).compute()
+    predictions = data.compute()
+
+    assert any(name.endswith(".parquet") for name in os.listdir(output_path))
+    assert list(predictions.columns) == list(expected.columns)
+    for task in model.block.last.task_names:
+        np.testing.assert_allclose(
+            predictions[task].to_numpy(), expected[task].to_numpy(), rtol=1e-5
+        )
+
+
+def test_item_embeddings_to_parquet(ecommerce_data: SyntheticData, tmpdir):
+    two_tower = ml.TwoTowerBlock(ecommerce_data.schema, query_tower=ml.MLPBlock([64, 128]))
+    model = two_tower.connect(
+        ml.ItemRetrievalTask(ecommerce_data.schema, target_name="click", metrics=[])
+    )
+    model.compile(run_eagerly=True, optimizer="adam")
+    model.fit(ecommerce_data.dataset, batch_size=50, epochs=1)
+
+    output_path = str(tmpdir.join("item_embeddings"))
+    item_embs = model.item_embeddings(
+        ecommerce_data.dataset, batch_size=10, output_path=output_path
+    )
+    item_embs_df = item_embs.compute()
+
+    assert len(list(item_embs_df.columns)) == 5 + 1
+    expected = model.item_embeddings(ecommerce_data.dataset, batch_size=10).compute()
+    np.testing.assert_allclose(
+        np.stack(item_embs_df["embedding"].to_numpy()),
+        expected[[str(i) for i in range(128)]].to_numpy(),
+        rtol=1e-5,
+    )
+
+
+@pytest.mark.parametrize("shuffled", [False, True])
+def test_unique_rows_by_id(shuffled):
+    import dask.dataframe as dd
+    import pandas as pd
+
+    from merlin.models.utils.dataset import unique_rows_by_id
+
+    ids = np.repeat(np.arange(100), 2)
+    if shuffled:
+        ids = np.random.RandomState(0).permutation(ids)
+    features = np.arange(200, dtype=np.float64)
+    # the first non-null value of every column is kept, as with groupby("item_id").first()
+    features[::3] = np.nan
+    df = pd.DataFrame({"item_id": ids, "feature": features})
+    ddf = dd.from_pandas(df, npartitions=4, sort=False)
+
+    unique = unique_rows_by_id(ddf, "item_id").compute()
+    expected = df.groupby("item_id").agg("first").reset_index()
+
+    assert list(unique.columns) == list(expected.columns)
+    # the rows are not sorted by id
+    unique = unique.sort_values("item_id")
+    np.testing.assert_array_equal(unique["item_id"].to_numpy(), expected["item_id"].to_numpy())
+    np.testing.assert_array_equal(unique["feature"].to_numpy(), expected["feature"].to_numpy())
+
+
+def test_parquet_sink_with_dask(ecommerce_data: SyntheticData, tmpdir, monkeypatch):
+    prediction_task = ml.PredictionTasks(ecommerce_data.schema)
+    model = ml.InputBlock(ecommerce_data.schema).connect(ml.MLPBlock([64]), prediction_task)
+    model.compile(run_eagerly=True, optimizer="adam")
+    model.fit(ecommerce_data.dataset, batch_size=50, epochs=1)
+
+    saved = []
+    save_model = TFModelEncode._save_model
+    monkeypatch.setattr(
+        TFModelEncode, "_save_model", lambda self: saved.append(self) or save_model(self)
+    )
+
+    output_path = str(tmpdir.join("predictions"))
+    sink = ParquetSink(TFModelEncode(model, batch_size=10), output_path)
+    ddf = ecommerce_data.dataset.to_ddf().repartition(npartitions=2)
+    predictions = sink.write(ddf).compute()
+    assert len(predictions) == len(ddf)
+    assert os.path.exists(os.path.join(output_path, "part.1.parquet"))
+
+    # the files of the previous write are replaced
+    predictions = sink.write(ddf.repartition(npartitions=1)).compute()
+    assert len(predictions) == len(ddf)
+    assert not os.path.exists(os.path.join(output_path, "part.1.parquet"))
+
+    empty = sink.write(ddf[ddf["click"] < 0]).compute()
+    assert len(empty) == 0
+
+    # the model is never saved, as the tasks are run in-process
+    assert saved == []
@@ -0,0 +1,46 @@
+import asyncio
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+import merlin.models.tf as ml
+from merlin.models.tf.utils.serving_utils import MicroBatcher
+
+
+def test_micro_batcher_coalesces_requests():
+    index = ml.TopKIndexBlock(k=5, values=tf.random.normal((100, 8)), ids=tf.range(100))
+    batch_sizes = []
+
+    def recommend(features):
+        batch_sizes.append(int(features["query"].shape[0]))
+        return index(features["query"], k=5)
+
+    queries = np.random.RandomState(0).normal(size=(40, 8)).astype(np.float32)
+
+    async def serve():
+        async with MicroBatcher(recommend, max_batch_size=16, max_latency_ms=50) as batcher:
+            outputs = await asyncio.gather(
+                *[batcher.predict({"query": queries[i : i + 1]}) for i in range(len(queries))]
+            )
+        return outputs, batcher.stats
+
+    outputs, stats = asyncio.run(serve())
+
+    _, expected_ids = index(tf.constant(queries), k=5)
+    np.testing.assert_array_equal(np.concatenate([ids for _, ids in outputs]), expected_ids)
+    assert max(batch_sizes) == 16
+    assert stats.num_requests == 40
+    assert stats.num_batches == len(batch_sizes) < 40
+
+
+def test_micro_batcher_propagates_errors():
+    def predict(features):
+        raise ValueError("invalid features")
+
+    async def serve():
+        async with MicroBatcher(predict) as batcher:
+            await batcher.predict({"query": np.zeros((1, 8))})
+
+    with pytest.raises(ValueError, match="invalid features"):
+        asyncio.run(serve())